@@ -2,39 +2,115 @@ import argparse
 import logging
 import os
 import sys
+import threading
 import yaml
+from uuid import uuid4
 from concurrent.futures import ThreadPoolExecutor
-from swarmci.util import get_logger
+from swarmci.util import get_logger, parse_duration
+from swarmci.sharding import get_parallelism, split_job
+from swarmci.journal import Journal, input_hash
+from swarmci.scheduler import FairShareExecutor
+from swarmci.streams import compile_patterns
+from swarmci.events import stop_event_monitors
+from swarmci.profiling import Profiler, DEFAULT_INTERVAL
+from swarmci import metrics
+from swarmci.sync import WorkspaceSync, HashCache
+from swarmci import simulate, gc
+from swarmci.backends import BACKENDS, DEFAULT_URL, DockerBackend, create_backend
 from swarmci.errors import SwarmCIError, TaskFailedError
-from swarmci.task import TaskType, TaskFactory
+from swarmci.task import TaskType, TaskFactory, LazyTasks
 from swarmci.version import __version__
 
 logger = get_logger(__name__)
 
+MAX_WORKERS = 25
 
-def build_tasks_hierarchy(swarmci_config, task_factory):
+
+def validate_command(cmd):
+    """raises a SwarmCIError if a command from the .swarmci file is invalid, without creating its task"""
+    if type(cmd) is not dict:
+        return
+
+    if cmd.get('parallel'):
+        if not cmd.get('commands'):
+            raise SwarmCIError('A parallel command group should have a list of "commands" in the .swarmci file.')
+        for member in cmd['commands']:
+            validate_command(member)
+        return
+
+    try:
+        parse_duration(cmd.get('timeout'))
+    except ValueError as exc:
+        raise SwarmCIError('The timeout of command [{}] is invalid: {}'.format(cmd.get('cmd'), exc))
+
+
+def build_command_task(cmd, task_factory, buffered=False):
+    """:param cmd: a command from the .swarmci file, which build_job_task has already validated"""
+    if type(cmd) is not dict:
+        return task_factory.create(TaskType.COMMAND, cmd=cmd, buffered=buffered)
+
+    if cmd.get('parallel'):
+        members = [build_command_task(member, task_factory, buffered=True) for member in cmd['commands']]
+        return task_factory.create(TaskType.GROUP, commands=members)
+
+    return task_factory.create(TaskType.COMMAND, cmd=cmd['cmd'], timeout=cmd.get('timeout'), buffered=buffered)
+
+
+def build_job_task(job, task_factory):
+    """the job's command tasks are only created when the job runs"""
+    for cmd in job['commands']:
+        validate_command(cmd)
+    compile_patterns(job.get('fail_on_output'))
+
+    commands = LazyTasks(job['commands'], lambda cmd: build_command_task(cmd, task_factory))
+    return task_factory.create(TaskType.JOB, job=job, commands=commands)
+
+
+def build_tasks_hierarchy(swarmci_config, task_factory, build_id=None, thread_pool_executor=None):
+    """
+    :param thread_pool_executor: runs the jobs of each stage. defaults to a pool of MAX_WORKERS for this build alone
+    """
     stages_from_yaml = swarmci_config.pop('stages', None)
     if stages_from_yaml is None:
         raise SwarmCIError('Did not find "stages" key in the .swarmci file.')
     elif type(stages_from_yaml) is not list:
         raise SwarmCIError('The value of the "stages" key should be a list in the .swarmci file.')
 
-    thread_pool_executor = ThreadPoolExecutor(max_workers=25)
+    if thread_pool_executor is None:
+        thread_pool_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        metrics.set_max_workers(MAX_WORKERS)
 
     stage_tasks = []
+    originals = {}
+    duplicates = 0
     for stage in stages_from_yaml:
         job_tasks = []
         for job in stage['jobs']:
-            commands = []
-            for cmd in job['commands']:
-                commands.append(task_factory.create(TaskType.COMMAND, cmd=cmd))
+            fingerprint = input_hash(job) if job.get('dedupe', True) else None
+            if fingerprint in originals:
+                original = originals[fingerprint]
+                logger.info('job %s is identical to job %s, it will only run once', job['name'], original.name)
+                job_tasks.append(task_factory.create(TaskType.JOB, job=job, commands=[], duplicate_of=original))
+                duplicates += 1
+                continue
+
+            if get_parallelism(job) > 1:
+                shards = [(shard_job, build_job_task(shard_job, task_factory)) for shard_job in split_job(job)]
+                job_task = task_factory.create(TaskType.JOB, job=job, commands=[], shards=shards)
+            else:
+                job_task = build_job_task(job, task_factory)
 
-            job_tasks.append(task_factory.create(TaskType.JOB, job=job, commands=commands))
+            if fingerprint:
+                originals[fingerprint] = job_task
+            job_tasks.append(job_task)
 
         stage_tasks.append(
             task_factory.create(TaskType.STAGE, stage=stage, jobs=job_tasks, thread_pool_executor=thread_pool_executor))
 
-    return task_factory.create(TaskType.BUILD, stages=stage_tasks)
+    if duplicates:
+        logger.info('deduplicated %s jobs which are identical to an earlier job in the build', duplicates)
+
+    return task_factory.create(TaskType.BUILD, stages=stage_tasks, build_id=build_id)
 
 
 def parse_args(args):
@@ -46,11 +122,152 @@ def parse_args(args):
     parser.add_argument('--version', action='version',
                         version='SwarmCI {}'.format(__version__))
 
-    parser.add_argument('--file', action='store', default='.swarmci')
+    parser.add_argument('command', nargs='?', choices=['build', 'simulate', 'gc'], default='build',
+                        help=('run the build (default), simulate it to predict its wall time, '
+                              'or remove the containers left behind by killed builds'))
+
+    parser.add_argument('--file', action='append',
+                        help=('the .swarmci file to build, defaults to .swarmci. give it more than once to run '
+                              'several builds, which share the workers by the "weight" key of each file'))
+
+    parser.add_argument('--docker-url', action='store', default=DEFAULT_URL,
+                        help='the swarm manager to run the jobs on, and to remove orphaned containers from')
+
+    parser.add_argument('--backend', action='store', choices=BACKENDS, default='docker',
+                        help=('where to run the job containers. local runs each job in a scratch directory on '
+                              'this host, without images or isolation, for fast local runs and tests'))
+
+    parser.add_argument('--lease-dir', action='store', default=gc.LEASE_DIR,
+                        help=('directory of the heartbeat files which keep the containers of running builds from '
+                              'being collected. every build and gc on a host must use the same one'))
+
+    parser.add_argument('--journal-dir', action='store', default='.swarmci-journal',
+                        help='directory where the state of each build is journaled')
+
+    parser.add_argument('--resume', action='append', metavar='BUILD_ID',
+                        help=('skip the jobs which succeeded with unchanged inputs in a previous build. '
+                              'with several --file, give it once per file, in the same order'))
+
+    parser.add_argument('--profile', action='store', metavar='PATH',
+                        help=('profile the driver, writing pstats to PATH, collapsed stacks to PATH.collapsed '
+                              'and lock wait times to PATH.waits'))
+
+    parser.add_argument('--profile-interval', action='store', type=float, default=DEFAULT_INTERVAL,
+                        help='seconds between profiler samples')
+
+    parser.add_argument('--metrics-textfile', action='store', metavar='PATH',
+                        help='write prometheus metrics to PATH while the build runs')
+
+    parser.add_argument('--metrics-interval', action='store', type=float, default=15.0,
+                        help='seconds between writes of the metrics textfile')
+
+    parser.add_argument('--metrics-port', action='store', type=int,
+                        help='serve prometheus metrics on this local port while the build runs')
+
+    simulation = parser.add_argument_group('simulate')
+
+    simulation.add_argument('--runtimes', action='store', metavar='PATH',
+                            help='a json file of recorded job runtimes, job name -> seconds')
+
+    simulation.add_argument('--runtimes-from', action='store', metavar='BUILD_ID',
+                            help='use the job runtimes journaled by a previous build')
+
+    simulation.add_argument('--default-runtime', action='store', type=float, default=simulate.DEFAULT_RUNTIME,
+                            help='seconds assumed for jobs without a recorded runtime')
+
+    simulation.add_argument('--workers', action='store', type=int, default=MAX_WORKERS,
+                            help='executor workers')
+
+    simulation.add_argument('--nodes', action='store', type=int, default=1,
+                            help='swarm nodes')
+
+    simulation.add_argument('--slots-per-node', action='store', type=int, default=MAX_WORKERS,
+                            help='containers each node can run at the same time')
+
+    simulation.add_argument('--pull-time', action='store', type=float, default=0.0,
+                            help='seconds to pull an image onto a node which does not have it')
+
+    simulation.add_argument('--container-overhead', action='store', type=float, default=0.0,
+                            help='seconds to create, start and remove a container')
+
+    simulation.add_argument('--sweep-workers', action='store', type=int_list, metavar='N,N,...',
+                            help='executor worker counts to sweep')
+
+    simulation.add_argument('--sweep-nodes', action='store', type=int_list, metavar='N,N,...',
+                            help='node counts to sweep')
 
     return parser.parse_args(args)
 
 
+def int_list(value):
+    try:
+        values = [int(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} should be a comma separated list of integers'.format(value))
+
+    if not values or min(values) < 1:
+        raise argparse.ArgumentTypeError('{} should be a comma separated list of positive integers'.format(value))
+    return values
+
+
+def simulate_build(swarmci_config, args):
+    if min(args.workers, args.nodes, args.slots_per_node) < 1:
+        raise SwarmCIError('--workers, --nodes and --slots-per-node should be at least 1.')
+
+    runtimes = simulate.load_runtimes(args.runtimes, os.path.abspath(args.journal_dir), args.runtimes_from)
+    plan, missing = simulate.build_plan(swarmci_config, runtimes, args.default_runtime)
+
+    model = simulate.CapacityModel(max_workers=args.workers, nodes=args.nodes, slots_per_node=args.slots_per_node,
+                                   pull_time=args.pull_time, container_overhead=args.container_overhead)
+    result = simulate.simulate(plan, model)
+
+    sweep_results = None
+    if args.sweep_workers or args.sweep_nodes:
+        sweep_results = simulate.sweep(plan, model, args.sweep_workers, args.sweep_nodes)
+
+    for line in simulate.format_report(result, sweep_results, missing):
+        logger.info(line)
+
+    return result
+
+
+def collect_orphans(docker_url, exclude_build_ids=(), lease_dir=gc.LEASE_DIR):
+    """removes the containers of builds whose driver stopped renewing their lease"""
+    try:
+        return gc.collect(DockerBackend(base_url=docker_url), exclude_build_ids=exclude_build_ids,
+                          lease_dir=lease_dir)
+    except Exception as exc:
+        logger.warning('failed to collect orphaned containers: %s', exc)
+        return []
+
+
+def load_config(swarmci_file):
+    logger.debug('opening %s', swarmci_file)
+    with open(swarmci_file, 'r') as f:
+        return yaml.load(f)
+
+
+def get_weight(swarmci_config):
+    weight = swarmci_config.pop('weight', 1)
+    if type(weight) not in (int, float) or weight <= 0:
+        raise SwarmCIError('The value of the "weight" key should be a positive number in the .swarmci file.')
+    return weight
+
+
+def run_builds(build_tasks):
+    """executes the builds concurrently, each on its own thread, returning once they have all ended"""
+    if len(build_tasks) == 1:
+        build_tasks[0].execute()
+        return
+
+    threads = [threading.Thread(target=build_task.execute, name='build_{}'.format(i))
+               for i, build_task in enumerate(build_tasks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
 def main(args):
     args = parse_args(args)
     logging.basicConfig(
@@ -58,26 +275,96 @@ def main(args):
         level=logging.DEBUG,
         format="%(asctime)s (%(threadName)-10s) [%(levelname)8s] - %(message)s")
 
-    swarmci_file = args.file if args.file else os.path.join(os.getcwd(), '.swarmci')
+    swarmci_files = [os.path.abspath(f) for f in args.file or [os.path.join(os.getcwd(), '.swarmci')]]
 
-    swarmci_file = os.path.abspath(swarmci_file)
+    logging.getLogger('requests').setLevel(logging.WARNING)
 
-    if not swarmci_file:
-        msg = 'must provide either --file or --demo'
-        logger.error(msg)
-        raise Exception(msg)
+    if args.command == 'gc':
+        collect_orphans(args.docker_url, lease_dir=args.lease_dir)
+        return
 
-    logging.getLogger('requests').setLevel(logging.WARNING)
+    swarmci_configs = [load_config(swarmci_file) for swarmci_file in swarmci_files]
 
-    logger.debug('opening %s', swarmci_file)
-    with open(swarmci_file, 'r') as f:
-        swarmci_config = yaml.load(f)
+    if args.command == 'simulate':
+        for swarmci_file, swarmci_config in zip(swarmci_files, swarmci_configs):
+            logger.info('simulating %s', swarmci_file)
+            simulate_build(swarmci_config, args)
+        return
+
+    resume = args.resume or [None] * len(swarmci_files)
+    if len(resume) != len(swarmci_files):
+        raise SwarmCIError('--resume should be given once for each --file.')
+
+    journal_dir = os.path.abspath(args.journal_dir)
+    workspace_sync = WorkspaceSync(HashCache(os.path.join(journal_dir, 'hashes.json')))
+
+    backend = create_backend(args.backend, args.docker_url)
+    # each job runner keeps a docker client of its own, whose connection pool is sized for the calls of one job
+    shared_backend = None if isinstance(backend, DockerBackend) else backend
+    executor = FairShareExecutor(MAX_WORKERS)
+    metrics.set_max_workers(MAX_WORKERS)
+
+    builds = []
+    registries = []
+    for swarmci_file, swarmci_config, resume_from in zip(swarmci_files, swarmci_configs, resume):
+        build_id = str(uuid4())
+        journal = Journal(journal_dir, build_id, resume_from=resume_from)
+        registry = gc.ContainerRegistry(build_id, lease_dir=args.lease_dir, lease=backend.supports_gc)
+        registries.append(registry)
+        task_factory = TaskFactory(journal=journal, workspace_sync=workspace_sync,
+                                   log_dir=os.path.join(journal_dir, 'logs', build_id),
+                                   backend=shared_backend, registry=registry, docker_url=args.docker_url)
+        build_queue = executor.queue(swarmci_file, get_weight(swarmci_config))
+        build_task = build_tasks_hierarchy(swarmci_config, task_factory, build_id=build_id,
+                                           thread_pool_executor=build_queue)
+        builds.append((swarmci_file, journal, build_task))
+
+    gc.install_signal_handlers(registries)
+    if backend.supports_gc:
+        build_ids = {registry.build_id for registry in registries}
+        threading.Thread(target=collect_orphans, args=(args.docker_url, build_ids, args.lease_dir), name='gc',
+                         daemon=True).start()
+
+    metrics_server = metrics.serve(args.metrics_port) if args.metrics_port else None
+    metrics_writer = None
+    if args.metrics_textfile:
+        metrics_writer = metrics.TextfileWriter(args.metrics_textfile, args.metrics_interval)
+        metrics_writer.start()
+
+    for swarmci_file, journal, build_task in builds:
+        logger.info('starting build %s of %s, journaling to %s', build_task.name, swarmci_file, journal.path)
+    build_tasks = [build_task for _, _, build_task in builds]
+    try:
+        if args.profile:
+            with Profiler(args.profile_interval) as profiler:
+                run_builds(build_tasks)
+            profiler.write(args.profile)
+            logger.info('wrote profile of %s samples to %s', profiler.samples, args.profile)
+            for line in profiler.wait_report():
+                logger.info(line)
+        else:
+            run_builds(build_tasks)
+    finally:
+        executor.shutdown(wait=False)
+        for registry in registries:
+            registry.stop()
+        stop_event_monitors()
+        workspace_sync.close()
+        if metrics_writer:
+            metrics_writer.stop()
+        if metrics_server:
+            metrics_server.shutdown()
 
-    build_task = build_tasks_hierarchy(swarmci_config, TaskFactory())
+    if len(builds) > 1:
+        for swarmci_file, _, build_task in builds:
+            minutes, seconds = divmod(build_task.runtime, 60.0)
+            logger.info('%s - build %s %s - %s min %.2f sec', swarmci_file, build_task.name, build_task.outcome,
+                        int(minutes), seconds)
 
-    logger.debug('starting build')
-    build_task.execute()
-    if build_task.successful:
+    failed = [build_task for _, _, build_task in builds if not build_task.successful]
+    if not failed:
         logger.info('all stages completed successfully!')
     else:
+        logger.info('to rerun from the first failure, use %s', ' '.join('--resume {}'.format(build_task.name)
+                                                                       for _, _, build_task in builds))
         raise TaskFailedError('some stages did not complete successfully. :(')
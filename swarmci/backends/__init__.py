@@ -0,0 +1,24 @@
+"""
+The backends which run job containers. A backend provides the container lifecycle, exec, archive transfer and
+stats calls of the docker api, with the same signatures as docker-py, which the Container class is written against.
+"""
+from swarmci.backends.base import Backend
+from swarmci.backends.docker import DockerBackend, DEFAULT_URL
+from swarmci.backends.local import LocalBackend
+
+__all__ = ['Backend', 'DockerBackend', 'LocalBackend', 'BACKENDS', 'DEFAULT_URL', 'create_backend']
+
+BACKENDS = ['docker', 'local']
+
+
+def create_backend(name, url=DEFAULT_URL):
+    """
+    :param name: one of BACKENDS
+    :param url: the docker api url, for the docker backend
+    """
+    if name == 'docker':
+        return DockerBackend(base_url=url)
+    elif name == 'local':
+        return LocalBackend()
+
+    raise ValueError('Unknown backend {}'.format(name))
@@ -0,0 +1,57 @@
+"""
+The interface of the backends which run job containers
+"""
+
+
+class Backend(object):
+    """
+    The calls a backend provides. Results have the shape of the corresponding docker api responses.
+    """
+    name = None
+
+    # whether containers can be followed through an event stream, and listed to collect orphans
+    supports_events = False
+    supports_gc = False
+
+    def create_host_config(self, **kwargs):
+        raise NotImplementedError
+
+    def create_container(self, image, command=None, name=None, environment=None, host_config=None, labels=None):
+        """:return: a dict with the container's 'Id'"""
+        raise NotImplementedError
+
+    def start(self, container):
+        raise NotImplementedError
+
+    def stop(self, container):
+        raise NotImplementedError
+
+    def kill(self, container):
+        raise NotImplementedError
+
+    def remove_container(self, container, v=False, force=False):
+        raise NotImplementedError
+
+    def exec_create(self, container, cmd, tty=False):
+        """:return: a dict with the exec's 'Id'"""
+        raise NotImplementedError
+
+    def exec_start(self, exec_id, socket=False):
+        """
+        :return: a socket of the exec's output, multiplexed into stdout and stderr frames unless it has a tty
+        """
+        raise NotImplementedError
+
+    def exec_inspect(self, exec_id):
+        """:return: a dict with the exec's 'ExitCode'"""
+        raise NotImplementedError
+
+    def put_archive(self, container, path, data):
+        raise NotImplementedError
+
+    def get_archive(self, container, path):
+        """:return: a tuple of a stream of the tar of path, and its stat. raises NotFound if it does not exist"""
+        raise NotImplementedError
+
+    def stats(self, container, stream=False):
+        raise NotImplementedError
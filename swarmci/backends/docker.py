@@ -0,0 +1,22 @@
+"""
+The docker backend, a docker-py client
+"""
+from docker import Client as DockerClient
+from swarmci.backends.base import Backend
+
+DEFAULT_URL = ':4000'
+DEFAULT_API_VERSION = '1.24'
+
+
+class DockerBackend(DockerClient, Backend):
+    """
+    Runs containers through the docker api, on a swarm manager or a single daemon
+    """
+    name = 'docker'
+    supports_events = True
+    supports_gc = True
+
+    def __init__(self, base_url=DEFAULT_URL, version=DEFAULT_API_VERSION, **kwargs):
+        super(DockerBackend, self).__init__(base_url=base_url, version=version, **kwargs)
+        # as given, docker-py rewrites base_url into the url it connects to
+        self.docker_url = base_url
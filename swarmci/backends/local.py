@@ -0,0 +1,263 @@
+"""
+A backend which runs each job's "container" as a scratch directory on the driver's host, and its execs as
+subprocesses in that directory. It needs no daemon, for fast local runs and repeatable performance tests of the
+driver. Images, resources and isolation are ignored. Commands run in the scratch directory, and archive calls only
+take paths relative to it: absolute paths would be the host's, where a workspace must never be synced to.
+"""
+import os
+import selectors
+import shlex
+import shutil
+import signal
+import struct
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from io import BytesIO
+from socket import socketpair
+from itertools import count
+from uuid import uuid4
+from requests.models import Response
+from docker.errors import NotFound, APIError
+from swarmci.util import get_logger
+from swarmci.backends.base import Backend
+from swarmci.streams import STDOUT, STDERR, READ_SIZE
+
+logger = get_logger(__name__)
+
+
+def _response(status_code, reason, message):
+    response = Response()
+    response.status_code = status_code
+    response.reason = reason
+    response._content = message.encode('utf-8')
+    return response
+
+
+def _not_found(message):
+    return NotFound(message, response=_response(404, 'Not Found', message))
+
+
+def _bad_request(message):
+    return APIError(message, response=_response(400, 'Bad Request', message))
+
+
+class _LocalContainer(object):
+    def __init__(self, cid, name, root, environment, labels):
+        self.id = cid
+        self.name = name
+        self.root = root
+        self.environment = environment
+        self.labels = labels
+        self.running = False
+        self.processes = set()
+        self.cpu_ns = 0
+        self.sampled_at = None
+
+
+class _LocalExec(object):
+    def __init__(self, eid, container, cmd, tty):
+        self.id = eid
+        self.container = container
+        self.cmd = cmd
+        self.tty = tty
+        self.process = None
+
+
+class LocalBackend(Backend):
+    """
+    :param scratch_dir: where the scratch directories are created, defaults to the system's temp directory
+    """
+    name = 'local'
+
+    def __init__(self, scratch_dir=None):
+        self.scratch_dir = scratch_dir
+        self._containers = {}
+        self._execs = {}
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def _container(self, container):
+        with self._lock:
+            if container not in self._containers:
+                raise _not_found('No such container: {}'.format(container))
+            return self._containers[container]
+
+    def path(self, container, path):
+        """
+        maps a path in the container to the host, as the commands of the container see it.
+        raises an APIError for paths outside of the scratch directory, such as absolute ones.
+        """
+        root = self._container(container).root
+        resolved = os.path.normpath(os.path.join(root, path))
+        if os.path.isabs(path) or os.path.commonpath([root, resolved]) != root:
+            raise _bad_request('the local backend only takes paths relative to the scratch directory, '
+                               'not {}'.format(path))
+        return resolved
+
+    def create_host_config(self, **kwargs):
+        return dict(kwargs)
+
+    def create_container(self, image, command=None, name=None, environment=None, host_config=None, labels=None):
+        cid = uuid4().hex
+        root = os.path.realpath(tempfile.mkdtemp(prefix='swarmci-local-', dir=self.scratch_dir))
+        logger.debug('created local container %s in %s for image %s', cid[0:12], root, image)
+        with self._lock:
+            self._containers[cid] = _LocalContainer(cid, name or cid, root, dict(environment or {}),
+                                                    dict(labels or {}))
+        return {'Id': cid}
+
+    def start(self, container):
+        self._container(container).running = True
+
+    def kill(self, container):
+        """kills the process group of every exec running in the container"""
+        cn = self._container(container)
+        cn.running = False
+        with self._lock:
+            processes = list(cn.processes)
+        for process in processes:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def stop(self, container):
+        self.kill(container)
+
+    def remove_container(self, container, v=False, force=False):
+        self.kill(container)
+        with self._lock:
+            cn = self._containers.pop(container)
+            self._execs = {eid: e for eid, e in self._execs.items() if e.container is not cn}
+        shutil.rmtree(cn.root, ignore_errors=True)
+
+    def exec_create(self, container, cmd, tty=False):
+        cn = self._container(container)
+        eid = 'local-exec-{}'.format(next(self._ids))
+        with self._lock:
+            self._execs[eid] = _LocalExec(eid, cn, shlex.split(cmd) if isinstance(cmd, str) else list(cmd), tty)
+        return {'Id': eid}
+
+    def exec_start(self, exec_id, socket=False):
+        """
+        starts the exec as a subprocess in its own process group.
+        with a tty, stdout and stderr are merged and returned as a pipe. otherwise, they are multiplexed into
+        frames on a socket, like the docker api does.
+        """
+        e = self._execs[exec_id]
+        cn = e.container
+        if not cn.running:
+            raise RuntimeError('container {} is not running'.format(cn.name))
+
+        env = dict(os.environ)
+        env.update({k: str(v) for k, v in cn.environment.items()})
+        env['SWARMCI_CONTAINER_ROOT'] = cn.root
+
+        e.process = subprocess.Popen(e.cmd, cwd=cn.root, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT if e.tty else subprocess.PIPE, start_new_session=True)
+        with self._lock:
+            cn.processes.add(e.process)
+
+        if e.tty:
+            return e.process.stdout
+
+        driver_end, backend_end = socketpair()
+        threading.Thread(target=_multiplex, args=(e.process, backend_end), name='local-exec', daemon=True).start()
+        return driver_end
+
+    def exec_inspect(self, exec_id):
+        e = self._execs[exec_id]
+        exit_code = e.process.wait()
+        with self._lock:
+            e.container.processes.discard(e.process)
+        return {'ID': exec_id, 'Running': False, 'ExitCode': exit_code}
+
+    def put_archive(self, container, path, data):
+        dest = self.path(container, path)
+        os.makedirs(dest, exist_ok=True)
+        fileobj = BytesIO(data) if isinstance(data, bytes) else data
+        with tarfile.open(mode='r|', fileobj=fileobj) as t:
+            # refuse members which would be extracted outside of dest, where the tarfile module supports it
+            t.extractall(dest, **({'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}))
+        return True
+
+    def get_archive(self, container, path):
+        src = self.path(container, path)
+        if not os.path.lexists(src):
+            raise _not_found('Could not find the file {} in container {}'.format(path, container))
+
+        data = BytesIO()
+        with tarfile.open(mode='w', fileobj=data) as t:
+            t.add(src, arcname=os.path.basename(src.rstrip('/')))
+        data.seek(0)
+
+        st = os.lstat(src)
+        return data, {'name': os.path.basename(src), 'size': st.st_size, 'mode': st.st_mode}
+
+    def stats(self, container, stream=False):
+        """the memory and cpu time of the running execs, read from /proc"""
+        cn = self._container(container)
+        with self._lock:
+            pids = [p.pid for p in cn.processes if p.poll() is None]
+
+        memory = cpu_ns = 0
+        for pid in pids:
+            memory += _rss(pid)
+            cpu_ns += _cpu_ns(pid)
+
+        now_ns = int(time.monotonic() * 10 ** 9)
+        precpu = {'cpu_usage': {'total_usage': cn.cpu_ns}, 'system_cpu_usage': cn.sampled_at or now_ns}
+        cn.cpu_ns = max(cn.cpu_ns, cpu_ns)
+        cn.sampled_at = now_ns
+        return {
+            'cpu_stats': {'cpu_usage': {'total_usage': cn.cpu_ns}, 'system_cpu_usage': now_ns, 'online_cpus': 1},
+            'precpu_stats': precpu,
+            'memory_stats': {'usage': memory}
+        }
+
+
+def _multiplex(process, sock):
+    """writes the output of process to sock in docker's frame format, closing sock when the process ends"""
+    streams = {process.stdout.fileno(): STDOUT, process.stderr.fileno(): STDERR}
+    selector = selectors.DefaultSelector()
+    for fd in streams:
+        selector.register(fd, selectors.EVENT_READ)
+
+    try:
+        while streams:
+            for key, _ in selector.select():
+                data = os.read(key.fd, READ_SIZE)
+                if not data:
+                    selector.unregister(key.fd)
+                    del streams[key.fd]
+                    continue
+                sock.sendall(struct.pack('>BxxxL', streams[key.fd], len(data)) + data)
+    except OSError:
+        # the driver closed its end, such as when the container was aborted
+        pass
+    finally:
+        selector.close()
+        process.stdout.close()
+        process.stderr.close()
+        sock.close()
+
+
+def _rss(pid):
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _cpu_ns(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+        return ticks * 10 ** 9 // os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return 0
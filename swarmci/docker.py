@@ -1,34 +1,89 @@
+import logging
+import socket
 import tarfile
 from io import BytesIO
+from contextlib import contextmanager
 import os
+import threading
 from uuid import uuid4
+from docker.errors import NotFound
+from swarmci import metrics
 from swarmci.util import get_logger
-from swarmci.errors import DockerCommandFailedError
+from swarmci.stats import ResourceSampler, get_limits, summarize
+from swarmci.streams import iter_lines, iter_raw_lines, read_socket, decode
+from swarmci.watchdog import get_watchdog
+from swarmci.errors import DockerCommandFailedError, TaskTimeoutError, OutputMatchedError, ContainerAbortedError
 
 logger = get_logger(__name__)
 
 
+def read_file(docker, container, path):
+    """
+    reads a single file from a container
+    :return: the file content as bytes, or None if it does not exist
+    """
+    try:
+        stream, _ = docker.get_archive(container, path)
+    except NotFound:
+        return None
+
+    with tarfile.open(mode='r|', fileobj=stream) as t:
+        for member in t:
+            if member.isfile():
+                return t.extractfile(member).read()
+
+    return None
+
+
 class Container(object):
     """
     A class representing a running container
     """
-    def __init__(self, image, host_config, docker, name=None, env=None, remove=True):
+    def __init__(self, image, host_config, docker, name=None, env=None, remove=True, stats_interval=None,
+                 tty=True, watchdog=None, registry=None, monitor=None, fail_on_output=None, log_archive=None):
         self.image = image
         self.host_config = host_config
         self.docker = docker
         self.name = name or 'swarmci_' + str(uuid4())
         self.env = env
         self.remove = remove
+        self.tty = tty
+        self.watchdog = watchdog or get_watchdog()
+        self.registry = registry
+        self.monitor = monitor
+        self.fail_on_output = fail_on_output
+        self.log_archive = log_archive
+        self.abort_error = None
+        self.abort_cause = None
+        self.closed = False
+        self._close_lock = threading.Lock()
+        self._sockets = set()
+        self._sockets_lock = threading.Lock()
 
         cmd = '/bin/sh -c "while true; do sleep 1000; done"'
 
-        self.id = self.docker.create_container(image=image,
-                                               host_config=host_config,
-                                               name=name,
-                                               environment=env or {},
-                                               command=cmd)['Id']
+        with metrics.CONTAINER_OPERATION_SECONDS.time(operation='create'):
+            self.id = self.docker.create_container(image=image,
+                                                   host_config=host_config,
+                                                   name=name,
+                                                   environment=env or {},
+                                                   labels=registry.labels() if registry else None,
+                                                   command=cmd)['Id']
+
+        if self.monitor:
+            self.monitor.watch(self)
 
-        self.docker.start(self.id)
+        with metrics.CONTAINER_OPERATION_SECONDS.time(operation='start'):
+            self.docker.start(self.id)
+        metrics.ACTIVE_CONTAINERS.inc()
+
+        self.sampler = None
+        if stats_interval:
+            self.sampler = ResourceSampler(self.docker, self.id, stats_interval)
+            self.sampler.start()
+
+        if self.registry:
+            self.registry.add(self)
 
     def __enter__(self):
         return self
@@ -37,13 +92,77 @@ class Container(object):
         self.close()
 
     def close(self):
-        """stop and optionally remove the container"""
-        if self.remove:
-            logger.debug('removing container!')
-            self.docker.remove_container(container=self.id, v=True, force=True)
-        else:
-            logger.debug('stopping container!')
-            self.docker.stop(container=self.id)
+        """stop and optionally remove the container, once"""
+        with self._close_lock:
+            if self.closed:
+                return
+            self.closed = True
+
+        if self.registry:
+            self.registry.discard(self)
+        if self.monitor:
+            self.monitor.unwatch(self)
+        if self.sampler:
+            self.sampler.stop()
+
+        try:
+            if self.remove:
+                logger.debug('removing container!')
+                with metrics.CONTAINER_OPERATION_SECONDS.time(operation='remove'):
+                    self.docker.remove_container(container=self.id, v=True, force=True)
+            else:
+                logger.debug('stopping container!')
+                with metrics.CONTAINER_OPERATION_SECONDS.time(operation='stop'):
+                    self.docker.stop(container=self.id)
+        finally:
+            metrics.ACTIVE_CONTAINERS.dec()
+
+    def abort(self, error, kill=True, cause=None):
+        """
+        kills the container and shuts down the streams of running execs,
+        which raise error instead of their own result.
+        :param error: the exception describing why the container was aborted
+        :param kill: False when the container is already dead
+        :param cause: the (exec id, command) of the command which caused the abort, if one did.
+            the other execs raise a ContainerAbortedError naming it instead.
+        """
+        if self.abort_error:
+            return
+
+        logger.error('aborting container %s: %s', self.name, error)
+        self.abort_cause = cause
+        self.abort_error = error
+        if kill:
+            try:
+                self.docker.kill(self.id)
+            except Exception as exc:
+                logger.warning('failed to kill container %s: %s', self.name, exc)
+
+        with self._sockets_lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            shutdown_socket(sock)
+
+    def set_timeout(self, timeout, message, cause=None):
+        """
+        aborts the container with a TaskTimeoutError if it is still running after timeout seconds
+        :param cause: the (exec id, command) which timed out, for the timeout of a command
+        :return: a handle for cancel_timeout
+        """
+        return self.watchdog.schedule(timeout, lambda: self.abort(TaskTimeoutError(message), cause=cause))
+
+    def cancel_timeout(self, handle):
+        self.watchdog.cancel(handle)
+
+    def resource_usage(self):
+        """
+        summarizes the resource usage sampled so far
+        :return: the summary, or None if sampling is not enabled
+        """
+        if not self.sampler:
+            return None
+
+        return summarize(self.sampler.samples, *get_limits(self.host_config))
 
     def cp(self, src, dest):
         """
@@ -63,23 +182,65 @@ class Container(object):
 
         self.docker.put_archive(self.id, path=dest, data=data)
 
-    def execute(self, cmd, out_func=(lambda x: None)):
+    def put_archive(self, dest, data):
+        """
+        extracts a tar archive into dest in the container
+        :param data: the tar as bytes or a file object, which is streamed
+        """
+        self.docker.put_archive(self.id, path=dest, data=data)
+
+    def get_file(self, path):
+        """
+        reads a single file from the container
+        :return: the file content as bytes, or None if it does not exist
+        """
+        return read_file(self.docker, self.id, path)
+
+    def execute(self, cmd, out_func=None, tty=None, timeout=None, internal=False):
         """
         Prepares a command to be executed within the container
         :param cmd: cmd to run
         :param out_func: a func to call for each line of output received
-            this func should take a string argument
+            this func should take a string argument. defaults to logging each line
+        :param tty: run the exec with a tty. defaults to the container's tty setting.
+            without a tty, stdout and stderr are read as raw frames and split into lines incrementally
+        :param timeout: seconds after which the container is killed and the command fails with a TaskTimeoutError
+        :param internal: a command of the driver's own, such as a workspace check, whose output is neither archived
+            nor checked against fail_on_output
         :return: nothing. raises an exception if the command fails
         """
+        if out_func is None and logger.isEnabledFor(logging.INFO):
+            out_func = logger.info
 
-        exec_id = self.docker.exec_create(container=self.id, cmd=cmd, tty=True)['Id']
+        with metrics.EXEC_SECONDS.time():
+            self._execute(cmd, out_func, self.tty if tty is None else tty, timeout, internal)
+
+    def _execute(self, cmd, out_func, tty, timeout, internal=False):
+        exec_id = self.docker.exec_create(container=self.id, cmd=cmd, tty=tty)['Id']
         logger.debug('starting exec [%s] in %s (%s)', cmd, self.name, self.id)
-        output = []
-        for line in self.docker.exec_start(exec_id=exec_id, stream=True):
-            line = line.decode().rstrip()
-            output.append(line)
-            out_func(line)
-            logger.info(line)
+
+        if self.log_archive and not internal:
+            self.log_archive.write('$ {}'.format(cmd).encode('utf-8'))
+
+        handle = None
+        if timeout:
+            handle = self.set_timeout(timeout, 'command [{}] timed out after {} sec'.format(cmd, timeout),
+                                      cause=(exec_id, cmd))
+        try:
+            if tty:
+                output = self._stream_tty(cmd, exec_id, out_func, internal)
+            else:
+                output = self._stream_demuxed(cmd, exec_id, out_func, internal)
+        except Exception:
+            # killing the container may break the stream, in which case the abort reason is what matters
+            if not self.abort_error:
+                raise
+        finally:
+            if handle is not None:
+                self.cancel_timeout(handle)
+
+        if self.abort_error:
+            raise self._abort_error_of(cmd, exec_id)
 
         logger.debug("attempting to get exit_code")
         exit_code = int(self.docker.exec_inspect(exec_id)['ExitCode'])
@@ -87,4 +248,72 @@ class Container(object):
 
         if exit_code != 0:
             msg = 'command [{}] returned exitcode [{}]'.format(cmd, exit_code)
+            output = [decode(line) if type(line) is bytes else line for line in output]
             raise DockerCommandFailedError(message=msg, exit_code=exit_code, cmd=cmd, output=output)
+
+    @contextmanager
+    def _exec_socket(self, exec_id):
+        """starts an exec, yielding its socket, which abort shuts down to end a stream which would otherwise hang"""
+        sock = self.docker.exec_start(exec_id=exec_id, socket=True)
+        with self._sockets_lock:
+            self._sockets.add(sock)
+        try:
+            yield sock
+        finally:
+            with self._sockets_lock:
+                self._sockets.discard(sock)
+            sock.close()
+
+    def _abort_error_of(self, cmd, exec_id):
+        """the error an exec raises once the container was aborted, naming the command which caused it if another did"""
+        if self.abort_cause is None or self.abort_cause[0] == exec_id:
+            return self.abort_error
+        return ContainerAbortedError('command [{}] was aborted: {}'.format(cmd, self.abort_error))
+
+    def _check_line(self, cmd, exec_id, line):
+        """archives a raw output line, and aborts the container if it matches the fail_on_output patterns"""
+        if self.log_archive:
+            self.log_archive.write(line)
+        if self.fail_on_output is not None and self.fail_on_output.search(line):
+            self.abort(OutputMatchedError('command [{}] printed a line matching fail_on_output: {}'.format(
+                cmd, decode(line)[0:200])), cause=(exec_id, cmd))
+
+    def _stream_tty(self, cmd, exec_id, out_func, internal=False):
+        """reads the output of an exec with a tty, which is not multiplexed"""
+        output = []
+
+        with self._exec_socket(exec_id) as sock:
+            for raw_line in iter_raw_lines(metrics.count_bytes(read_socket(sock))):
+                line = decode(raw_line).rstrip()
+                output.append(line)
+                if out_func:
+                    out_func(line)
+                if not internal:
+                    self._check_line(cmd, exec_id, raw_line)
+
+        return output
+
+    def _stream_demuxed(self, cmd, exec_id, out_func, internal=False):
+        """reads output as raw bytes, only decoding the lines which are emitted"""
+        output = []
+
+        with self._exec_socket(exec_id) as sock:
+            for _, line in iter_lines(metrics.count_bytes(read_socket(sock))):
+                output.append(line)
+                if out_func:
+                    out_func(decode(line))
+                if not internal:
+                    self._check_line(cmd, exec_id, line)
+
+        return output
+
+
+def shutdown_socket(sock):
+    """unblocks any thread reading from sock"""
+    for s in (getattr(sock, '_sock', None), sock):
+        if hasattr(s, 'shutdown'):
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+                return
+            except OSError:
+                pass
@@ -25,6 +25,11 @@ class InvalidOperationError(SwarmCIError):
         super(InvalidOperationError, self).__init__(*args, **kwargs)
 
 
+class TaskTimeoutError(SwarmCIError):
+    def __init__(self, *args, **kwargs):
+        super(TaskTimeoutError, self).__init__(*args, **kwargs)
+
+
 class DockerCommandFailedError(SwarmCIError):
     def __init__(self, *args, **kwargs):
         self._output = kwargs.pop('output')
@@ -43,3 +48,18 @@ class DockerCommandFailedError(SwarmCIError):
     @property
     def cmd(self):
         return self._cmd
+
+
+class ContainerDiedError(SwarmCIError):
+    def __init__(self, *args, **kwargs):
+        super(ContainerDiedError, self).__init__(*args, **kwargs)
+
+
+class OutputMatchedError(SwarmCIError):
+    def __init__(self, *args, **kwargs):
+        super(OutputMatchedError, self).__init__(*args, **kwargs)
+
+
+class ContainerAbortedError(SwarmCIError):
+    def __init__(self, *args, **kwargs):
+        super(ContainerAbortedError, self).__init__(*args, **kwargs)
@@ -0,0 +1,120 @@
+"""
+A single subscriber to the docker event stream of each daemon the driver uses.
+It aborts containers which die or are killed for running out of memory while a job is still using them,
+such as when a swarm node fails, so their commands fail straight away instead of hanging.
+Commands still stream their output on their own exec sockets, and their exit codes are inspected when they end.
+"""
+import threading
+import time
+from swarmci.util import get_logger
+from swarmci.gc import LABEL_BUILD_ID
+from swarmci.backends import DockerBackend, DEFAULT_URL
+from swarmci.errors import ContainerDiedError
+
+logger = get_logger(__name__)
+
+RECONNECT_DELAY = 1.0
+
+
+def _action(event):
+    # older daemons append the command to some actions, as in 'exec_start: sh -c ...'
+    return (event.get('Action') or event.get('status') or '').split(':')[0]
+
+
+class EventMonitor(object):
+    """
+    Watches the containers of the driver on one daemon. The event stream is opened, with a client of its own,
+    when the first container is watched, and reopened from the last event seen if it breaks.
+    """
+    def __init__(self, docker=None, tm=None, reconnect_delay=RECONNECT_DELAY, url=DEFAULT_URL):
+        """
+        :param docker: the client to follow the events with, defaults to a new client of url
+        """
+        self.docker = docker
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self._tm = time.time if tm is None else tm
+        self._containers = {}
+        self._oom = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._since = None
+
+    def watch(self, cn):
+        with self._lock:
+            self._containers[cn.id] = cn
+            if self._thread is None:
+                # the event stream holds its connection open, so it does not share a client with the jobs
+                self.docker = self.docker or DockerBackend(base_url=self.url)
+                self._since = int(self._tm())
+                self._thread = threading.Thread(target=self._run, name='events', daemon=True)
+                self._thread.start()
+
+    def unwatch(self, cn):
+        with self._lock:
+            self._containers.pop(cn.id, None)
+            self._oom.discard(cn.id)
+
+    def handle(self, event):
+        action = _action(event)
+        actor = event.get('Actor') or {}
+        container_id = actor.get('ID') or event.get('id')
+        attributes = actor.get('Attributes') or {}
+
+        with self._lock:
+            cn = self._containers.get(container_id)
+            if cn is None:
+                return
+
+            if action == 'oom':
+                self._oom.add(container_id)
+                return
+
+            if action != 'die':
+                return
+            oom = container_id in self._oom
+
+        # containers which the driver closed or aborted itself are expected to die
+        if cn.closed or cn.abort_error:
+            return
+
+        if oom:
+            msg = 'container {} was killed for running out of memory'.format(cn.name)
+        else:
+            msg = 'container {} died unexpectedly with exit code {}'.format(cn.name, attributes.get('exitCode'))
+        cn.abort(ContainerDiedError(msg), kill=False)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                for event in self.docker.events(since=self._since, decode=True,
+                                                filters={'type': 'container', 'label': LABEL_BUILD_ID}):
+                    self._since = event.get('time', self._since)
+                    self.handle(event)
+                    if self._stopped.is_set():
+                        return
+            except Exception as exc:
+                logger.warning('docker event stream failed, reconnecting: %s', exc)
+            self._stopped.wait(self.reconnect_delay)
+
+    def stop(self):
+        self._stopped.set()
+
+
+_default_monitors = {}
+_default_monitor_lock = threading.Lock()
+
+
+def get_event_monitor(url=DEFAULT_URL):
+    """returns the event monitor of a daemon, shared by the whole driver"""
+    with _default_monitor_lock:
+        if url not in _default_monitors:
+            _default_monitors[url] = EventMonitor(url=url)
+        return _default_monitors[url]
+
+
+def stop_event_monitors():
+    with _default_monitor_lock:
+        for monitor in _default_monitors.values():
+            monitor.stop()
@@ -0,0 +1,245 @@
+"""
+Garbage collection of containers left behind by drivers which were killed before they could remove them.
+Every container is labelled with its build id, the driver's host and a lease expiry. While the build runs the
+driver renews the lease of its build by writing a heartbeat file on its own host, outside of the containers, and
+containers of that host whose lease has expired are removed by `swarmci gc`, or by the sweep at the start of
+every build. A container whose build has no heartbeat file is never removed, since it may belong to a driver
+which writes its heartbeats elsewhere.
+"""
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from swarmci.util import get_logger
+from swarmci.errors import SwarmCIError
+
+logger = get_logger(__name__)
+
+LABEL_BUILD_ID = 'swarmci.build-id'
+LABEL_HOST = 'swarmci.host'
+LABEL_LEASE = 'swarmci.lease'
+
+# shared by every driver on the host, so that each sees the heartbeats of the others. a fixed path rather than
+# one under $TMPDIR, which differs between the environments a driver and `swarmci gc` may be started from
+LEASE_DIR = '/var/tmp/swarmci-leases'
+LEASE_DURATION = 300.0
+HEARTBEAT_INTERVAL = 60.0
+BATCH_SIZE = 20
+
+
+def _parse_expiry(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def heartbeat_path(lease_dir, build_id):
+    return os.path.join(lease_dir, '{}.lease'.format(build_id))
+
+
+def write_heartbeat(lease_dir, build_id, expires):
+    os.makedirs(lease_dir, exist_ok=True)
+    path = heartbeat_path(lease_dir, build_id)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write('{:.3f}'.format(expires))
+    os.replace(tmp_path, path)
+
+
+def read_heartbeat(lease_dir, build_id):
+    """:return: when the lease of a build expires, from its heartbeat file, or None if it has none"""
+    try:
+        with open(heartbeat_path(lease_dir, build_id), 'r') as f:
+            return _parse_expiry(f.read())
+    except OSError:
+        return None
+
+
+class ContainerRegistry(object):
+    """
+    Tracks the containers of the running build, labels them, and renews the build's lease every heartbeat_interval.
+    The heartbeat thread is started when the first container is added.
+    :param lease: whether to renew the lease at all, which backends without gc have no use for
+    """
+    def __init__(self, build_id=None, host=None, lease_duration=LEASE_DURATION,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, tm=None, lease_dir=LEASE_DIR, lease=True):
+        self.build_id = build_id
+        self.host = host or socket.gethostname()
+        self.lease_duration = lease_duration
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_dir = lease_dir
+        self.lease = lease
+        self._tm = time.time if tm is None else tm
+        self._containers = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._torn_down = False
+
+    def labels(self):
+        return {
+            LABEL_BUILD_ID: self.build_id or '',
+            LABEL_HOST: self.host,
+            LABEL_LEASE: '{:.3f}'.format(self._tm() + self.lease_duration)
+        }
+
+    def add(self, cn):
+        """
+        starts renewing the lease of a container.
+        raises a SwarmCIError, after closing the container, if the build is being torn down.
+        """
+        with self._lock:
+            torn_down = self._torn_down
+            start = not torn_down and self.lease and self._thread is None
+            if not torn_down:
+                self._containers.add(cn)
+                if start:
+                    self._thread = threading.Thread(target=self._run, name='heartbeat', daemon=True)
+
+        if start:
+            self.renew()
+            self._thread.start()
+
+        if torn_down:
+            cn.close()
+            raise SwarmCIError('build {} is being torn down'.format(self.build_id))
+
+    def discard(self, cn):
+        with self._lock:
+            self._containers.discard(cn)
+
+    @property
+    def containers(self):
+        with self._lock:
+            return list(self._containers)
+
+    def renew(self):
+        """writes a new lease expiry into the build's heartbeat file, once the driver has given the build an id"""
+        if self.build_id is None or not self.lease:
+            return
+        try:
+            write_heartbeat(self.lease_dir, self.build_id, self._tm() + self.lease_duration)
+        except OSError as exc:
+            logger.warning('failed to renew the lease of build %s: %s', self.build_id, exc)
+
+    def _run(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            self.renew()
+
+    def stop(self):
+        """stops renewing the lease, removing the heartbeat file once the build's containers are gone"""
+        self._stopped.set()
+        if self._thread is not None and not self.containers:
+            try:
+                os.remove(heartbeat_path(self.lease_dir, self.build_id))
+            except OSError:
+                pass
+
+    def teardown(self, reason, max_workers=BATCH_SIZE):
+        """
+        aborts and closes every container of the build concurrently.
+        containers added afterwards are closed straight away.
+        """
+        with self._lock:
+            self._torn_down = True
+            containers = list(self._containers)
+
+        logger.error('tearing down %s containers of build %s: %s', len(containers), self.build_id, reason)
+
+        def close(cn):
+            cn.abort(SwarmCIError(reason))
+            try:
+                cn.close()
+            except Exception as exc:
+                logger.warning('failed to remove container %s: %s', cn.name, exc)
+
+        if containers:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(containers))) as executor:
+                list(executor.map(close, containers))
+        self.stop()
+
+
+def install_signal_handlers(registries, signals=(signal.SIGINT, signal.SIGTERM)):
+    """
+    tears the builds down on SIGINT and SIGTERM, then exits. must be called from the main thread.
+    :param registries: the container registry of each build
+    """
+    def handler(signum, frame):
+        signal.signal(signum, signal.SIG_DFL)
+        for registry in registries:
+            registry.teardown('received {}'.format(signal.Signals(signum).name))
+        raise SystemExit(128 + signum)
+
+    for signum in signals:
+        signal.signal(signum, handler)
+
+
+def lease_expiry(container, lease_dir=LEASE_DIR):
+    """
+    :param container: a container as listed by docker.containers
+    :return: when the container's lease expires, from its build's heartbeat, or None if its build has no heartbeat
+    """
+    labels = container.get('Labels', {})
+    renewed = read_heartbeat(lease_dir, labels.get(LABEL_BUILD_ID))
+    if renewed is None:
+        return None
+    return max(e for e in (_parse_expiry(labels.get(LABEL_LEASE)), renewed) if e is not None)
+
+
+def collect(docker, exclude_build_ids=(), tm=None, max_workers=BATCH_SIZE, host=None, lease_dir=LEASE_DIR):
+    """
+    removes every swarmci container of this host whose lease has expired.
+    the heartbeats of other hosts cannot be read here, so their containers are left to the drivers of those hosts.
+    containers whose build has no heartbeat in lease_dir are left alone too, as their lease cannot be known.
+    :param exclude_build_ids: builds whose containers are never removed, such as the ones starting
+    :return: the ids of the containers removed
+    """
+    now = (time.time if tm is None else tm)()
+    host = host or socket.gethostname()
+
+    listed = docker.containers(all=True, filters={'label': LABEL_BUILD_ID})
+    containers = [c for c in listed if c.get('Labels', {}).get(LABEL_HOST) == host]
+    if len(containers) < len(listed):
+        logger.debug('skipping %s swarmci containers of other hosts', len(listed) - len(containers))
+
+    candidates = [c for c in containers if c.get('Labels', {}).get(LABEL_BUILD_ID) not in exclude_build_ids]
+    expiries = [(c, lease_expiry(c, lease_dir)) for c in candidates]
+    unknown = sum(1 for _, expiry in expiries if expiry is None)
+    if unknown:
+        logger.warning('skipping %s swarmci containers without a heartbeat in %s', unknown, lease_dir)
+    orphans = [c for c, expiry in expiries if expiry is not None and expiry <= now]
+    if not orphans:
+        return []
+
+    def remove(container):
+        labels = container.get('Labels', {})
+        logger.info('removing container %s of build %s from %s, its lease expired', container['Id'][0:12],
+                    labels.get(LABEL_BUILD_ID), labels.get(LABEL_HOST))
+        try:
+            docker.remove_container(container=container['Id'], v=True, force=True)
+            return container['Id']
+        except Exception as exc:
+            logger.warning('failed to remove container %s: %s', container['Id'][0:12], exc)
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(orphans))) as executor:
+        removed = [cid for cid in executor.map(remove, orphans) if cid]
+
+    logger.info('removed %s of %s swarmci containers', len(removed), len(containers))
+    return removed
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """returns the container registry shared by the whole driver"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ContainerRegistry()
+        return _default_registry
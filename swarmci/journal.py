@@ -0,0 +1,115 @@
+"""
+An append-only journal of task states for a build, used to resume a failed build
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from swarmci.util import get_logger
+from swarmci.errors import SwarmCIError
+
+logger = get_logger(__name__)
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+TIMED_OUT = 'timed_out'
+SKIPPED = 'skipped'
+
+
+def input_hash(job, manifest=None):
+    """
+    a hash of everything which determines the outcome of a job, other than its name and whether it is deduplicated
+    :param manifest: the manifest of the job's workspace, so that a change to its files changes the hash too
+    """
+    inputs = {k: v for k, v in job.items() if k not in ('name', 'dedupe')}
+    if manifest is not None:
+        inputs = [inputs, manifest]
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def journal_path(directory, build_id):
+    return os.path.join(directory, '{}.jsonl'.format(build_id))
+
+
+def load(directory, build_id):
+    """
+    reads the entries journaled by a previous build
+    :return: a list of entries, in the order they were written
+    """
+    path = journal_path(directory, build_id)
+    if not os.path.isfile(path):
+        raise SwarmCIError('Could not find a journal for build {} in {}.'.format(build_id, directory))
+
+    entries = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # the last line may be incomplete if the driver was killed while writing it
+                logger.warning('skipping unreadable journal entry in %s', path)
+
+    return entries
+
+
+class Journal(object):
+    """
+    Records the state of each task as it completes.
+    When resuming from a previous build, jobs which succeeded in that build with the same inputs are skipped.
+    """
+    def __init__(self, directory, build_id, resume_from=None, tm=None):
+        self.directory = directory
+        self.build_id = build_id
+        self.path = journal_path(directory, build_id)
+        self.resume_from = resume_from
+        self._tm = time.time if tm is None else tm
+        self._lock = threading.Lock()
+        self._skipped = set()
+        self._succeeded = {}
+
+        if resume_from:
+            for entry in load(directory, resume_from):
+                key = (entry['type'], entry['name'], entry['input_hash'])
+                if entry['status'] in (SUCCEEDED, SKIPPED):
+                    self._succeeded[key] = entry
+                else:
+                    self._succeeded.pop(key, None)
+
+        os.makedirs(directory, exist_ok=True)
+
+    def should_skip(self, task):
+        """
+        :return: True if the task succeeded with the same inputs in the build being resumed
+        """
+        key = (task.task_type.name, task.name, task.input_hash)
+        if key not in self._succeeded:
+            return False
+
+        logger.info('%s %s already succeeded in build %s, skipping', task.pretty_task_type, task.name,
+                    self.resume_from)
+        with self._lock:
+            self._skipped.add(task.id)
+        return True
+
+    def record(self, task):
+        """appends the state of a completed task to the journal"""
+        status = SKIPPED if task.id in self._skipped else task.outcome
+
+        entry = {
+            'build_id': self.build_id,
+            'id': task.id,
+            'type': task.task_type.name,
+            'name': task.name,
+            'status': status,
+            'runtime': task.runtime,
+            'input_hash': task.input_hash,
+            'duplicate_of': task.duplicate_of,
+            'time': self._tm(),
+            'error': str(task.error) if task.error else None
+        }
+
+        line = json.dumps(entry, sort_keys=True, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
@@ -0,0 +1,266 @@
+"""
+Metrics for builds and the driver, exported in the Prometheus text format,
+either written to a textfile or served over http
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from swarmci.util import get_logger
+
+logger = get_logger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not False:
+            (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{} expects labels {}, got {}'.format(self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def samples(self):
+        """returns a list of (suffix, label values, extra labels, value) tuples"""
+        with self._lock:
+            return [('', key, None, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation.replace('\n', ' ')),
+                 '# TYPE {} {}'.format(self.name, self.metric_type)]
+        for suffix, key, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, _format_labels(self.labelnames, key, extra),
+                                            _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            return self._values[key]
+
+    def dec(self, amount=1, **labels):
+        return self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super(Histogram, self).__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """observes the time spent in the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', key, [('le', _format_value(bound))], cumulative))
+                samples.append(('_sum', key, None, total))
+                samples.append(('_count', key, None, cumulative))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def write_textfile(path, registry=REGISTRY):
+    """writes all metrics to path, replacing it atomically so collectors never read a partial file"""
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class TextfileWriter(object):
+    """
+    Writes metrics to a textfile every interval seconds, and once more when stopped
+    """
+    def __init__(self, path, interval, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-textfile', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        write_textfile(self.path, self.registry)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                write_textfile(self.path, self.registry)
+            except Exception as exc:
+                logger.warning('failed to write metrics to %s: %s', self.path, exc)
+
+
+def serve(port, address='127.0.0.1', registry=REGISTRY):
+    """
+    serves metrics over http on a background thread
+    :return: the server, call shutdown() to stop it
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((address, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info('serving metrics on http://%s:%s/metrics', address, server.server_port)
+    return server
+
+
+READY_QUEUE_DEPTH = Gauge('swarmci_ready_queue_depth',
+                          'Tasks submitted to the thread pool which have not started yet')
+EXECUTOR_MAX_WORKERS = Gauge('swarmci_executor_max_workers',
+                             'Worker threads available to run jobs')
+EXECUTOR_BUSY_WORKERS = Gauge('swarmci_executor_busy_workers',
+                              'Worker threads currently running a task')
+EXECUTOR_UTILIZATION = Gauge('swarmci_executor_utilization',
+                             'Busy worker threads as a fraction of the available worker threads')
+GROUP_BUSY_WORKERS = Gauge('swarmci_group_busy_workers',
+                           'Threads running the commands of parallel groups, apart from the executor workers')
+ACTIVE_CONTAINERS = Gauge('swarmci_active_containers',
+                          'Containers started by the driver which have not been closed yet')
+CONTAINER_OPERATION_SECONDS = Histogram('swarmci_container_operation_seconds',
+                                        'Latency of container lifecycle calls', ['operation'])
+EXEC_SECONDS = Histogram('swarmci_exec_seconds',
+                         'Time from creating an exec until its exit code is known')
+OUTPUT_BYTES = Counter('swarmci_output_bytes_total',
+                       'Bytes of command output streamed through the driver')
+TASKS = Counter('swarmci_tasks_total',
+                'Completed tasks by type and outcome', ['type', 'outcome'])
+TASK_SECONDS = Histogram('swarmci_task_seconds',
+                         'Runtime of completed tasks by type', ['type'])
+
+
+def set_max_workers(count):
+    EXECUTOR_MAX_WORKERS.set(count)
+    _update_utilization()
+
+
+def worker_started():
+    READY_QUEUE_DEPTH.dec()
+    EXECUTOR_BUSY_WORKERS.inc()
+    _update_utilization()
+
+
+def worker_finished():
+    EXECUTOR_BUSY_WORKERS.dec()
+    _update_utilization()
+
+
+def _update_utilization():
+    max_workers = EXECUTOR_MAX_WORKERS.get()
+    if max_workers:
+        EXECUTOR_UTILIZATION.set(float(EXECUTOR_BUSY_WORKERS.get() or 0) / max_workers)
+
+
+def count_bytes(chunks):
+    """passes chunks through, counting their bytes as output"""
+    for chunk in chunks:
+        OUTPUT_BYTES.inc(len(chunk))
+        yield chunk
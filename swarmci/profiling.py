@@ -0,0 +1,189 @@
+"""
+A low overhead, sampling profiler for the driver.
+The stacks of all threads are sampled on a background thread, and written both as a pstats file
+and as collapsed stacks (for flame graphs). Time spent waiting on locks in the logging path
+and in the thread pool queue is recorded alongside.
+"""
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from swarmci.util import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_INTERVAL = 0.01
+
+_active = None
+
+
+def record_wait(name, seconds):
+    """records time spent waiting, if a profiler is running. this is cheap enough to call on hot paths."""
+    profiler = _active
+    if profiler is not None:
+        profiler.record_wait(name, seconds)
+
+
+class TimedLock(object):
+    """
+    Wraps a lock, recording how long each acquire waited
+    """
+    def __init__(self, lock, name, profiler):
+        self.lock = lock
+        self.name = name
+        self.profiler = profiler
+
+    def acquire(self, *args, **kwargs):
+        start = time.perf_counter()
+        acquired = self.lock.acquire(*args, **kwargs)
+        self.profiler.record_wait(self.name, time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class Profiler(object):
+    """
+    Samples the stack of every thread except its own every interval seconds
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self.waits = {}
+        self._waits_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._handlers = []
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        global _active
+        self.start_time = time.time()
+        self._instrument_logging()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        _active = self
+
+    def stop(self):
+        global _active
+        _active = None
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self._restore_logging()
+        self.end_time = time.time()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def record_wait(self, name, seconds):
+        with self._waits_lock:
+            count, total, longest = self.waits.get(name, (0, 0.0, 0.0))
+            self.waits[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def sample(self):
+        """records the current stack of every other thread"""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+
+            self.stacks[(names.get(ident, str(ident)),) + tuple(stack)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def _instrument_logging(self):
+        loggers = [logging.getLogger()] + [lg for lg in logging.Logger.manager.loggerDict.values()
+                                           if isinstance(lg, logging.Logger)]
+        for handler in {h for lg in loggers for h in lg.handlers}:
+            if handler.lock is None or isinstance(handler.lock, TimedLock):
+                continue
+            name = 'logging lock ({})'.format(type(handler).__name__)
+            self._handlers.append((handler, handler.lock))
+            handler.lock = TimedLock(handler.lock, name, self)
+
+    def _restore_logging(self):
+        for handler, lock in self._handlers:
+            handler.lock = lock
+        self._handlers = []
+
+    def collapsed(self):
+        """returns the samples as collapsed stacks, one 'thread;frame;frame count' line per unique stack"""
+        lines = []
+        for stack, count in sorted(self.stacks.items(), key=lambda x: -x[1]):
+            frames = ['{} ({}:{})'.format(name, os.path.basename(filename), line)
+                      for filename, line, name in stack[1:]]
+            lines.append('{} {}'.format(';'.join([stack[0]] + frames), count))
+        return lines
+
+    def pstats(self):
+        """returns the samples as a stats dict, as expected by the pstats module"""
+        stats = {}
+        for stack, count in self.stacks.items():
+            frames = stack[1:]
+            seconds = count * self.interval
+            for index, func in enumerate(frames):
+                if func in frames[:index]:
+                    # recursive calls are only counted once per sample
+                    continue
+                cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+                if index + 1 == len(frames):
+                    tt += seconds
+                if index > 0:
+                    caller = frames[index - 1]
+                    ccc, cnc, ctt, cct = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (ccc + count, cnc + count, ctt, cct + seconds)
+                stats[func] = (cc + count, nc + count, tt, ct + seconds, callers)
+        return stats
+
+    def write(self, path):
+        """
+        writes the profile as a pstats file at path, collapsed stacks at path.collapsed,
+        and a summary of lock waits at path.waits
+        """
+        with open(path, 'wb') as f:
+            marshal.dump(self.pstats(), f)
+
+        with open(path + '.collapsed', 'w') as f:
+            for line in self.collapsed():
+                f.write(line + '\n')
+
+        with open(path + '.waits', 'w') as f:
+            for line in self.wait_report():
+                f.write(line + '\n')
+
+    def wait_report(self):
+        lines = []
+        with self._waits_lock:
+            waits = sorted(self.waits.items(), key=lambda x: -x[1][1])
+        for name, (count, total, longest) in waits:
+            lines.append('{}: {} waits, total {:.4f} sec, avg {:.6f} sec, max {:.4f} sec'.format(
+                name, count, total, total / count, longest))
+        return lines
@@ -1,7 +1,15 @@
-from docker import Client as DockerClient
 import concurrent.futures
+import threading
+import time
+from swarmci import profiling, metrics
 from swarmci.util import get_logger
 from swarmci.docker import Container
+from swarmci.stats import format_report
+from swarmci.sync import WorkspaceSync
+from swarmci.streams import LogArchive, compile_patterns
+from swarmci.gc import get_registry
+from swarmci.backends import DockerBackend, DEFAULT_URL
+from swarmci.events import get_event_monitor
 from swarmci.errors import TaskFailedError
 
 logger = get_logger(__name__)
@@ -50,9 +58,58 @@ class ThreadedRunner(RunnerBase):
         self._thread_pool_executor = thread_pool_executor
         super().__init__()
 
-    def run_all(self, tasks):
-        futures = list(map(lambda t: self._thread_pool_executor.submit(self.run, t), tasks))
-        concurrent.futures.wait(futures)
+    @classmethod
+    def run_queued(cls, task, submitted_at, *args, **kwargs):
+        profiling.record_wait('thread pool queue', time.perf_counter() - submitted_at)
+        metrics.worker_started()
+        try:
+            return cls.run(task, *args, **kwargs)
+        finally:
+            metrics.worker_finished()
+
+    def submit(self, task, *args, **kwargs):
+        metrics.READY_QUEUE_DEPTH.inc()
+        return self._thread_pool_executor.submit(self.run_queued, task, time.perf_counter(), *args, **kwargs)
+
+    def schedule(self, task, scheduled, *args, **kwargs):
+        """
+        submits a task once the tasks it runs after have ended, scheduling those which have not run yet first.
+        a task waiting for others does not hold a worker, it is only submitted when the last of them ends.
+        :param scheduled: the futures of the tasks scheduled so far, by task
+        :return: the future of the task
+        """
+        if task in scheduled:
+            return scheduled[task]
+
+        pending = [self.schedule(t, scheduled, *args, **kwargs) for t in task.after if t.end_time is None]
+        if not pending:
+            scheduled[task] = self.submit(task, *args, **kwargs)
+            return scheduled[task]
+
+        future = concurrent.futures.Future()
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                _chain(self.submit(task, *args, **kwargs), future)
+            except Exception as exc:
+                future.set_exception(exc)
+
+        for f in pending:
+            f.add_done_callback(on_done)
+        scheduled[task] = future
+        return future
+
+    def run_all(self, tasks, *args, **kwargs):
+        scheduled = {}
+        for t in tasks:
+            self.schedule(t, scheduled, *args, **kwargs)
+        concurrent.futures.wait(list(scheduled.values()))
 
         if not all(t.successful for t in tasks):
             msg = "Failure detected in one or more {}s!".format(tasks[0].pretty_task_type)
@@ -60,20 +117,65 @@ class ThreadedRunner(RunnerBase):
             raise TaskFailedError(msg)
 
 
+class GroupRunner(ThreadedRunner):
+    """
+    Runs the commands of a parallel group concurrently, as execs in the job's container.
+    Its threads only stream the output of the execs, so they are counted apart from the executor's workers.
+    """
+
+    @classmethod
+    def run_queued(cls, task, submitted_at, *args, **kwargs):
+        metrics.GROUP_BUSY_WORKERS.inc()
+        try:
+            return cls.run(task, *args, **kwargs)
+        finally:
+            metrics.GROUP_BUSY_WORKERS.dec()
+
+    def submit(self, task, *args, **kwargs):
+        return self._thread_pool_executor.submit(self.run_queued, task, time.perf_counter(), *args, **kwargs)
+
+
+def _chain(source, target):
+    """completes the target future with the outcome of the source future"""
+    def copy(f):
+        if f.exception() is not None:
+            target.set_exception(f.exception())
+        else:
+            target.set_result(f.result())
+    source.add_done_callback(copy)
+
+
 class DockerRunner(RunnerBase):
     """
     DockerRunner is responsible for running tasks within a Docker Container.
     It is similar to the SerialRunner, in that it also runs tasks serially, and quits if a task fails.
     """
 
-    def __init__(self, image, remove=True, url=':4000', env=None, docker=None, cn=None, **kwargs):
-        self.docker = docker or DockerClient(base_url=url, version='1.24')
+    def __init__(self, image, remove=True, url=DEFAULT_URL, env=None, docker=None, cn=None, name=None,
+                 stats_interval=None, tty=True, timeout=None, workspace=None, workspace_sync=None, registry=None,
+                 monitor=None, fail_on_output=None, log_path=None, **kwargs):
+        self.docker = docker or DockerBackend(base_url=url)
         self.image = image
         self.remove = remove
         self.env = env or {}
+        self.name = name
+        self.stats_interval = stats_interval
+        self.tty = tty
+        self.timeout = timeout
+        self.workspace = workspace
+        self.workspace_sync = workspace_sync
+        self.registry = registry or get_registry()
+        self.monitor = monitor
+        if monitor is None and getattr(self.docker, 'supports_events', False):
+            self.monitor = get_event_monitor(getattr(self.docker, 'docker_url', url))
+        self.fail_on_output = compile_patterns(fail_on_output)
+        self.log_path = log_path
         self._cn = cn or Container
+        self.results = {}
 
         kwargs.setdefault('binds', [])
+        if workspace and workspace.get('volume'):
+            kwargs['binds'] = kwargs['binds'] + ['{}:{}'.format(workspace['volume'], workspace['dest'])]
         kwargs.setdefault('network_mode', 'bridge')
 
         self.host_config = self.docker.create_host_config(**kwargs)
@@ -82,14 +184,75 @@ class DockerRunner(RunnerBase):
         super().__init__()
 
     @staticmethod
-    def run_in_docker(command, cn):
-        logger.info("----BEGIN STDOUT----")
-        cn.execute(command)
-        logger.info("----END STDOUT----")
+    def run_in_docker(command, cn, timeout=None, sink=None):
+        """
+        :param sink: an OutputSink to collect the command's output in, instead of logging it as it arrives
+        :return: the command's output lines, when collected in a sink
+        """
+        if sink is None:
+            logger.info("----BEGIN STDOUT----")
+            cn.execute(command, timeout=timeout)
+            logger.info("----END STDOUT----")
+            return None
+
+        try:
+            cn.execute(command, out_func=sink, timeout=timeout)
+        finally:
+            sink.flush()
+        return sink.lines
 
     def run_all(self, tasks):
-        with self._cn(self.image, self.host_config, self.docker, env=self.env) as cn:
-            self.logger.info('Using Container %s', cn.id[0:11])
+        log_archive = LogArchive(self.log_path) if self.log_path else None
+        try:
+            with self._cn(self.image, self.host_config, self.docker, env=self.env,
+                          stats_interval=self.stats_interval, tty=self.tty, registry=self.registry,
+                          monitor=self.monitor, fail_on_output=self.fail_on_output, log_archive=log_archive) as cn:
+                self.logger.info('Using Container %s', cn.id[0:11])
+                self.results = {'container': cn.id}
+                if log_archive:
+                    self.results['log'] = self.log_path
+                self.run_in_container(cn, tasks)
+        finally:
+            if log_archive:
+                log_archive.close()
+
+        return self.results
+
+    def run_in_container(self, cn, tasks):
+        handle = None
+        if self.timeout:
+            handle = cn.set_timeout(self.timeout, 'job {} timed out after {} sec'.format(
+                self.name or cn.name, self.timeout))
+        try:
+            if self.workspace:
+                self.sync_workspace(cn)
             for task in tasks:
                 self.run(task, cn=cn)
                 self.raise_if_not_successful(task)
+        except TaskFailedError:
+            # a timeout, a match of fail_on_output or a dead container explains the failure better
+            if cn.abort_error is not None:
+                raise cn.abort_error
+            raise
+        finally:
+            if handle is not None:
+                cn.cancel_timeout(handle)
+            self.collect_resource_usage(cn)
+
+    def sync_workspace(self, cn):
+        workspace_sync = self.workspace_sync or WorkspaceSync()
+        try:
+            sent, deleted = workspace_sync.sync(cn, self.workspace.get('src', '.'), self.workspace['dest'])
+            self.results['workspace'] = {'sent': sent, 'deleted': deleted}
+        finally:
+            if workspace_sync is not self.workspace_sync:
+                workspace_sync.close()
+
+    def collect_resource_usage(self, cn):
+        if not self.stats_interval:
+            return
+
+        usage = cn.resource_usage()
+        self.results['resource_usage'] = usage
+        self.results['resource_samples'] = cn.sampler.samples if cn.sampler else []
+        self.logger.info(format_report(self.name or cn.name, usage))
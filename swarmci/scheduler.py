@@ -0,0 +1,125 @@
+"""
+A thread pool shared by several builds running in the same driver.
+Each build submits to its own queue, and free workers take the next task from the queue which is furthest below
+its weighted share of the workers, so one huge build cannot starve small ones.
+"""
+import threading
+from collections import deque
+from concurrent.futures import Future
+from swarmci.util import get_logger
+
+logger = get_logger(__name__)
+
+
+class BuildQueue(object):
+    """
+    The queue of one build. It has the submit method of an executor, so it can be given to a ThreadedRunner.
+    """
+    def __init__(self, scheduler, name, weight):
+        self.scheduler = scheduler
+        self.name = name
+        self.weight = weight
+        self.tasks = deque()
+        self.running = 0
+        self.dispatched = 0
+        self.virtual_time = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        return self.scheduler.submit(self, fn, *args, **kwargs)
+
+    @property
+    def share(self):
+        """running workers relative to the weight, lower is further behind"""
+        return self.running / self.weight
+
+
+class FairShareExecutor(object):
+    """
+    A fixed pool of worker threads serving weighted queues.
+    Among queues with waiting tasks, a worker picks the one using the smallest share of the workers for its
+    weight, and between equal shares, the one which was dispatched the least relative to its weight.
+    """
+    def __init__(self, max_workers, thread_name_prefix='build'):
+        if max_workers < 1:
+            raise ValueError('max_workers must be greater than 0')
+
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._queues = []
+        self._cond = threading.Condition()
+        self._threads = []
+        self._shutdown = False
+
+    def queue(self, name, weight=1.0):
+        """
+        :param weight: the relative share of the workers this queue gets while other queues have waiting tasks
+        :return: a new queue to submit tasks to
+        """
+        if weight <= 0:
+            raise ValueError('the weight of {} must be greater than 0'.format(name))
+
+        with self._cond:
+            q = BuildQueue(self, name, float(weight))
+            self._queues.append(q)
+            return q
+
+    def submit(self, q, fn, *args, **kwargs):
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('cannot submit after shutdown')
+
+            if not q.tasks and not q.running:
+                # a queue which was idle does not get to catch up on the time it did not use
+                active = [other.virtual_time for other in self._queues if other.tasks or other.running]
+                if active:
+                    q.virtual_time = max(q.virtual_time, min(active))
+
+            q.tasks.append((future, fn, args, kwargs))
+            if len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, daemon=True,
+                                          name='{}_{}'.format(self.thread_name_prefix, len(self._threads)))
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify()
+        return future
+
+    def _next(self):
+        """waits for a task, returning the queue and the task, or None on shutdown"""
+        with self._cond:
+            while True:
+                waiting = [q for q in self._queues if q.tasks]
+                if waiting:
+                    q = min(waiting, key=lambda x: (x.share, x.virtual_time))
+                    q.running += 1
+                    q.dispatched += 1
+                    q.virtual_time += 1.0 / q.weight
+                    return q, q.tasks.popleft()
+                if self._shutdown:
+                    return None
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+
+            q, (future, fn, args, kwargs) = item
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as exc:
+                        future.set_exception(exc)
+            finally:
+                with self._cond:
+                    q.running -= 1
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
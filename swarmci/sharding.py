@@ -0,0 +1,140 @@
+"""
+Splits a job with ``parallelism: N`` into N shard jobs, balancing the job's work items
+across the shards using recorded per-item timings
+"""
+import glob
+import json
+import os
+from swarmci.util import get_logger
+from swarmci.errors import SwarmCIError
+
+logger = get_logger(__name__)
+
+SHARD_INDEX_ENV = 'SWARMCI_SHARD_INDEX'
+SHARD_COUNT_ENV = 'SWARMCI_SHARD_COUNT'
+SHARD_ITEMS_ENV = 'SWARMCI_SHARD_ITEMS'
+
+DEFAULT_ITEM_TIME = 1.0
+
+
+def get_parallelism(job):
+    """returns the number of shards requested by a job, 1 if it is not sharded"""
+    try:
+        parallelism = int(job.get('parallelism', 1))
+    except (TypeError, ValueError):
+        raise SwarmCIError('The value of "parallelism" for job {} should be an integer.'.format(job.get('name')))
+
+    if parallelism < 1:
+        raise SwarmCIError('The value of "parallelism" for job {} should be at least 1.'.format(job.get('name')))
+
+    return parallelism
+
+
+def load_timings(path):
+    """
+    loads recorded per-item timings
+    :param path: a json file mapping item -> seconds
+    :return: a dict of item -> seconds, empty if the file does not exist
+    """
+    if not path or not os.path.isfile(path):
+        logger.debug('no timings found at %s, assuming equal item times', path)
+        return {}
+
+    with open(path, 'r') as f:
+        timings = json.load(f)
+
+    if type(timings) is not dict:
+        raise SwarmCIError('The timings file {} should contain a mapping of item to seconds.'.format(path))
+
+    return {item: float(seconds) for item, seconds in timings.items()}
+
+
+def get_items(shard_config):
+    """returns the work items to shard, from an explicit list of items and/or a glob"""
+    items = list(shard_config.get('items', []))
+
+    pattern = shard_config.get('glob')
+    if pattern:
+        items.extend(sorted(glob.glob(pattern, recursive=True)))
+
+    return items
+
+
+def partition(items, count, timings=None):
+    """
+    assigns items to shards so that the shards finish at roughly the same time.
+    items are handed out longest first, each going to the shard with the least work so far.
+    items without a recorded timing are assumed to take the average of the recorded ones.
+    :param items: work items, such as test file names
+    :param count: number of shards
+    :param timings: dict of item -> seconds
+    :return: a list of (items, estimated seconds) tuples, one per shard
+    """
+    timings = timings or {}
+    known = [timings[i] for i in items if i in timings]
+    default = sum(known) / len(known) if known else DEFAULT_ITEM_TIME
+
+    weighted = sorted(((timings.get(i, default), i) for i in items), key=lambda x: (-x[0], x[1]))
+
+    shards = [([], 0.0) for _ in range(count)]
+    for seconds, item in weighted:
+        index = min(range(count), key=lambda s: shards[s][1])
+        shard_items, total = shards[index]
+        shard_items.append(item)
+        shards[index] = (shard_items, total + seconds)
+
+    return shards
+
+
+def split_job(job):
+    """
+    creates one job definition per shard of a sharded job.
+    each shard receives its index, the shard count, and its assigned items in its env, one per line.
+    when there are fewer items than shards, only the shards which were assigned items are created.
+    """
+    count = get_parallelism(job)
+    shard_config = job.get('shard', {})
+
+    items = get_items(shard_config)
+    timings = load_timings(shard_config.get('timings'))
+
+    shards = partition(items, count, timings)
+    if items:
+        shards = [shard for shard in shards if shard[0]]
+        if len(shards) < count:
+            logger.debug('%s has %s items, running %s of %s shards', job['name'], len(items), len(shards), count)
+            count = len(shards)
+
+    shard_jobs = []
+    for index, (shard_items, estimate) in enumerate(shards):
+        logger.debug('%s shard %s/%s assigned %s items, estimated %.2f sec',
+                     job['name'], index, count, len(shard_items), estimate)
+
+        env = dict(job.get('env') or {})
+        env.update({
+            SHARD_INDEX_ENV: str(index),
+            SHARD_COUNT_ENV: str(count),
+            SHARD_ITEMS_ENV: '\n'.join(shard_items)
+        })
+
+        shard_job = dict(job, name='{} [shard {}/{}]'.format(job['name'], index + 1, count), env=env)
+        shard_job.pop('parallelism', None)
+        shard_job['shard'] = {'index': index, 'count': count, 'items': shard_items, 'estimate': estimate}
+        shard_jobs.append(shard_job)
+
+    return shard_jobs
+
+
+def aggregate(shards):
+    """
+    collects the outcome of each shard into a single result for the parent job
+    :param shards: a list of (shard job, shard task) tuples
+    """
+    return [{
+        'index': job['shard']['index'],
+        'items': job['shard']['items'],
+        'estimate': job['shard']['estimate'],
+        'successful': task.successful,
+        'runtime': task.runtime,
+        'error': task.error
+    } for job, task in shards]
@@ -0,0 +1,292 @@
+"""
+A discrete-event simulator which predicts the wall time of a build from recorded job runtimes
+and a model of the capacity available to run it, to size the swarm and the executor from data
+"""
+import heapq
+import itertools
+import json
+import os
+import re
+from collections import deque
+from swarmci.util import get_logger
+from swarmci.errors import SwarmCIError
+from swarmci.sharding import get_parallelism
+from swarmci import journal
+
+logger = get_logger(__name__)
+
+DEFAULT_RUNTIME = 60.0
+
+# the names sharding.split_job gives the shards of a job
+SHARD_NAME = re.compile(r'^(?P<job>.*) \[shard (?P<index>\d+)/\d+\]$')
+
+
+class CapacityModel(object):
+    """
+    :param max_workers: executor threads, each running one job at a time
+    :param nodes: swarm nodes
+    :param slots_per_node: containers each node can run at the same time
+    :param pull_time: seconds to pull an image onto a node which does not have it yet
+    :param container_overhead: seconds to create, start and remove a container, added to estimated runtimes only,
+        as recorded runtimes already include it
+    """
+    def __init__(self, max_workers=25, nodes=1, slots_per_node=25, pull_time=0.0, container_overhead=0.0):
+        self.max_workers = max_workers
+        self.nodes = nodes
+        self.slots_per_node = slots_per_node
+        self.pull_time = pull_time
+        self.container_overhead = container_overhead
+
+    def replace(self, **kwargs):
+        options = dict(self.__dict__)
+        options.update(kwargs)
+        return CapacityModel(**options)
+
+
+class SimJob(object):
+    """
+    :param estimated: the runtime was assumed rather than recorded, so it does not include the container overhead
+    """
+    def __init__(self, name, image, runtime, shard_runtimes=None, estimated=False):
+        self.name = name
+        self.image = image
+        self.runtime = runtime
+        self.shard_runtimes = shard_runtimes or []
+        self.estimated = estimated
+        self.start_time = None
+        self.end_time = None
+        self.wait_time = 0.0
+        self.pull_time = 0.0
+
+
+class _Unit(object):
+    """a container to run: a job, or one shard of a sharded job"""
+    def __init__(self, job, runtime, parent=None):
+        self.job = job
+        self.runtime = runtime
+        self.parent = parent
+        self.node = None
+
+
+def load_runtimes(path=None, journal_dir=None, build_id=None):
+    """
+    loads recorded runtimes, from a json file of job name -> seconds and/or the journal of a previous build
+    :return: a dict of job name -> seconds
+    """
+    runtimes = {}
+    if journal_dir and build_id:
+        for entry in journal.load(journal_dir, build_id):
+            if entry['type'] == 'JOB' and entry['status'] != journal.SKIPPED and entry.get('runtime') is not None:
+                runtimes[entry['name']] = float(entry['runtime'])
+
+        # a sharded job only waits for its shards, so its own runtime says nothing about the work
+        for name in list(runtimes):
+            match = SHARD_NAME.match(name)
+            if match:
+                runtimes.pop(match.group('job'), None)
+
+    if path:
+        if not os.path.isfile(path):
+            raise SwarmCIError('Could not find runtimes file {}.'.format(path))
+        with open(path, 'r') as f:
+            runtimes.update({name: float(seconds) for name, seconds in json.load(f).items()})
+
+    return runtimes
+
+
+def recorded_shard_runtimes(runtimes, name):
+    """
+    :return: the runtimes of the shards recorded for a job, in shard order, however many there were.
+        shards which had no items are not run, and the job's parallelism may have changed since.
+    """
+    shards = []
+    for shard_name, seconds in runtimes.items():
+        match = SHARD_NAME.match(shard_name)
+        if match and match.group('job') == name:
+            shards.append((int(match.group('index')), seconds))
+    return [seconds for _, seconds in sorted(shards)]
+
+
+def build_plan(swarmci_config, runtimes, default_runtime=DEFAULT_RUNTIME):
+    """
+    :return: a list of (stage name, [SimJob]) tuples, and the names of the jobs without a recorded runtime
+    """
+    stages = swarmci_config.get('stages')
+    if type(stages) is not list:
+        raise SwarmCIError('The value of the "stages" key should be a list in the .swarmci file.')
+
+    missing = []
+
+    def runtime_of(name):
+        if name not in runtimes:
+            missing.append(name)
+        return runtimes.get(name, default_runtime)
+
+    plan = []
+    for stage in stages:
+        jobs = []
+        for job in stage['jobs']:
+            parallelism = get_parallelism(job)
+            if parallelism > 1:
+                shard_runtimes = recorded_shard_runtimes(runtimes, job['name'])
+                estimated = False
+                if not shard_runtimes:
+                    estimated = job['name'] not in runtimes
+                    shard_runtimes = [runtime_of(job['name']) / parallelism] * parallelism
+                jobs.append(SimJob(job['name'], job.get('image'), max(shard_runtimes), shard_runtimes, estimated))
+            elif job['name'] not in runtimes and recorded_shard_runtimes(runtimes, job['name']):
+                # no longer sharded, the shards' work runs in one container
+                runtime = sum(recorded_shard_runtimes(runtimes, job['name']))
+                jobs.append(SimJob(job['name'], job.get('image'), runtime))
+            else:
+                estimated = job['name'] not in runtimes
+                jobs.append(SimJob(job['name'], job.get('image'), runtime_of(job['name']), estimated=estimated))
+        plan.append((stage['name'], jobs))
+
+    return plan, missing
+
+
+class SimulationResult(object):
+    def __init__(self, model):
+        self.model = model
+        self.wall_time = 0.0
+        self.stages = []
+
+    @property
+    def critical_path(self):
+        """the job which finished last in each stage, as (stage name, job) tuples"""
+        return [(name, max(jobs, key=lambda j: j.end_time)) for name, start, end, jobs in self.stages if jobs]
+
+
+def simulate(plan, model):
+    """
+    runs the plan through a simulated scheduler.
+    stages run one after another. within a stage, jobs take an executor worker in order, then wait for a free
+    container slot on a node, preferring nodes which already have the job's image. each shard of a sharded job
+    takes a worker and a container slot of its own, and the job ends when its last shard ends.
+    """
+    result = SimulationResult(model)
+    images = [set() for _ in range(model.nodes)]
+    pulls = [{} for _ in range(model.nodes)]
+    now = 0.0
+
+    for stage_name, sim_jobs in plan:
+        stage_start = now
+        jobs = [SimJob(j.name, j.image, j.runtime, j.shard_runtimes, j.estimated) for j in sim_jobs]
+        worker_queue = deque()
+        for job in jobs:
+            if job.shard_runtimes:
+                worker_queue.extend(_Unit(job, runtime, parent=job) for runtime in job.shard_runtimes)
+            else:
+                worker_queue.append(_Unit(job, job.runtime))
+        node_queue = deque()
+        free_workers = model.max_workers
+        free_slots = [model.slots_per_node] * model.nodes
+        remaining_shards = {}
+        events = []
+        counter = itertools.count()
+
+        while worker_queue or node_queue or events:
+            while free_workers and worker_queue:
+                unit = worker_queue.popleft()
+                free_workers -= 1
+                if unit.job.start_time is None:
+                    unit.job.start_time = now
+                    if unit.parent:
+                        remaining_shards[unit.parent] = len(unit.parent.shard_runtimes)
+                node_queue.append(unit)
+
+            while node_queue and any(free_slots):
+                unit = node_queue.popleft()
+                node = _pick_node(unit.job.image, free_slots, images, pulls)
+                free_slots[node] -= 1
+                unit.node = node
+
+                ready = now
+                if unit.job.image not in images[node]:
+                    pulled = pulls[node].get(unit.job.image)
+                    if pulled is None:
+                        pulled = now + model.pull_time
+                        pulls[node][unit.job.image] = pulled
+                    ready = max(now, pulled)
+                unit.job.pull_time = max(unit.job.pull_time, ready - now)
+                unit.job.wait_time = max(unit.job.wait_time, now - stage_start)
+
+                overhead = model.container_overhead if unit.job.estimated else 0.0
+                end = ready + overhead + unit.runtime
+                heapq.heappush(events, (end, next(counter), unit))
+
+            if not events:
+                break
+
+            now, _, unit = heapq.heappop(events)
+            free_slots[unit.node] += 1
+            free_workers += 1
+            for node, node_pulls in enumerate(pulls):
+                for image, pulled in list(node_pulls.items()):
+                    if pulled <= now:
+                        images[node].add(image)
+                        del node_pulls[image]
+
+            if unit.parent:
+                remaining_shards[unit.parent] -= 1
+                if remaining_shards[unit.parent]:
+                    continue
+            unit.job.end_time = now
+
+        result.stages.append((stage_name, stage_start, now, jobs))
+
+    result.wall_time = now
+    return result
+
+
+def _pick_node(image, free_slots, images, pulls):
+    """prefers nodes which have, or are pulling, the image, then the node with the most free slots"""
+    candidates = [n for n, slots in enumerate(free_slots) if slots]
+    return max(candidates, key=lambda n: (image in images[n] or image in pulls[n], free_slots[n], -n))
+
+
+def sweep(plan, model, workers=None, nodes=None):
+    """
+    simulates the plan for every combination of executor workers and nodes
+    :return: a list of (max_workers, nodes, wall time) tuples
+    """
+    results = []
+    for worker_count in workers or [model.max_workers]:
+        for node_count in nodes or [model.nodes]:
+            result = simulate(plan, model.replace(max_workers=worker_count, nodes=node_count))
+            results.append((worker_count, node_count, result.wall_time))
+    return results
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(seconds, 60.0)
+    return '{} min {:.2f} sec'.format(int(minutes), seconds)
+
+
+def format_report(result, sweep_results=None, missing=None):
+    model = result.model
+    lines = ['Simulated {} workers, {} nodes with {} container slots each, {:.1f} sec image pulls, '
+             '{:.1f} sec container overhead'.format(model.max_workers, model.nodes, model.slots_per_node,
+                                                    model.pull_time, model.container_overhead),
+             'Predicted wall time - {}'.format(_duration(result.wall_time))]
+
+    for name, start, end, jobs in result.stages:
+        lines.append('Stage {} - {}'.format(name, _duration(end - start)))
+
+    lines.append('Critical path:')
+    for stage_name, job in result.critical_path:
+        lines.append('  {} / {} - runtime {}, waited {}, pulling {}'.format(
+            stage_name, job.name, _duration(job.runtime), _duration(job.wait_time), _duration(job.pull_time)))
+
+    if missing:
+        lines.append('No recorded runtime for {} jobs, assumed the default: {}'.format(
+            len(missing), ', '.join(sorted(set(missing)))))
+
+    if sweep_results:
+        lines.append('Sweep:')
+        lines.append('  {:>8} {:>6} {:>12}'.format('workers', 'nodes', 'wall time'))
+        for worker_count, node_count, wall_time in sweep_results:
+            lines.append('  {:>8} {:>6} {:>12.2f}'.format(worker_count, node_count, wall_time))
+
+    return lines
@@ -0,0 +1,142 @@
+"""
+Samples the resource usage of a running container, and summarizes it against the container's limits
+"""
+import threading
+import time
+from swarmci.util import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_CPU_PERIOD = 100000
+
+
+class ResourceSampler(object):
+    """
+    Samples docker stats for a container on a background thread, every interval seconds
+    """
+    def __init__(self, docker, container_id, interval, tm=None):
+        self.docker = docker
+        self.container_id = container_id
+        self.interval = interval
+        self.samples = []
+        self._tm = time.time if tm is None else tm
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stats-' + container_id[0:11], daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def sample(self):
+        stats = self.docker.stats(self.container_id, stream=False)
+        self.samples.append(parse_stats(stats, self._tm()))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+            except Exception as exc:
+                logger.debug('failed to sample stats for %s: %s', self.container_id, exc)
+            self._stopped.wait(self.interval)
+
+
+def parse_stats(stats, timestamp):
+    """reduces a docker stats response to the values we report on"""
+    cpu_stats = stats.get('cpu_stats', {})
+    precpu_stats = stats.get('precpu_stats', {})
+    memory_stats = stats.get('memory_stats', {})
+
+    cpu_delta = cpu_stats.get('cpu_usage', {}).get('total_usage', 0) - \
+        precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+    # the first sample of a container has no previous cpu sample to measure against
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0) \
+        if precpu_stats.get('system_cpu_usage') else 0
+    online_cpus = cpu_stats.get('online_cpus') or len(cpu_stats.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+
+    block_read = block_write = 0
+    for entry in (stats.get('blkio_stats', {}).get('io_service_bytes_recursive') or []):
+        if entry.get('op') == 'Read':
+            block_read += entry.get('value', 0)
+        elif entry.get('op') == 'Write':
+            block_write += entry.get('value', 0)
+
+    networks = (stats.get('networks') or {}).values()
+
+    return {
+        'time': timestamp,
+        'cpu': (float(cpu_delta) / system_delta) * online_cpus if cpu_delta > 0 and system_delta > 0 else 0.0,
+        'memory': memory_stats.get('usage', 0),
+        'memory_max': memory_stats.get('max_usage', memory_stats.get('usage', 0)),
+        'memory_limit': memory_stats.get('limit'),
+        'block_read': block_read,
+        'block_write': block_write,
+        'net_rx': sum(n.get('rx_bytes', 0) for n in networks),
+        'net_tx': sum(n.get('tx_bytes', 0) for n in networks)
+    }
+
+
+def get_limits(host_config):
+    """returns the requested (cpus, memory bytes) limits from a host config, None when unlimited"""
+    host_config = host_config or {}
+
+    cpu_limit = None
+    if host_config.get('CpuQuota'):
+        cpu_limit = float(host_config['CpuQuota']) / (host_config.get('CpuPeriod') or DEFAULT_CPU_PERIOD)
+
+    return cpu_limit, host_config.get('Memory') or None
+
+
+def summarize(samples, cpu_limit=None, memory_limit=None):
+    """
+    summarizes samples into peak and average usage
+    :param samples: samples returned by parse_stats
+    :param cpu_limit: requested cpus, if any
+    :param memory_limit: requested memory in bytes, if any. defaults to the limit docker reports
+    """
+    if not samples:
+        return None
+
+    last = samples[-1]
+    return {
+        'samples': len(samples),
+        'cpu_peak': max(s['cpu'] for s in samples),
+        'cpu_avg': sum(s['cpu'] for s in samples) / len(samples),
+        'cpu_limit': cpu_limit,
+        'memory_peak': max(max(s['memory'], s['memory_max']) for s in samples),
+        'memory_avg': sum(s['memory'] for s in samples) / len(samples),
+        'memory_limit': memory_limit or last['memory_limit'],
+        'block_read': last['block_read'],
+        'block_write': last['block_write'],
+        'net_rx': last['net_rx'],
+        'net_tx': last['net_tx']
+    }
+
+
+def _mib(value):
+    return '{:.1f} MiB'.format(value / 1048576.0)
+
+
+def format_report(name, usage):
+    """formats a summary as returned by summarize into a human readable report"""
+    if not usage:
+        return 'Resource Usage - {} - no samples collected'.format(name)
+
+    cpu_limit = '{:.2f}'.format(usage['cpu_limit']) if usage['cpu_limit'] else 'unlimited'
+    memory_limit = 'unlimited'
+    if usage['memory_limit']:
+        memory_limit = '{}, peak is {:.0%}'.format(_mib(usage['memory_limit']),
+                                                   usage['memory_peak'] / float(usage['memory_limit']))
+
+    return ('Resource Usage - {} - '
+            'cpu peak {:.2f} avg {:.2f} limit {} cores, '
+            'memory peak {} avg {} limit {}, '
+            'block io read {} write {}, '
+            'network rx {} tx {}').format(name,
+                                          usage['cpu_peak'], usage['cpu_avg'], cpu_limit,
+                                          _mib(usage['memory_peak']), _mib(usage['memory_avg']), memory_limit,
+                                          _mib(usage['block_read']), _mib(usage['block_write']),
+                                          _mib(usage['net_rx']), _mib(usage['net_tx']))
@@ -0,0 +1,218 @@
+"""
+Incremental, byte-level readers for the output of a non-TTY docker exec.
+Output is demultiplexed into stdout/stderr frames and split into lines without decoding;
+callers decode a line only when it is actually emitted.
+Also holds the sinks which collect the output of commands running concurrently.
+"""
+import gzip
+import os
+import re
+import struct
+import threading
+from docker.utils.socket import read as socket_read
+from swarmci.util import get_logger
+from swarmci.errors import SwarmCIError
+
+logger = get_logger(__name__)
+
+STDOUT = 1
+STDERR = 2
+
+HEADER_SIZE = 8
+READ_SIZE = 65536
+ARCHIVE_BUFFER_SIZE = 65536
+
+
+def read_socket(sock, n=READ_SIZE):
+    """yields raw chunks read from sock until it is closed"""
+    while True:
+        data = socket_read(sock, n)
+        if not data:
+            break
+        yield data
+
+
+class Demuxer(object):
+    """
+    Splits the multiplexed exec stream into (stream, payload) frames.
+    Chunks may end anywhere, including within a frame header; incomplete frames are carried over.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        :param data: a chunk of raw bytes read from the exec socket
+        :return: a list of (stream, payload) tuples for the frames completed by this chunk
+        """
+        self._buffer.extend(data)
+
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= HEADER_SIZE:
+            stream, size = struct.unpack_from('>BxxxL', self._buffer, offset)
+            end = offset + HEADER_SIZE + size
+            if len(self._buffer) < end:
+                break
+            frames.append((stream, bytes(self._buffer[offset + HEADER_SIZE:end])))
+            offset = end
+
+        del self._buffer[:offset]
+        return frames
+
+    @property
+    def pending(self):
+        """number of bytes received for frames which are not yet complete"""
+        return len(self._buffer)
+
+
+class LineSplitter(object):
+    """
+    Splits a byte stream into lines, carrying partial lines over to the next chunk
+    """
+    def __init__(self):
+        self._partial = bytearray()
+
+    def feed(self, data):
+        """
+        :param data: a chunk of bytes
+        :return: a list of the lines completed by this chunk, as bytes without line endings
+        """
+        if b'\n' not in data:
+            self._partial.extend(data)
+            return []
+
+        lines = data.split(b'\n')
+        if self._partial:
+            self._partial.extend(lines[0])
+            lines[0] = bytes(self._partial)
+        self._partial = bytearray(lines.pop())
+
+        return [line[:-1] if line.endswith(b'\r') else line for line in lines]
+
+    def flush(self):
+        """
+        :return: the trailing partial line, if any, as bytes
+        """
+        if not self._partial:
+            return None
+
+        line = bytes(self._partial)
+        self._partial = bytearray()
+        return line[:-1] if line.endswith(b'\r') else line
+
+
+def iter_lines(chunks):
+    """
+    demultiplexes and splits raw exec output into lines
+    :param chunks: an iterable of raw bytes read from the exec socket
+    :return: a generator of (stream, line) tuples, where line is bytes
+    """
+    demuxer = Demuxer()
+    splitters = {STDOUT: LineSplitter(), STDERR: LineSplitter()}
+
+    for chunk in chunks:
+        for stream, payload in demuxer.feed(chunk):
+            splitter = splitters.setdefault(stream, LineSplitter())
+            for line in splitter.feed(payload):
+                yield stream, line
+
+    for stream, splitter in splitters.items():
+        line = splitter.flush()
+        if line is not None:
+            yield stream, line
+
+
+def iter_raw_lines(chunks):
+    """
+    splits the raw output of an exec with a tty, which is not multiplexed, into lines
+    :return: a generator of lines as bytes
+    """
+    splitter = LineSplitter()
+    for chunk in chunks:
+        for line in splitter.feed(chunk):
+            yield line
+
+    line = splitter.flush()
+    if line is not None:
+        yield line
+
+
+def decode(line):
+    return line.decode('utf-8', errors='replace')
+
+
+class OutputSink(object):
+    """
+    Collects the output lines of one command, so that commands running concurrently in the same
+    container do not interleave their output. The lines are logged as one block on flush.
+    """
+    _log_lock = threading.Lock()
+
+    def __init__(self, name):
+        self.name = name
+        self.lines = []
+
+    def __call__(self, line):
+        self.lines.append(line)
+
+    def flush(self):
+        with self._log_lock:
+            logger.info('----BEGIN OUTPUT [%s]----', self.name)
+            for line in self.lines:
+                logger.info(line)
+            logger.info('----END OUTPUT [%s]----', self.name)
+
+
+def compile_patterns(patterns):
+    """
+    compiles patterns into a single regex, matched against raw output lines
+    :param patterns: a list of regex strings, or a single one
+    :return: the compiled bytes regex, or None if there are no patterns
+    """
+    if not patterns:
+        return None
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    try:
+        return re.compile(b'|'.join(b'(?:' + str(p).encode('utf-8') + b')' for p in patterns))
+    except re.error as exc:
+        raise SwarmCIError('Invalid fail_on_output pattern in the .swarmci file: {}'.format(exc))
+
+
+class LogArchive(object):
+    """
+    Writes the output lines of a job to a gzip file as they stream, buffering writes to the compressor.
+    Appending to an existing archive adds a gzip member, which gzip reads as one stream.
+    """
+    def __init__(self, path, compresslevel=6):
+        self.path = path
+        self.compresslevel = compresslevel
+        self._file = None
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+
+    def write(self, line):
+        """:param line: a line of output as bytes, without its line ending"""
+        with self._lock:
+            self._buffer += line
+            self._buffer += b'\n'
+            if len(self._buffer) >= ARCHIVE_BUFFER_SIZE:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = gzip.open(self.path, 'ab', compresslevel=self.compresslevel)
+        self._file.write(bytes(self._buffer))
+        self._buffer = bytearray()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,272 @@
+"""
+Content-addressed, incremental sync of a workspace into a container.
+The target keeps a manifest of the hash of every file it holds; only files which changed are sent,
+as a delta tar, and files which were removed from the workspace are deleted from the target.
+The commands of a job may change the target after it was synced, so the files the manifest holds as unchanged
+are checked in the container before they are skipped.
+"""
+import hashlib
+import json
+from io import BytesIO
+import os
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import Future
+from swarmci.util import get_logger
+
+logger = get_logger(__name__)
+
+MANIFEST_NAME = '.swarmci-manifest.json'
+READ_SIZE = 1048576
+DELETE_BATCH_SIZE = 500
+VERIFY_BATCH_SIZE = 500
+
+# prints the mode and name of each path, then the sha256 of each. errors, such as for missing files, are dropped
+VERIFY_SCRIPT = ('cd "$1" 2>/dev/null || exit 0; shift; '
+                 'stat -c "%a %n" -- "$@" 2>/dev/null; echo --; sha256sum -- "$@" 2>/dev/null; exit 0')
+
+
+def diff(local, remote):
+    """
+    :param local: manifest of the workspace, relpath -> digest
+    :param remote: manifest of the target, relpath -> digest
+    :return: a tuple of (sorted paths to send, sorted paths to delete)
+    """
+    changed = sorted(path for path, digest in local.items() if remote.get(path) != digest)
+    deleted = sorted(path for path in remote if path not in local)
+    return changed, deleted
+
+
+def verify(cn, dest, manifest):
+    """
+    checks the files of a manifest against the container, with one exec per batch of files.
+    symlinks are only checked to still be symlinks.
+    :param manifest: relpath -> digest of the files to check
+    :return: the part of the manifest which still holds
+    """
+    held = {}
+    paths = sorted(manifest)
+    for i in range(0, len(paths), VERIFY_BATCH_SIZE):
+        batch = paths[i:i + VERIFY_BATCH_SIZE]
+        lines = []
+        cn.execute(['sh', '-c', VERIFY_SCRIPT, 'sh', dest] + batch, out_func=lines.append, tty=False, internal=True)
+
+        split = lines.index('--') if '--' in lines else len(lines)
+        modes = dict(reversed(line.split(' ', 1)) for line in lines[:split] if ' ' in line)
+        # sha256sum escapes names with a backslash or newline, which are left unverified
+        hashes = {line[66:]: line[:64] for line in lines[split + 1:] if len(line) > 66 and not line.startswith('\\')}
+
+        for path in batch:
+            digest = manifest[path]
+            if digest.startswith('link:'):
+                # the mode of a symlink is always 777, unlike a file a command would leave in its place
+                holds = modes.get(path) == '777'
+            else:
+                holds = '{}:{}'.format(hashes.get(path), modes.get(path)) == digest
+            if holds:
+                held[path] = digest
+
+    return held
+
+
+class HashCache(object):
+    """
+    Remembers the digest of each file by its size and modification time, so unchanged files are hashed once.
+    Optionally persisted to a json file between builds.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._digests = {}
+        self._lock = threading.Lock()
+        self.hashed = 0
+
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    self._digests = {k: tuple(v) for k, v in json.load(f).items()}
+            except ValueError:
+                logger.warning('ignoring unreadable hash cache %s', path)
+
+    def digest(self, full_path, st):
+        """returns the digest of a file's content and mode"""
+        key = (st.st_size, st.st_mtime_ns, st.st_mode)
+        with self._lock:
+            cached = self._digests.get(full_path)
+        if cached and tuple(cached[:3]) == key:
+            return cached[3]
+
+        sha = hashlib.sha256()
+        with open(full_path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_SIZE), b''):
+                sha.update(block)
+        digest = '{}:{:o}'.format(sha.hexdigest(), st.st_mode & 0o777)
+
+        with self._lock:
+            self._digests[full_path] = key + (digest,)
+            self.hashed += 1
+        return digest
+
+    def save(self):
+        if not self.path:
+            return
+
+        with self._lock:
+            data = json.dumps(self._digests)
+        tmp_path = '{}.{}.{}.tmp'.format(self.path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def build_manifest(src, hash_cache):
+    """
+    hashes every file and symlink under src
+    :return: a dict of relpath -> digest
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for name in files:
+            full_path = os.path.join(root, name)
+            rel_path = os.path.relpath(full_path, src).replace(os.sep, '/')
+            if rel_path == MANIFEST_NAME:
+                continue
+
+            st = os.lstat(full_path)
+            if os.path.islink(full_path):
+                manifest[rel_path] = 'link:' + os.readlink(full_path)
+            elif os.path.isfile(full_path):
+                manifest[rel_path] = hash_cache.digest(full_path, st)
+
+        for name in dirs:
+            full_path = os.path.join(root, name)
+            if os.path.islink(full_path):
+                manifest[os.path.relpath(full_path, src).replace(os.sep, '/')] = 'link:' + os.readlink(full_path)
+
+    return manifest
+
+
+def write_delta(src, paths, manifest, fileobj):
+    """writes a tar of the given paths, followed by the new manifest, to fileobj"""
+    with tarfile.open(mode='w', fileobj=fileobj) as t:
+        for path in paths:
+            t.add(os.path.join(src, path), arcname=path, recursive=False)
+
+        data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        t.addfile(info, fileobj=BytesIO(data))
+
+
+class WorkspaceSync(object):
+    """
+    Syncs workspaces into containers for a whole build.
+    Each workspace is scanned once per build, and identical deltas are built once and shared between jobs.
+    """
+    def __init__(self, hash_cache=None, tmp_dir=None):
+        self.hash_cache = hash_cache or HashCache()
+        self.tmp_dir = tmp_dir
+        self._manifests = {}
+        self._deltas = {}
+        self._lock = threading.Lock()
+
+    def _once(self, cache, key, build):
+        """
+        returns cache[key], calling build to create it the first time.
+        build runs outside the lock, so different keys are built concurrently, while callers wanting a key which is
+        being built wait for it.
+        """
+        with self._lock:
+            future = cache.get(key)
+            building = future is None
+            if building:
+                future = cache[key] = Future()
+
+        if building:
+            try:
+                future.set_result(build())
+            except Exception as exc:
+                with self._lock:
+                    cache.pop(key, None)
+                future.set_exception(exc)
+
+        return future.result()
+
+    def manifest(self, src):
+        src = os.path.abspath(src)
+
+        def build():
+            logger.debug('building manifest of %s', src)
+            manifest = build_manifest(src, self.hash_cache)
+            self.hash_cache.save()
+            return manifest
+
+        return self._once(self._manifests, src, build)
+
+    def delta(self, src, paths):
+        """returns the path of a delta tar for paths, building it if no other job needed the same delta"""
+        src = os.path.abspath(src)
+        manifest = self.manifest(src)
+        key = hashlib.sha256(json.dumps([src] + [(p, manifest[p]) for p in paths]).encode('utf-8')).hexdigest()
+
+        def build():
+            logger.debug('building delta %s of %s files', key[0:12], len(paths))
+            fd, path = tempfile.mkstemp(prefix='swarmci-delta-', suffix='.tar', dir=self.tmp_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write_delta(src, paths, manifest, f)
+            except Exception:
+                os.remove(path)
+                raise
+            return path
+
+        return self._once(self._deltas, key, build)
+
+    def sync(self, cn, src, dest):
+        """
+        brings dest in the container up to date with src
+        :return: a tuple of (number of files sent, number of files deleted)
+        """
+        local = self.manifest(src)
+
+        remote_data = cn.get_file('{}/{}'.format(dest.rstrip('/'), MANIFEST_NAME))
+        if remote_data is None:
+            remote = {}
+            cn.execute(['mkdir', '-p', dest])
+        else:
+            remote = json.loads(remote_data.decode('utf-8'))
+            unchanged = {path: digest for path, digest in remote.items() if local.get(path) == digest}
+            held = verify(cn, dest, unchanged)
+            if len(held) < len(unchanged):
+                logger.warning('%s files in %s:%s changed since they were synced, sending them again',
+                               len(unchanged) - len(held), cn.name, dest)
+                remote = {path: digest for path, digest in remote.items() if path not in unchanged or path in held}
+
+        changed, deleted = diff(local, remote)
+        logger.info('syncing %s to %s:%s, sending %s files, deleting %s, %s unchanged',
+                    src, cn.name, dest, len(changed), len(deleted), len(local) - len(changed))
+
+        if not changed and not deleted:
+            return 0, 0
+
+        for i in range(0, len(deleted), DELETE_BATCH_SIZE):
+            batch = deleted[i:i + DELETE_BATCH_SIZE]
+            cn.execute(['rm', '-rf', '--'] + ['{}/{}'.format(dest.rstrip('/'), p) for p in batch])
+
+        with open(self.delta(src, changed), 'rb') as f:
+            cn.put_archive(dest, f)
+
+        return len(changed), len(deleted)
+
+    def close(self):
+        """removes the delta tars built during the build"""
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+
+        for future in deltas.values():
+            if future.done() and future.exception() is None:
+                try:
+                    os.remove(future.result())
+                except OSError:
+                    pass
@@ -1,8 +1,24 @@
+import itertools
+import os
+import re
 import time
 from uuid import uuid4
 from enum import Enum
-from swarmci.util import get_logger, raise_
-from swarmci.runners import SerialRunner, ThreadedRunner, DockerRunner
+from concurrent.futures import ThreadPoolExecutor
+from swarmci import sharding, metrics
+from swarmci.journal import input_hash, SUCCEEDED, FAILED, TIMED_OUT
+from swarmci.util import get_logger, raise_, parse_duration
+from swarmci.runners import SerialRunner, ThreadedRunner, GroupRunner, DockerRunner
+from swarmci.backends import DEFAULT_URL
+from swarmci.streams import OutputSink
+from swarmci.sync import WorkspaceSync
+from swarmci.errors import TaskFailedError, TaskTimeoutError
+
+
+logger = get_logger(__name__)
+
+# the most commands of one parallel group which run at the same time
+MAX_GROUP_WORKERS = 10
 
 
 class TaskType(Enum):
@@ -10,12 +26,25 @@ class TaskType(Enum):
     STAGE = 2
     JOB = 3
     COMMAND = 4
+    GROUP = 5
+
+
+_PRETTY_TASK_TYPES = {task_type: task_type.name.lower().capitalize() for task_type in TaskType}
+
+# ids only need to be unique within the driver, and are much cheaper than uuids
+_ids = itertools.count(1)
 
 
 class Task(object):
-    def __init__(self, name, task_type, exec_func, tm=None):
-        self.logger = get_logger(__name__)
-        self.id = str(uuid4())
+    """
+    A unit of work in the build hierarchy.
+    Tasks are slotted and share their listeners list, so that plans with many thousands of commands stay small.
+    """
+    __slots__ = ('id', '_tm', '_name', '_task_type', 'exec_func', 'input_hash', 'listeners', 'duplicate_of', 'after',
+                 'start_time', 'end_time', 'runtime', '_successful', '_results', '_error')
+
+    def __init__(self, name, task_type, exec_func, tm=None, input_hash=None, listeners=None):
+        self.id = next(_ids)
         self._tm = time.time if tm is None else tm
 
         self._name = name or raise_(ValueError('tasks must have a name'))
@@ -27,7 +56,11 @@ class Task(object):
 
         self.exec_func = exec_func if callable(exec_func) else raise_(ValueError('exec_func must be a callable'))
 
-        self._task_type_pretty = str(self.task_type.name).lower().capitalize()
+        self.input_hash = input_hash
+        self.listeners = listeners or ()
+        self.duplicate_of = None
+        # tasks which must end before this one runs, see ThreadedRunner.schedule
+        self.after = ()
 
         self.start_time = None
         self.end_time = None
@@ -50,7 +83,7 @@ class Task(object):
 
     @property
     def pretty_task_type(self):
-        return self._task_type_pretty
+        return _PRETTY_TASK_TYPES[self._task_type]
 
     @property
     def results(self):
@@ -64,32 +97,108 @@ class Task(object):
     def error(self):
         return self._error
 
+    @property
+    def timed_out(self):
+        return isinstance(self._error, TaskTimeoutError)
+
+    @property
+    def outcome(self):
+        if self._successful:
+            return SUCCEEDED
+        return TIMED_OUT if self.timed_out else FAILED
+
     def execute(self, *args, **kwargs):
         end_msg_fmt = '{} Ended {} - {}'
 
+        pretty_task_type = self.pretty_task_type
+
         self.start_time = self._tm()
-        self.logger.info('Starting %s - %s', self._task_type_pretty, self.name)
+        logger.info('Starting %s - %s', pretty_task_type, self.name)
         try:
             self.results = self.exec_func(*args, **kwargs)
             self._successful = True
-            self.logger.info(end_msg_fmt.format(self._task_type_pretty, "successfully", self.name))
+            logger.info(end_msg_fmt.format(pretty_task_type, "successfully", self.name))
         except Exception as exc:
             self._successful = False
             self._error = exc
-            result_msg = end_msg_fmt.format(self._task_type_pretty, "with an error", self.name)
-            self.logger.error(result_msg)
+            result_msg = end_msg_fmt.format(pretty_task_type, "with an error", self.name)
+            logger.error(result_msg)
         finally:
             self.end_time = self._tm()
             self.runtime = self.end_time - self.start_time
             minutes, seconds = divmod(self.runtime, 60.0)
-            self.logger.info('%s Runtime - %s min %.2f sec', self._task_type_pretty, int(minutes), seconds)
+            logger.info('%s Runtime - %s min %.2f sec', pretty_task_type, int(minutes), seconds)
+
+            task_type = self._task_type.name.lower()
+            metrics.TASKS.inc(type=task_type, outcome=self.outcome)
+            metrics.TASK_SECONDS.observe(self.runtime, type=task_type)
+
+            for listener in self.listeners:
+                listener(self)
+
+
+class LazyTasks(object):
+    """
+    A sequence of tasks which are created from their specs only while being iterated,
+    so a plan does not hold a task and closures for every command of every job until the job runs.
+    Each task is created once, later passes and indexing see the same tasks.
+    """
+    __slots__ = ('specs', 'create', '_tasks')
+
+    def __init__(self, specs, create):
+        """
+        :param specs: a list of task specs, such as the commands of a job
+        :param create: a func creating the task for a spec
+        """
+        self.specs = specs
+        self.create = create
+        self._tasks = None
+
+    def __len__(self):
+        return len(self.specs)
+
+    def _task(self, index):
+        if self._tasks is None:
+            self._tasks = []
+        while len(self._tasks) <= index:
+            self._tasks.append(self.create(self.specs[len(self._tasks)]))
+        return self._tasks[index]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.specs)
+        if not 0 <= index < len(self.specs):
+            raise IndexError('task index out of range')
+        return self._task(index)
+
+    def __iter__(self):
+        for index in range(len(self.specs)):
+            yield self._task(index)
 
 
 class TaskFactory(object):
-    def __init__(self, runners=None):
+    def __init__(self, runners=None, journal=None, listeners=None, workspace_sync=None, log_dir=None, backend=None,
+                 registry=None, docker_url=DEFAULT_URL):
+        """
+        :param log_dir: a directory to archive the output of each job to, gzipped
+        :param backend: the backend shared by the job containers, each job runner creates a docker client otherwise
+        :param docker_url: the docker api url of the clients created by the job runners
+        :param registry: the container registry of the build, which labels its containers with its build id
+        """
+        self.journal = journal
+        self.workspace_sync = workspace_sync
+        self.log_dir = log_dir
+        self.backend = backend
+        self.registry = registry
+        self.docker_url = docker_url
+        self.listeners = list(listeners or [])
+        if journal:
+            self.listeners.append(journal.record)
+
         self.runners = {
             'job': DockerRunner,
             'stage': ThreadedRunner,
+            'group': GroupRunner,
             'build': SerialRunner
         }
 
@@ -99,6 +208,7 @@ class TaskFactory(object):
     def create(self, task_type, *args, **kwargs):
         switcher = {
             TaskType.COMMAND: self.create_command_task,
+            TaskType.GROUP: self.create_command_group_task,
             TaskType.JOB: self.create_job_task,
             TaskType.STAGE: self.create_stage_task,
             TaskType.BUILD: self.create_build_task
@@ -107,19 +217,132 @@ class TaskFactory(object):
         func = switcher.get(task_type, lambda: raise_(ValueError("Unknown task_type {}".format(task_type))))
         return func(*args, **kwargs)
 
-    def create_command_task(self, cmd, run_func=DockerRunner.run_in_docker):
-        def command_func(*args, **kwargs):
-            return run_func(cmd, *args, **kwargs)
+    def create_command_task(self, cmd, run_func=DockerRunner.run_in_docker, timeout=None, buffered=False):
+        """
+        :param buffered: collect the command's output in its own sink, for commands running concurrently
+        """
+        timeout = parse_duration(timeout)
 
-        return Task(cmd, TaskType.COMMAND, exec_func=command_func)
+        def command_func(*args, **kwargs):
+            if buffered:
+                kwargs['sink'] = OutputSink(cmd)
+            return run_func(cmd, *args, timeout=timeout, **kwargs)
+
+        return Task(cmd, TaskType.COMMAND, exec_func=command_func, listeners=self.listeners)
+
+    def create_command_group_task(self, commands):
+        """
+        creates a task which runs its commands concurrently, as separate execs in the job's container.
+        at most MAX_GROUP_WORKERS of them run at a time.
+        """
+        runner = self.runners['group']
+
+        def group_func(cn):
+            try:
+                max_workers = min(len(commands), MAX_GROUP_WORKERS)
+                with ThreadPoolExecutor(max_workers) as thread_pool_executor:
+                    runner(thread_pool_executor).run_all(commands, cn=cn)
+            finally:
+                task.results = [{
+                    'cmd': command.name,
+                    'successful': command.successful,
+                    'exit_code': 0 if command.successful else getattr(command.error, 'exit_code', None),
+                    'output': command.results if command.successful else getattr(command.error, 'output', None),
+                    'runtime': command.runtime
+                } for command in commands]
+            return task.results
+
+        name = 'parallel [{}]'.format(', '.join(command.name for command in commands))
+        task = Task(name, TaskType.GROUP, exec_func=group_func, listeners=self.listeners)
+        return task
+
+    def create_job_task(self, job, commands, shards=None, duplicate_of=None):
+        if duplicate_of:
+            return self.create_duplicate_job_task(job, duplicate_of)
+        if shards:
+            return self.create_sharded_job_task(job, shards)
 
-    def create_job_task(self, job, commands):
         runner = self.runners['job']
 
         def job_func():
-            return runner(job['image']).run_all(commands)
-
-        return Task(job['name'], TaskType.JOB, exec_func=job_func)
+            if self.journal and self.journal.should_skip(task):
+                return None
+
+            job_runner = runner(job['image'], env=job.get('env'), name=job['name'],
+                                stats_interval=job.get('stats_interval'), tty=job.get('tty', True),
+                                timeout=parse_duration(job.get('timeout')), workspace=job.get('workspace'),
+                                workspace_sync=self.workspace_sync, fail_on_output=job.get('fail_on_output'),
+                                log_path=self.log_path(job, task), url=self.docker_url, docker=self.backend,
+                                registry=self.registry,
+                                **job.get('resources', {}))
+            try:
+                return job_runner.run_all(commands)
+            finally:
+                task.results = job_runner.results
+
+        task = Task(job['name'], TaskType.JOB, exec_func=job_func, input_hash=self.input_hash(job),
+                    listeners=self.listeners)
+        return task
+
+    def input_hash(self, job):
+        """the input hash of a job, which covers the files of its workspace, as scanned once per build"""
+        workspace = job.get('workspace')
+        if not workspace:
+            return input_hash(job)
+        manifest = (self.workspace_sync or WorkspaceSync()).manifest(workspace.get('src', '.'))
+        return input_hash(job, manifest)
+
+    def log_path(self, job, task):
+        """the task id tells apart jobs whose names are the same once made safe for a file name, such as a/b and a b"""
+        if not self.log_dir:
+            return None
+        return os.path.join(self.log_dir, '{}.{}.log.gz'.format(re.sub(r'[^\w.-]+', '_', job['name']), task.id))
+
+    def create_sharded_job_task(self, job, shards):
+        """
+        creates a job which collects the outcome of its shard jobs.
+        the shards run after it is scheduled, in the stage's pool, each in its own container,
+        and the job itself only runs once they have all ended
+        :param shards: a list of (shard job, shard task) tuples
+        """
+        def sharded_job_func():
+            if self.journal and self.journal.should_skip(task):
+                return None
+
+            task.results = sharding.aggregate(shards)
+            failed = [shard_task.name for _, shard_task in shards if not shard_task.successful]
+            if failed:
+                raise TaskFailedError('shards of job {} failed: {}'.format(task.name, ', '.join(failed)))
+            return task.results
+
+        task = Task(job['name'], TaskType.JOB, exec_func=sharded_job_func, input_hash=self.input_hash(job),
+                    listeners=self.listeners)
+        task.after = tuple(shard_task for _, shard_task in shards)
+        return task
+
+    def create_duplicate_job_task(self, job, original):
+        """
+        creates a job which runs nothing, and instead reuses the outcome and results of an identical job.
+        it runs after the original, so it does not hold a worker while the original runs.
+        :param original: the task of the first job in the build with the same inputs
+        """
+        def duplicate_job_func():
+            if original.end_time is None:
+                raise TaskFailedError('identical job {} has not run'.format(original.name))
+
+            logger.info('Job %s is identical to job %s, reusing its outcome', task.name, original.name)
+            task.results = original.results
+            if original.timed_out:
+                raise TaskTimeoutError('identical job {} timed out'.format(original.name))
+            if not original.successful:
+                raise TaskFailedError('identical job {} failed'.format(original.name))
+            return task.results
+
+        task = Task(job['name'], TaskType.JOB, exec_func=duplicate_job_func, input_hash=self.input_hash(job),
+                    listeners=self.listeners)
+        task.duplicate_of = original.name
+        task.after = (original,)
+        return task
 
     def create_stage_task(self, stage, jobs, thread_pool_executor):
         runner = self.runners['stage']
@@ -127,12 +350,12 @@ class TaskFactory(object):
         def stage_func():
             return runner(thread_pool_executor).run_all(jobs)
 
-        return Task(stage['name'], TaskType.STAGE, exec_func=stage_func)
+        return Task(stage['name'], TaskType.STAGE, exec_func=stage_func, listeners=self.listeners)
 
-    def create_build_task(self, stages):
+    def create_build_task(self, stages, build_id=None):
         runner = self.runners['build']
 
         def build_func():
             return runner().run_all(stages)
 
-        return Task(str(uuid4()), TaskType.BUILD, exec_func=build_func)
+        return Task(build_id or str(uuid4()), TaskType.BUILD, exec_func=build_func, listeners=self.listeners)
@@ -2,9 +2,10 @@ import logging
 
 
 def get_logger(name):
-    """creates a logger with NullHandler"""
+    """returns the logger for name, adding a NullHandler the first time"""
     _logger = logging.getLogger(name)
-    _logger.addHandler(logging.NullHandler())
+    if not any(isinstance(h, logging.NullHandler) for h in _logger.handlers):
+        _logger.addHandler(logging.NullHandler())
     return _logger
 
 
@@ -12,3 +13,27 @@ def get_logger(name):
 # x = y or raise_(ValueError)
 def raise_(ex):
     raise ex
+
+
+def parse_duration(value):
+    """
+    parses a duration in seconds, such as 90, '90s', '10m' or '1h'
+    :return: the duration in seconds, or None if value is None
+    """
+    if value is None:
+        return None
+
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    text = str(value).strip()
+    try:
+        if text and text[-1] in units:
+            seconds = float(text[:-1]) * units[text[-1]]
+        else:
+            seconds = float(text)
+    except ValueError:
+        raise ValueError('invalid duration {}'.format(value))
+
+    if seconds <= 0:
+        raise ValueError('invalid duration {}, it should be greater than 0'.format(value))
+
+    return seconds
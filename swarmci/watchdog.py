@@ -0,0 +1,108 @@
+"""
+A single background thread which fires callbacks when their deadline expires, used to enforce timeouts
+"""
+import heapq
+import itertools
+import threading
+import time
+from swarmci.util import get_logger
+
+logger = get_logger(__name__)
+
+
+class Watchdog(object):
+    """
+    Keeps a heap of deadlines, and calls the callback of each deadline which expires before it is cancelled.
+    The thread is started on the first schedule.
+    """
+    def __init__(self, tm=None):
+        self._tm = time.monotonic if tm is None else tm
+        self._heap = []
+        self._live = set()
+        self._cancelled = set()
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, timeout, callback):
+        """
+        :param timeout: seconds from now
+        :param callback: a func taking no arguments, called on the watchdog thread
+        :return: a handle to cancel the deadline with
+        """
+        handle = next(self._counter)
+        with self._cond:
+            heapq.heappush(self._heap, (self._tm() + timeout, handle, callback))
+            self._live.add(handle)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='watchdog', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+        return handle
+
+    def cancel(self, handle):
+        with self._cond:
+            if handle in self._live:
+                self._live.discard(handle)
+                self._cancelled.add(handle)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    @property
+    def pending(self):
+        with self._cond:
+            return len(self._live)
+
+    def _next_expired(self):
+        """waits for the next deadline to expire, returning its callback, or None when stopped"""
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                deadline, handle, callback = self._heap[0]
+                if handle in self._cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled.discard(handle)
+                    continue
+
+                remaining = deadline - self._tm()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+
+                heapq.heappop(self._heap)
+                self._live.discard(handle)
+                return callback
+
+        return None
+
+    def _run(self):
+        while True:
+            callback = self._next_expired()
+            if callback is None:
+                return
+
+            try:
+                callback()
+            except Exception as exc:
+                logger.exception('watchdog callback failed', exc_info=exc)
+
+
+_default_watchdog = None
+_default_watchdog_lock = threading.Lock()
+
+
+def get_watchdog():
+    """returns the watchdog shared by the whole driver"""
+    global _default_watchdog
+    with _default_watchdog_lock:
+        if _default_watchdog is None:
+            _default_watchdog = Watchdog()
+        return _default_watchdog
@@ -0,0 +1,66 @@
+"""
+Memory and construction time of the build hierarchy for generated plans of 100k commands.
+These only run with --benchmark, add -s to see the measurements.
+"""
+import time
+import tracemalloc
+import pytest
+from assertpy import assert_that
+from swarmci import build_tasks_hierarchy, build_command_task
+from swarmci.task import TaskFactory
+
+STAGES = 10
+JOBS_PER_STAGE = 100
+COMMANDS_PER_JOB = 100
+
+pytestmark = pytest.mark.benchmark
+
+
+def create_config():
+    return {
+        'stages': [{
+            'name': 'stage{}'.format(s),
+            'jobs': [{
+                'name': 'job{}-{}'.format(s, j),
+                'image': 'foo',
+                'commands': ['make test-{}-{}-{}'.format(s, j, c) for c in range(COMMANDS_PER_JOB)]
+            } for j in range(JOBS_PER_STAGE)]
+        } for s in range(STAGES)]
+    }
+
+
+def measure(func):
+    """:return: the result of func, the seconds it took, and the bytes it allocated which are still in use"""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, allocated
+
+
+def describe_large_plan():
+    def expect_hierarchy_of_100k_commands_built_quickly_in_little_memory():
+        config = create_config()
+
+        build_task, seconds, allocated = measure(lambda: build_tasks_hierarchy(config, TaskFactory()))
+
+        print('\nhierarchy of {} commands: {:.3f} sec, {:.1f} KiB'.format(
+            STAGES * JOBS_PER_STAGE * COMMANDS_PER_JOB, seconds, allocated / 1024.0))
+        assert_that(build_task).is_not_none()
+        assert_that(allocated).is_less_than(2 * 1024 * 1024)
+        assert_that(seconds).is_less_than(5)
+
+    def expect_100k_command_tasks_compact():
+        task_factory = TaskFactory()
+        commands = [cmd for stage in create_config()['stages'] for job in stage['jobs'] for cmd in job['commands']]
+
+        tasks, seconds, allocated = measure(lambda: [build_command_task(cmd, task_factory) for cmd in commands])
+
+        print('\n{} command tasks: {:.3f} sec, {:.0f} bytes per task'.format(
+            len(tasks), seconds, allocated / float(len(tasks))))
+        assert_that(tasks).is_length(STAGES * JOBS_PER_STAGE * COMMANDS_PER_JOB)
+        assert_that(allocated / float(len(tasks))).is_less_than(768)
@@ -6,6 +6,21 @@ from tests import RESOURCES_ROOT
 example_yaml_path = os.path.join(RESOURCES_ROOT, 'agents/build/example.yaml')
 
 
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', default=False,
+                     help='run the benchmarks, which assert on wall time and memory')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+
+    skip = pytest.mark.skip(reason='benchmarks only run with --benchmark')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture(scope="session")
 def example_yaml():
     with open(example_yaml_path, 'r') as f:
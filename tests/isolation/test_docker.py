@@ -1,9 +1,18 @@
-from mock import Mock, call, create_autospec
+import socket
+import tarfile
+from io import BytesIO
+import threading
+import struct
+from mock import mock, Mock, call, create_autospec
 from assertpy import assert_that
 import pytest
 from docker import Client as DockerClient
+from docker.errors import NotFound
 from swarmci.docker import Container
-from swarmci.errors import DockerCommandFailedError
+from swarmci.watchdog import Watchdog
+from swarmci.errors import DockerCommandFailedError, TaskTimeoutError, ContainerDiedError, OutputMatchedError, \
+    ContainerAbortedError
+from swarmci.streams import compile_patterns
 
 
 container_init_defaults = {
@@ -22,6 +31,15 @@ def create_container_obj(docker_client, **kwargs):
     return Container(**options)
 
 
+def create_exec_socket(*chunks):
+    """:return: the driver's end of a socket on which docker sent chunks, then closed"""
+    driver_end, docker_end = socket.socketpair()
+    for chunk in chunks:
+        docker_end.sendall(chunk)
+    docker_end.close()
+    return driver_end
+
+
 def describe_container():
     def describe_init():
         def creates_container_from_docker_client():
@@ -46,6 +64,7 @@ def describe_container():
                                          host_config=expected_host_config,
                                          name=expected_name,
                                          environment=expected_env,
+                                         labels=None,
                                          command=expected_cmd)
 
             assert_that(subject.id).is_equal_to(expected_cn_id)
@@ -100,6 +119,48 @@ def describe_container():
 
                 docker_mock.stop.assert_called_once_with(container=expected_cn_id)
 
+    def describe_resource_usage():
+        def given_stats_interval():
+            def expect_usage_sampled_until_closed():
+                docker_mock = create_autospec(DockerClient, spec_set=True)
+                docker_mock.create_container.return_value = {'Id': '12345'}
+                docker_mock.stats.return_value = {'memory_stats': {'usage': 10, 'limit': 100}}
+
+                with create_container_obj(docker_mock, stats_interval=0.01) as cn:
+                    pass
+
+                assert_that(cn.resource_usage()).contains_entry({'memory_peak': 10}, {'memory_limit': 100})
+
+        def given_no_stats_interval():
+            def expect_none():
+                docker_mock = create_autospec(DockerClient, spec_set=True)
+                docker_mock.create_container.return_value = {'Id': '12345'}
+
+                assert_that(create_container_obj(docker_mock).resource_usage()).is_none()
+
+    def describe_get_file():
+        def given_file_missing():
+            def expect_none():
+                docker_mock = create_autospec(DockerClient, spec_set=True)
+                docker_mock.create_container.return_value = {'Id': '12345'}
+                docker_mock.get_archive.side_effect = NotFound('not found', response=Mock(status_code=404, content=b''))
+
+                assert_that(create_container_obj(docker_mock).get_file('/foo')).is_none()
+
+        def given_file_exists():
+            def expect_content_returned():
+                docker_mock = create_autospec(DockerClient, spec_set=True)
+                docker_mock.create_container.return_value = {'Id': '12345'}
+                data = BytesIO()
+                with tarfile.open(mode='w', fileobj=data) as t:
+                    info = tarfile.TarInfo('foo')
+                    info.size = 5
+                    t.addfile(info, BytesIO(b'hello'))
+                data.seek(0)
+                docker_mock.get_archive.return_value = (data, {})
+
+                assert_that(create_container_obj(docker_mock).get_file('/foo')).is_equal_to(b'hello')
+
     def describe_cp():
         # TODO finish tests for this
         pass
@@ -113,7 +174,7 @@ def describe_container():
             docker_mock.create_container.return_value = {'Id': expected_cn_id}
 
             docker_mock.exec_create.return_value = {'Id': 'e123'}
-            docker_mock.exec_start.return_value = []
+            docker_mock.exec_start.side_effect = lambda **kwargs: create_exec_socket()
             docker_mock.exec_inspect.return_value = {'ExitCode': 0}
 
             return docker_mock
@@ -128,10 +189,11 @@ def describe_container():
             create_container_obj(docker_client_fixture).execute('my_cmd')
 
             docker_client_fixture.exec_start \
-                .assert_called_once_with(exec_id='e123', stream=True)
+                .assert_called_once_with(exec_id='e123', socket=True)
 
         def expect_out_func_called_for_each_output_line(docker_client_fixture):
-            docker_client_fixture.exec_start.return_value = [b'line1', b'line2']
+            docker_client_fixture.exec_start.side_effect = None
+            docker_client_fixture.exec_start.return_value = create_exec_socket(b'line1\r\nli', b'ne2\r\n')
             mock_out_func = Mock()
 
             create_container_obj(docker_client_fixture).execute('my_cmd', mock_out_func)
@@ -153,3 +215,153 @@ def describe_container():
                 docker_client_fixture.exec_inspect.return_value = {'ExitCode': 0}
 
                 create_container_obj(docker_client_fixture).execute('my_cmd')
+
+        def given_tty_false():
+            @pytest.fixture(scope='function')
+            def exec_socket(docker_client_fixture):
+                docker_client_fixture.exec_start.side_effect = None
+                return create_exec_socket(*[struct.pack('>BxxxL', 1, len(payload)) + payload
+                                            for payload in [b'line1\nli', b'ne2\n']])
+
+            def expect_exec_created_without_tty(docker_client_fixture, exec_socket):
+                docker_client_fixture.exec_start.return_value = exec_socket
+
+                create_container_obj(docker_client_fixture, tty=False).execute('my_cmd')
+
+                docker_client_fixture.exec_create \
+                    .assert_called_once_with(container='c123', cmd='my_cmd', tty=False)
+                docker_client_fixture.exec_start \
+                    .assert_called_once_with(exec_id='e123', socket=True)
+
+            def expect_out_func_called_for_each_line(docker_client_fixture, exec_socket):
+                docker_client_fixture.exec_start.return_value = exec_socket
+                mock_out_func = Mock()
+
+                create_container_obj(docker_client_fixture, tty=False).execute('my_cmd', mock_out_func)
+
+                assert_that(mock_out_func.call_args_list).is_equal_to([call('line1'), call('line2')])
+
+            def expect_decoded_output_in_error(docker_client_fixture, exec_socket):
+                docker_client_fixture.exec_start.return_value = exec_socket
+                docker_client_fixture.exec_inspect.return_value = {'ExitCode': 1}
+
+                with pytest.raises(DockerCommandFailedError) as excinfo:
+                    create_container_obj(docker_client_fixture, tty=False).execute('my_cmd')
+
+                assert_that(excinfo.value.output).is_equal_to(['line1', 'line2'])
+
+        def given_fail_on_output():
+            def when_line_matches():
+                def expect_container_aborted_and_error_raised(docker_client_fixture):
+                    docker_client_fixture.exec_start.side_effect = None
+                    docker_client_fixture.exec_start.return_value = create_exec_socket(b'ok\nFATAL: doomed\n')
+                    cn = create_container_obj(docker_client_fixture, fail_on_output=compile_patterns(['FATAL']))
+
+                    with pytest.raises(OutputMatchedError) as excinfo:
+                        cn.execute('my_cmd')
+
+                    docker_client_fixture.kill.assert_called_once_with('c123')
+                    assert_that(str(excinfo.value)).is_equal_to(
+                        'command [my_cmd] printed a line matching fail_on_output: FATAL: doomed')
+
+        def given_log_archive():
+            def expect_command_and_raw_lines_archived(docker_client_fixture):
+                docker_client_fixture.exec_start.side_effect = None
+                docker_client_fixture.exec_start.return_value = create_exec_socket(b'line1\n')
+                log_archive = Mock()
+
+                create_container_obj(docker_client_fixture, log_archive=log_archive).execute('my_cmd')
+
+                assert_that(log_archive.write.call_args_list).is_equal_to([call(b'$ my_cmd'), call(b'line1')])
+
+        def given_event_monitor():
+            def expect_container_watched_until_closed(docker_client_fixture):
+                monitor = Mock()
+
+                cn = create_container_obj(docker_client_fixture, monitor=monitor)
+                cn.execute('my_cmd')
+                cn.close()
+
+                monitor.watch.assert_called_once_with(cn)
+                monitor.unwatch.assert_called_once_with(cn)
+                docker_client_fixture.exec_inspect.assert_called_once()
+
+        def given_container_dies_while_streaming():
+            def expect_stream_ended_and_died_error_raised(docker_client_fixture):
+                driver_end, docker_end = socket.socketpair()
+                docker_client_fixture.exec_start.side_effect = None
+                docker_client_fixture.exec_start.return_value = driver_end
+                cn = create_container_obj(docker_client_fixture)
+                timer = threading.Timer(0.05, lambda: cn.abort(ContainerDiedError('died'), kill=False))
+                timer.start()
+
+                try:
+                    with pytest.raises(ContainerDiedError):
+                        cn.execute('my_cmd')
+                finally:
+                    timer.join()
+                    docker_end.close()
+
+                docker_client_fixture.kill.assert_not_called()
+
+        def given_timeout():
+            def when_command_finishes_in_time():
+                def expect_timeout_cancelled(docker_client_fixture):
+                    watchdog = Mock()
+                    watchdog.schedule.return_value = 'handle'
+
+                    create_container_obj(docker_client_fixture, watchdog=watchdog).execute('my_cmd', timeout=5)
+
+                    watchdog.schedule.assert_called_once_with(5, mock.ANY)
+                    watchdog.cancel.assert_called_once_with('handle')
+
+            def when_command_times_out():
+                def expect_container_killed_and_timeout_raised(docker_client_fixture):
+                    def stream_until_killed(**kwargs):
+                        killed.wait(5)
+                        return create_exec_socket()
+
+                    killed = threading.Event()
+                    docker_client_fixture.kill.side_effect = lambda *args: killed.set()
+                    docker_client_fixture.exec_start.side_effect = stream_until_killed
+                    watchdog = Watchdog()
+
+                    with pytest.raises(TaskTimeoutError) as excinfo:
+                        create_container_obj(docker_client_fixture, watchdog=watchdog).execute('my_cmd', timeout=0.01)
+
+                    docker_client_fixture.kill.assert_called_once_with('c123')
+                    assert_that(str(excinfo.value)).is_equal_to('command [my_cmd] timed out after 0.01 sec')
+                    watchdog.stop()
+
+            def when_command_running_alongside_times_out():
+                def expect_other_command_aborted_naming_it(docker_client_fixture):
+                    def stream_until_killed(**kwargs):
+                        killed.wait(5)
+                        return create_exec_socket()
+
+                    def run(cmd, timeout=None):
+                        try:
+                            cn.execute(cmd, timeout=timeout)
+                        except Exception as exc:
+                            errors[cmd] = exc
+
+                    killed = threading.Event()
+                    errors = {}
+                    docker_client_fixture.kill.side_effect = lambda *args: killed.set()
+                    docker_client_fixture.exec_create.side_effect = [{'Id': 'e1'}, {'Id': 'e2'}]
+                    docker_client_fixture.exec_start.side_effect = stream_until_killed
+                    watchdog = Watchdog()
+                    cn = create_container_obj(docker_client_fixture, watchdog=watchdog)
+
+                    threads = [threading.Thread(target=run, args=('other',))]
+                    threads[0].start()
+                    threads.append(threading.Thread(target=run, args=('slow', 0.05)))
+                    threads[1].start()
+                    for thread in threads:
+                        thread.join(5)
+
+                    assert_that(errors['slow']).is_instance_of(TaskTimeoutError)
+                    assert_that(errors['other']).is_instance_of(ContainerAbortedError)
+                    assert_that(str(errors['other'])).is_equal_to(
+                        'command [other] was aborted: command [slow] timed out after 0.05 sec')
+                    watchdog.stop()
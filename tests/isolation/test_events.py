@@ -0,0 +1,107 @@
+import time
+from mock import Mock
+from assertpy import assert_that
+from swarmci.events import EventMonitor
+from swarmci.backends import DockerBackend
+from swarmci.errors import ContainerDiedError
+
+
+def create_event(action, container_id='c123', **attributes):
+    return {'Type': 'container', 'Action': action, 'status': action, 'id': container_id, 'time': 10,
+            'Actor': {'ID': container_id, 'Attributes': attributes}}
+
+
+def create_cn(cid='c123'):
+    cn = Mock(id=cid, closed=False, abort_error=None)
+    cn.name = 'swarmci_' + cid
+    return cn
+
+
+def create_watching_monitor(cn):
+    docker_mock = Mock()
+    docker_mock.events.return_value = iter([])
+    subject = EventMonitor(docker_mock, reconnect_delay=3600)
+    subject.watch(cn)
+    return subject
+
+
+def describe_event_monitor():
+    def describe_handle():
+        def given_container_died():
+            def expect_container_aborted():
+                cn = create_cn()
+                subject = create_watching_monitor(cn)
+
+                subject.handle(create_event('die', exitCode='137'))
+
+                error = cn.abort.call_args[0][0]
+                assert_that(error).is_instance_of(ContainerDiedError)
+                assert_that(str(error)).is_equal_to('container swarmci_c123 died unexpectedly with exit code 137')
+                assert_that(cn.abort.call_args[1]).is_equal_to({'kill': False})
+                subject.stop()
+
+            def when_killed_for_running_out_of_memory():
+                def expect_oom_reported():
+                    cn = create_cn()
+                    subject = create_watching_monitor(cn)
+
+                    subject.handle(create_event('oom'))
+                    subject.handle(create_event('die', exitCode='137'))
+
+                    assert_that(str(cn.abort.call_args[0][0])).contains('running out of memory')
+                    subject.stop()
+
+            def when_closed_by_the_driver():
+                def expect_container_not_aborted():
+                    cn = create_cn()
+                    cn.closed = True
+                    subject = create_watching_monitor(cn)
+
+                    subject.handle(create_event('die'))
+
+                    cn.abort.assert_not_called()
+                    subject.stop()
+
+            def when_not_watched():
+                def expect_event_ignored():
+                    cn = create_cn()
+                    subject = create_watching_monitor(cn)
+                    subject.unwatch(cn)
+
+                    subject.handle(create_event('die'))
+
+                    cn.abort.assert_not_called()
+                    subject.stop()
+
+    def describe_watch():
+        def expect_events_followed_with_a_client_of_its_own():
+            cn = create_cn()
+            cn.docker = Mock()
+            subject = EventMonitor(reconnect_delay=3600, url='tcp://127.0.0.1:1')
+            subject.stop()
+
+            subject.watch(cn)
+
+            assert_that(subject.docker).is_instance_of(DockerBackend)
+            assert_that(subject.docker.docker_url).is_equal_to('tcp://127.0.0.1:1')
+
+    def describe_run():
+        def given_event_stream_fails():
+            def expect_stream_reopened_from_last_event():
+                cn = create_cn()
+                docker_mock = Mock()
+                docker_mock.events.side_effect = [iter([create_event('start', 'other')]),
+                                                  Exception('connection reset'),
+                                                  iter([create_event('start', 'other')]),
+                                                  iter([])]
+                subject = EventMonitor(docker_mock, reconnect_delay=0.01)
+                subject.watch(cn)
+
+                for _ in range(500):
+                    if docker_mock.events.call_count >= 3:
+                        break
+                    time.sleep(0.01)
+                subject.stop()
+
+                assert_that(docker_mock.events.call_count).is_greater_than_or_equal_to(3)
+                assert_that(docker_mock.events.call_args_list[2][1]['since']).is_equal_to(10)
@@ -0,0 +1,147 @@
+import os
+from mock import Mock, create_autospec
+from assertpy import assert_that
+import pytest
+from docker import Client as DockerClient
+from swarmci.docker import Container
+from swarmci.errors import SwarmCIError
+from swarmci.gc import ContainerRegistry, collect, heartbeat_path, write_heartbeat, read_heartbeat, \
+    LABEL_BUILD_ID, LABEL_HOST, LABEL_LEASE
+
+
+def create_listed_container(cid, build_id='build1', lease=100.0, host='host1'):
+    return {'Id': cid, 'Labels': {LABEL_BUILD_ID: build_id, LABEL_HOST: host, LABEL_LEASE: str(lease)}}
+
+
+def create_docker_mock(containers):
+    docker_mock = create_autospec(DockerClient, spec_set=True)
+    docker_mock.containers.return_value = containers
+    return docker_mock
+
+
+def describe_container_registry():
+    def expect_labels_hold_build_host_and_lease():
+        subject = ContainerRegistry('build1', host='host1', lease_duration=60, tm=lambda: 100)
+
+        assert_that(subject.labels()).is_equal_to({LABEL_BUILD_ID: 'build1', LABEL_HOST: 'host1',
+                                                   LABEL_LEASE: '160.000'})
+
+    def expect_lease_renewed_on_the_driver_not_in_the_containers(tmpdir):
+        now = [100]
+        subject = ContainerRegistry('build1', lease_duration=60, heartbeat_interval=3600, tm=lambda: now[0],
+                                    lease_dir=str(tmpdir))
+        cn = Mock()
+        subject.add(cn)
+        assert_that(read_heartbeat(str(tmpdir), 'build1')).is_equal_to(160.0)
+
+        now[0] = 200
+        subject.renew()
+
+        assert_that(read_heartbeat(str(tmpdir), 'build1')).is_equal_to(260.0)
+        cn.put_archive.assert_not_called()
+        subject.discard(cn)
+        subject.stop()
+        assert_that(os.path.exists(heartbeat_path(str(tmpdir), 'build1'))).is_false()
+
+    def given_no_lease():
+        def expect_no_heartbeat_written(tmpdir):
+            subject = ContainerRegistry('build1', lease_dir=str(tmpdir), lease=False)
+            cn = Mock()
+            subject.add(cn)
+            subject.renew()
+
+            assert_that(subject.containers).is_equal_to([cn])
+            assert_that(tmpdir.listdir()).is_empty()
+            subject.stop()
+
+    def describe_teardown():
+        def expect_every_container_aborted_and_closed(tmpdir):
+            subject = ContainerRegistry('build1', heartbeat_interval=3600, lease_dir=str(tmpdir))
+            containers = [Mock(), Mock()]
+            for cn in containers:
+                subject.add(cn)
+
+            subject.teardown('received SIGTERM')
+
+            for cn in containers:
+                cn.abort.assert_called_once()
+                cn.close.assert_called_once_with()
+
+        def given_container_added_afterwards():
+            def expect_container_closed_and_error_raised():
+                subject = ContainerRegistry('build1')
+                subject.teardown('received SIGINT')
+                cn = Mock()
+
+                with pytest.raises(SwarmCIError):
+                    subject.add(cn)
+
+                cn.close.assert_called_once_with()
+                assert_that(subject.containers).is_empty()
+
+
+def describe_collect():
+    def expect_containers_with_expired_lease_removed(tmpdir):
+        write_heartbeat(str(tmpdir), 'build1', 100)
+        docker_mock = create_docker_mock([create_listed_container('expired'),
+                                          create_listed_container('leased', lease=300)])
+
+        removed = collect(docker_mock, tm=lambda: 200, host='host1', lease_dir=str(tmpdir))
+
+        assert_that(removed).is_equal_to(['expired'])
+        docker_mock.remove_container.assert_called_once_with(container='expired', v=True, force=True)
+
+    def given_no_heartbeat():
+        def expect_container_kept(tmpdir):
+            docker_mock = create_docker_mock([create_listed_container('unknown')])
+
+            assert_that(collect(docker_mock, tm=lambda: 200, host='host1', lease_dir=str(tmpdir))).is_empty()
+            docker_mock.remove_container.assert_not_called()
+
+        def expect_lease_renewed_elsewhere_kept(tmpdir):
+            registry = ContainerRegistry('build1', heartbeat_interval=3600, lease_dir=str(tmpdir.mkdir('a')))
+            registry.add(Mock())
+            docker_mock = create_docker_mock([create_listed_container('live')])
+
+            removed = collect(docker_mock, tm=lambda: 1e12, host='host1', lease_dir=str(tmpdir.mkdir('b')))
+
+            assert_that(removed).is_empty()
+            registry.stop()
+
+    def given_lease_renewed():
+        def expect_container_kept(tmpdir):
+            write_heartbeat(str(tmpdir), 'build1', 300)
+            docker_mock = create_docker_mock([create_listed_container('renewed')])
+
+            assert_that(collect(docker_mock, tm=lambda: 200, host='host1', lease_dir=str(tmpdir))).is_empty()
+
+    def given_container_of_another_host():
+        def expect_container_kept(tmpdir):
+            docker_mock = create_docker_mock([create_listed_container('remote', host='host2')])
+
+            assert_that(collect(docker_mock, tm=lambda: 200, host='host1', lease_dir=str(tmpdir))).is_empty()
+            docker_mock.remove_container.assert_not_called()
+
+    def given_excluded_build():
+        def expect_its_containers_kept(tmpdir):
+            docker_mock = create_docker_mock([create_listed_container('current', build_id='build2')])
+
+            assert_that(collect(docker_mock, exclude_build_ids={'build2'}, tm=lambda: 200, host='host1',
+                                lease_dir=str(tmpdir))).is_empty()
+            docker_mock.remove_container.assert_not_called()
+
+
+def describe_container_registration():
+    def expect_container_labelled_and_registered_until_closed(tmpdir):
+        docker_mock = create_autospec(DockerClient, spec_set=True)
+        docker_mock.create_container.return_value = {'Id': '12345'}
+        registry = ContainerRegistry('build1', heartbeat_interval=3600, lease_dir=str(tmpdir))
+
+        with Container('test_img', {}, docker_mock, registry=registry) as cn:
+            assert_that(registry.containers).is_equal_to([cn])
+            cn.close()
+
+        assert_that(docker_mock.create_container.call_args[1]['labels']).contains_key(LABEL_BUILD_ID)
+        assert_that(registry.containers).is_empty()
+        docker_mock.remove_container.assert_called_once_with(container='12345', v=True, force=True)
+        registry.stop()
@@ -1,14 +1,25 @@
 import pytest
+from mock import Mock
 from contextlib import contextmanager
 from io import StringIO
 import sys
 from assertpy import assert_that
 from swarmci import parse_args
 from swarmci.errors import SwarmCIError
-from swarmci import build_tasks_hierarchy
+from swarmci import build_tasks_hierarchy, build_command_task, build_job_task, get_weight
 from swarmci.task import Task, TaskType, TaskFactory
 
 
+def create_identical_jobs_config(dedupe=True):
+    job = {'image': 'foo', 'commands': ['test command']}
+    return {
+        'stages': [
+            {'name': 'first', 'jobs': [dict(job, name='a', dedupe=dedupe), dict(job, name='b', dedupe=dedupe)]},
+            {'name': 'second', 'jobs': [dict(job, name='c', dedupe=dedupe)]}
+        ]
+    }
+
+
 def describe_build_tasks_hierarchy():
     def given_no_stages():
         def expect_error_raised():
@@ -54,6 +65,101 @@ def describe_build_tasks_hierarchy():
         assert_that(task).is_instance_of(Task)
         assert_that(task.task_type).is_equal_to(TaskType.BUILD)
 
+    def given_job_with_parallelism():
+        def expect_one_job_task_per_shard():
+            config = {
+                'stages': [
+                    {
+                        'name': 'foo_stage',
+                        'jobs': [
+                            {
+                                'name': 'foo_job',
+                                'parallelism': 3,
+                                'shard': {'items': ['a', 'b', 'c']},
+                                'commands': [
+                                    'test command'
+                                ]
+                            }
+                        ]
+                    }
+                ]
+            }
+            task_factory = Mock(wraps=TaskFactory())
+
+            build_tasks_hierarchy(config, task_factory)
+
+            job_calls = [c for c in task_factory.create.call_args_list if c[0][0] is TaskType.JOB]
+            assert_that(job_calls).is_length(4)
+            assert_that(job_calls[-1][1]['shards']).is_length(3)
+
+    def given_identical_jobs():
+        def expect_later_jobs_reuse_the_first():
+            task_factory = Mock(wraps=TaskFactory())
+
+            build_tasks_hierarchy(create_identical_jobs_config(), task_factory)
+
+            job_calls = [c for c in task_factory.create.call_args_list if c[0][0] is TaskType.JOB]
+            originals = [c[1].get('duplicate_of') for c in job_calls]
+            assert_that(originals[0]).is_none()
+            assert_that(originals[1].name).is_equal_to('a')
+            assert_that(originals[2].name).is_equal_to('a')
+
+        def expect_dedupe_key_not_part_of_the_fingerprint():
+            task_factory = Mock(wraps=TaskFactory())
+            config = create_identical_jobs_config()
+            del config['stages'][0]['jobs'][0]['dedupe']
+
+            build_tasks_hierarchy(config, task_factory)
+
+            job_calls = [c for c in task_factory.create.call_args_list if c[0][0] is TaskType.JOB]
+            assert_that(job_calls[1][1].get('duplicate_of').name).is_equal_to('a')
+
+        def when_dedupe_disabled():
+            def expect_every_job_run():
+                task_factory = Mock(wraps=TaskFactory())
+
+                build_tasks_hierarchy(create_identical_jobs_config(dedupe=False), task_factory)
+
+                job_calls = [c for c in task_factory.create.call_args_list if c[0][0] is TaskType.JOB]
+                assert_that([c[1].get('duplicate_of') for c in job_calls]).is_equal_to([None, None, None])
+
+
+def describe_build_job_task():
+    def given_parallel_group_without_commands():
+        def expect_error_raised():
+            with pytest.raises(SwarmCIError):
+                build_job_task({'name': 'a', 'image': 'foo', 'commands': [{'parallel': True}]}, TaskFactory())
+
+    def given_invalid_fail_on_output():
+        def expect_error_raised():
+            with pytest.raises(SwarmCIError):
+                build_job_task({'name': 'foo', 'commands': [], 'fail_on_output': ['(']}, TaskFactory())
+
+
+def describe_get_weight():
+    def expect_weight_removed_from_config():
+        config = {'weight': 3, 'stages': []}
+        assert_that(get_weight(config)).is_equal_to(3)
+        assert_that(config).does_not_contain_key('weight')
+
+    def given_no_weight():
+        def expect_weight_of_one():
+            assert_that(get_weight({'stages': []})).is_equal_to(1)
+
+    def given_weight_not_positive():
+        def expect_error_raised():
+            with pytest.raises(SwarmCIError):
+                get_weight({'weight': 0})
+
+
+def describe_build_command_task():
+    def given_parallel_group():
+        def expect_group_of_buffered_commands():
+            task = build_command_task({'parallel': True, 'commands': ['lint', {'cmd': 'test', 'timeout': 5}]},
+                                      TaskFactory())
+
+            assert_that(task.task_type).is_equal_to(TaskType.GROUP)
+
 
 @contextmanager
 def capture_sys_output():
@@ -79,4 +185,31 @@ def describe_parse_args():
         def expect_file_set_in_output():
             expected_filename = 'foo.bar'
             actual_args = parse_args(['--file', expected_filename])
-            assert_that(actual_args.file).is_equal_to(expected_filename)
+            assert_that(actual_args.file).is_equal_to([expected_filename])
+
+        def given_several_files():
+            def expect_every_file_in_output():
+                actual_args = parse_args(['--file', 'a', '--file', 'b'])
+                assert_that(actual_args.file).is_equal_to(['a', 'b'])
+
+    def given_resume_option():
+        def expect_resume_set_in_output():
+            actual_args = parse_args(['--resume', 'build1'])
+            assert_that(actual_args.resume).is_equal_to(['build1'])
+
+    def given_simulate_command():
+        def expect_simulate_options_set_in_output():
+            actual_args = parse_args(['simulate', '--workers', '10', '--sweep-nodes', '1,2,4'])
+            assert_that(actual_args.command).is_equal_to('simulate')
+            assert_that(actual_args.workers).is_equal_to(10)
+            assert_that(actual_args.sweep_nodes).is_equal_to([1, 2, 4])
+
+    def given_no_command():
+        def expect_build_command_set_in_output():
+            assert_that(parse_args([]).command).is_equal_to('build')
+
+    def given_gc_command():
+        def expect_gc_command_set_in_output():
+            actual_args = parse_args(['gc', '--docker-url', 'tcp://manager:4000'])
+            assert_that(actual_args.command).is_equal_to('gc')
+            assert_that(actual_args.docker_url).is_equal_to('tcp://manager:4000')
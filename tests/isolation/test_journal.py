@@ -0,0 +1,95 @@
+import json
+import pytest
+from assertpy import assert_that
+from swarmci.errors import SwarmCIError
+from swarmci.task import Task, TaskType
+from swarmci.journal import Journal, input_hash, load
+
+
+def create_job_task(name='my_job', job_input_hash='abc', func=lambda: None):
+    return Task(name, TaskType.JOB, func, input_hash=job_input_hash)
+
+
+def describe_input_hash():
+    def expect_name_ignored():
+        assert_that(input_hash({'name': 'a', 'image': 'foo'})).is_equal_to(input_hash({'name': 'b', 'image': 'foo'}))
+
+    def expect_inputs_change_hash():
+        assert_that(input_hash({'image': 'foo', 'commands': ['x']}))\
+            .is_not_equal_to(input_hash({'image': 'foo', 'commands': ['y']}))
+
+    def given_workspace_manifest():
+        def expect_file_changes_change_hash():
+            job = {'image': 'foo', 'workspace': {'src': '.', 'dest': '/ws'}}
+
+            assert_that(input_hash(job, {'a.txt': '1:644'})).is_not_equal_to(input_hash(job, {'a.txt': '2:644'}))
+            assert_that(input_hash(job, {'a.txt': '1:644'})).is_not_equal_to(input_hash(job))
+
+
+def describe_journal():
+    def describe_record():
+        def expect_entry_appended(tmpdir):
+            subject = Journal(str(tmpdir), 'build1', tm=lambda: 10)
+            task = create_job_task()
+            task.execute()
+
+            subject.record(task)
+
+            entry = json.loads(tmpdir.join('build1.jsonl').read())
+            assert_that(entry).contains_entry({'id': task.id}, {'type': 'JOB'}, {'name': 'my_job'},
+                                              {'status': 'succeeded'}, {'input_hash': 'abc'}, {'time': 10},
+                                              {'duplicate_of': None})
+
+        def given_failed_task():
+            def expect_failed_status_and_error(tmpdir):
+                subject = Journal(str(tmpdir), 'build1')
+
+                def fail():
+                    raise Exception('boom')
+
+                task = create_job_task(func=fail)
+                task.execute()
+                subject.record(task)
+
+                assert_that(load(str(tmpdir), 'build1')[0]).contains_entry({'status': 'failed'}, {'error': 'boom'})
+
+    def describe_should_skip():
+        def given_no_resume():
+            def expect_false(tmpdir):
+                assert_that(Journal(str(tmpdir), 'build1').should_skip(create_job_task())).is_false()
+
+        def given_resume_from_missing_build():
+            def expect_error_raised(tmpdir):
+                with pytest.raises(SwarmCIError):
+                    Journal(str(tmpdir), 'build2', resume_from='build1')
+
+        def given_task_succeeded_in_resumed_build():
+            @pytest.fixture
+            def previous_build(tmpdir):
+                journal = Journal(str(tmpdir), 'build1')
+                task = create_job_task()
+                task.execute()
+                journal.record(task)
+                return str(tmpdir)
+
+            def when_inputs_unchanged():
+                def expect_true_and_recorded_as_skipped(previous_build):
+                    subject = Journal(previous_build, 'build2', resume_from='build1')
+                    task = create_job_task()
+
+                    assert_that(subject.should_skip(task)).is_true()
+
+                    task.execute()
+                    subject.record(task)
+                    assert_that(load(previous_build, 'build2')[0]['status']).is_equal_to('skipped')
+
+            def when_inputs_changed():
+                def expect_false(previous_build):
+                    subject = Journal(previous_build, 'build2', resume_from='build1')
+                    assert_that(subject.should_skip(create_job_task(job_input_hash='changed'))).is_false()
+
+    def describe_load():
+        def given_incomplete_last_line():
+            def expect_line_skipped(tmpdir):
+                tmpdir.join('build1.jsonl').write('{"name": "a"}\n{"name": ')
+                assert_that(load(str(tmpdir), 'build1')).is_equal_to([{'name': 'a'}])
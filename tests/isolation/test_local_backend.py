@@ -0,0 +1,156 @@
+import os
+import threading
+import pytest
+from assertpy import assert_that
+from docker.errors import NotFound, APIError
+from swarmci.backends import LocalBackend, DockerBackend, create_backend
+from swarmci.docker import Container
+from swarmci.errors import DockerCommandFailedError
+from swarmci.sync import WorkspaceSync
+
+
+def create_container(backend, tty=True):
+    return Container('ignored:latest', backend.create_host_config(), backend, name='local', tty=tty)
+
+
+def run(cn, cmd):
+    lines = []
+    cn.execute(cmd, out_func=lines.append)
+    return lines
+
+
+def describe_local_backend():
+    def describe_execute():
+        def given_tty():
+            def expect_output_returned():
+                backend = LocalBackend()
+                with create_container(backend) as cn:
+                    assert_that(run(cn, 'echo hello')).is_equal_to(['hello'])
+
+        def given_no_tty():
+            def expect_stdout_and_stderr_returned():
+                backend = LocalBackend()
+                with create_container(backend, tty=False) as cn:
+                    output = run(cn, ['sh', '-c', 'echo out; echo err >&2'])
+                assert_that(sorted(output)).is_equal_to(['err', 'out'])
+
+        def given_environment():
+            def expect_env_set():
+                backend = LocalBackend()
+                cn = Container('ignored:latest', backend.create_host_config(), backend, env={'FOO': 'bar'})
+                with cn:
+                    assert_that(run(cn, ['sh', '-c', 'echo $FOO'])).is_equal_to(['bar'])
+
+        def given_failing_command():
+            def expect_exit_code_raised():
+                backend = LocalBackend()
+                with create_container(backend) as cn:
+                    with pytest.raises(DockerCommandFailedError) as exc_info:
+                        cn.execute(['sh', '-c', 'echo failed; exit 3'])
+                assert_that(exc_info.value.exit_code).is_equal_to(3)
+                assert_that(exc_info.value.output).is_equal_to(['failed'])
+
+        def given_relative_paths():
+            def expect_resolved_in_scratch_dir():
+                backend = LocalBackend()
+                with create_container(backend) as cn:
+                    cn.execute(['sh', '-c', 'echo data > file.txt'])
+                    assert_that(cn.get_file('file.txt')).is_equal_to(b'data\n')
+
+    def describe_archive():
+        def expect_round_trip(tmpdir):
+            tmpdir.join('src.txt').write('content')
+            backend = LocalBackend()
+            with create_container(backend) as cn:
+                cn.cp(str(tmpdir.join('src.txt')), 'workspace')
+                assert_that(cn.get_file('workspace/src.txt')).is_equal_to(b'content')
+                assert_that(run(cn, 'cat workspace/src.txt')).is_equal_to(['content'])
+
+        def given_missing_path():
+            def expect_not_found():
+                backend = LocalBackend()
+                with create_container(backend) as cn:
+                    with pytest.raises(NotFound):
+                        backend.get_archive(cn.id, 'missing')
+                    assert_that(cn.get_file('missing')).is_none()
+
+        def given_path_outside_scratch_dir():
+            def expect_api_error(tmpdir):
+                backend = LocalBackend()
+                with create_container(backend) as cn:
+                    for path in (str(tmpdir), '../outside'):
+                        with pytest.raises(APIError):
+                            backend.put_archive(cn.id, path, b'')
+                        with pytest.raises(APIError):
+                            backend.get_archive(cn.id, path)
+
+            def expect_workspace_not_synced_to_the_host(tmpdir):
+                tmpdir.mkdir('src').join('a.txt').write('a')
+                dest = tmpdir.join('dest')
+                backend = LocalBackend()
+                with create_container(backend) as cn:
+                    with pytest.raises(APIError):
+                        WorkspaceSync().sync(cn, str(tmpdir.join('src')), str(dest))
+
+                assert_that(dest.check()).is_false()
+
+    def describe_workspace_sync():
+        def given_file_changed_by_a_command():
+            def expect_file_sent_again(tmpdir):
+                src = tmpdir.mkdir('src')
+                src.join('a.txt').write('a')
+                src.join('b.txt').write('b')
+                backend = LocalBackend()
+                sync = WorkspaceSync()
+                with create_container(backend) as cn:
+                    sync.sync(cn, str(src), 'ws')
+                    cn.execute(['sh', '-c', 'echo tampered > ws/a.txt'])
+
+                    assert_that(sync.sync(cn, str(src), 'ws')).is_equal_to((1, 0))
+                    assert_that(cn.get_file('ws/a.txt')).is_equal_to(b'a')
+
+    def describe_kill():
+        def expect_running_exec_ended():
+            backend = LocalBackend()
+            with create_container(backend) as cn:
+                errors = []
+                started = threading.Event()
+
+                def sleep():
+                    try:
+                        cn.execute(['sh', '-c', 'echo started; sleep 60'], out_func=lambda line: started.set())
+                    except DockerCommandFailedError as exc:
+                        errors.append(exc)
+
+                thread = threading.Thread(target=sleep)
+                thread.start()
+                assert_that(started.wait(10)).is_true()
+                backend.kill(cn.id)
+                thread.join(10)
+
+                assert_that(thread.is_alive()).is_false()
+                assert_that(errors).is_length(1)
+
+    def describe_remove_container():
+        def expect_scratch_dir_deleted():
+            backend = LocalBackend()
+            cn = create_container(backend)
+            root = backend.path(cn.id, '.')
+            assert_that(os.path.isdir(root)).is_true()
+
+            cn.close()
+
+            assert_that(os.path.exists(root)).is_false()
+            with pytest.raises(NotFound):
+                backend.start(cn.id)
+
+
+def describe_create_backend():
+    def expect_backend_by_name():
+        assert_that(create_backend('local')).is_instance_of(LocalBackend)
+        assert_that(create_backend('docker', 'tcp://manager:4000')).is_instance_of(DockerBackend)
+
+    def given_unknown_name():
+        def expect_value_error():
+            with pytest.raises(ValueError):
+                create_backend('kubernetes')
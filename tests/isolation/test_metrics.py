@@ -0,0 +1,94 @@
+from urllib.request import urlopen
+import pytest
+from assertpy import assert_that
+from swarmci import metrics
+from swarmci.metrics import Counter, Gauge, Histogram, Registry, write_textfile, serve
+from swarmci.task import Task, TaskType
+
+
+def describe_counter():
+    def expect_rendered_with_labels():
+        registry = Registry()
+        subject = Counter('my_total', 'help text', ['type'], registry=registry)
+
+        subject.inc(type='job')
+        subject.inc(2, type='job')
+
+        assert_that(registry.render()).is_equal_to(
+            '# HELP my_total help text\n# TYPE my_total counter\nmy_total{type="job"} 3.0\n')
+
+    def given_wrong_labels():
+        def expect_error_raised():
+            subject = Counter('my_total', 'help text', ['type'], registry=False)
+            with pytest.raises(ValueError):
+                subject.inc(foo='bar')
+
+    def expect_label_values_escaped():
+        subject = Counter('my_total', 'help text', ['name'], registry=False)
+        subject.inc(name='say "hi"\n')
+        assert_that(subject.render()[-1]).is_equal_to(r'my_total{name="say \"hi\"\n"} 1.0')
+
+
+def describe_gauge():
+    def expect_inc_and_dec():
+        subject = Gauge('my_gauge', 'help text', registry=False)
+        subject.inc()
+        subject.inc()
+        subject.dec()
+        assert_that(subject.get()).is_equal_to(1)
+
+
+def describe_histogram():
+    def expect_cumulative_buckets_sum_and_count():
+        subject = Histogram('my_seconds', 'help text', registry=False, buckets=(1, 5))
+        subject.observe(0.5)
+        subject.observe(3)
+        subject.observe(10)
+
+        assert_that(subject.render()[2:]).is_equal_to([
+            'my_seconds_bucket{le="1.0"} 1.0',
+            'my_seconds_bucket{le="5.0"} 2.0',
+            'my_seconds_bucket{le="+Inf"} 3.0',
+            'my_seconds_sum 13.5',
+            'my_seconds_count 3.0'])
+
+    def expect_time_observes_block():
+        subject = Histogram('my_seconds', 'help text', ['operation'], registry=False)
+        with subject.time(operation='create'):
+            pass
+        assert_that(subject.get(operation='create')[0][0]).is_equal_to(1)
+
+
+def describe_write_textfile():
+    def expect_metrics_written(tmpdir):
+        registry = Registry()
+        Gauge('my_gauge', 'help text', registry=registry).set(4)
+        path = str(tmpdir.join('swarmci.prom'))
+
+        write_textfile(path, registry)
+
+        assert_that(tmpdir.join('swarmci.prom').read()).contains('my_gauge 4.0')
+        assert_that(tmpdir.listdir()).is_length(1)
+
+
+def describe_serve():
+    def expect_metrics_served():
+        registry = Registry()
+        Gauge('my_gauge', 'help text', registry=registry).set(4)
+
+        server = serve(0, registry=registry)
+        try:
+            body = urlopen('http://127.0.0.1:{}/metrics'.format(server.server_port)).read().decode()
+        finally:
+            server.shutdown()
+
+        assert_that(body).contains('my_gauge 4.0')
+
+
+def describe_task_outcomes():
+    def expect_task_outcome_counted():
+        before = metrics.TASKS.get(type='stage', outcome='succeeded') or 0
+
+        Task('foo', TaskType.STAGE, lambda: None).execute()
+
+        assert_that(metrics.TASKS.get(type='stage', outcome='succeeded')).is_equal_to(before + 1)
@@ -0,0 +1,82 @@
+import logging
+import pstats
+import threading
+from assertpy import assert_that
+from swarmci import profiling
+from swarmci.profiling import Profiler, TimedLock
+
+
+def busy_worker(stop):
+    while not stop.is_set():
+        stop.wait(0.001)
+
+
+def describe_profiler():
+    def describe_sample():
+        def expect_stacks_of_other_threads_recorded():
+            stop = threading.Event()
+            worker = threading.Thread(target=busy_worker, args=(stop,), name='worker')
+            worker.start()
+
+            subject = Profiler()
+            subject.sample()
+            stop.set()
+            worker.join()
+
+            threads = [stack[0] for stack in subject.stacks]
+            assert_that(threads).contains('worker')
+            assert_that(subject.samples).is_equal_to(1)
+
+    def describe_write():
+        def expect_pstats_collapsed_and_waits_written(tmpdir):
+            stop = threading.Event()
+            worker = threading.Thread(target=busy_worker, args=(stop,), name='worker')
+            worker.start()
+
+            subject = Profiler()
+            subject.sample()
+            subject.record_wait('my lock', 0.5)
+            stop.set()
+            worker.join()
+
+            path = str(tmpdir.join('profile'))
+            subject.write(path)
+
+            stats = pstats.Stats(path)
+            assert_that([func[2] for func in stats.stats]).contains('busy_worker')
+            assert_that(tmpdir.join('profile.collapsed').read()).matches(r'worker;.*busy_worker')
+            assert_that(tmpdir.join('profile.waits').read()).starts_with('my lock: 1 waits, total 0.5000 sec')
+
+    def describe_start():
+        def expect_logging_lock_waits_recorded():
+            handler = logging.StreamHandler()
+            test_logger = logging.getLogger('swarmci.test_profiling')
+            test_logger.addHandler(handler)
+            original_lock = handler.lock
+
+            try:
+                with Profiler(interval=1) as subject:
+                    handler.handle(logging.LogRecord('foo', logging.DEBUG, 'foo', 1, 'bar', None, None))
+            finally:
+                test_logger.removeHandler(handler)
+
+            assert_that(handler.lock).is_same_as(original_lock)
+            assert_that(subject.waits).contains_key('logging lock (StreamHandler)')
+
+        def expect_module_record_wait_forwarded():
+            with Profiler(interval=1) as subject:
+                profiling.record_wait('thread pool queue', 0.1)
+
+            profiling.record_wait('thread pool queue', 0.1)
+            assert_that(subject.waits['thread pool queue'][0]).is_equal_to(1)
+
+
+def describe_timed_lock():
+    def expect_wait_recorded_on_acquire():
+        subject = Profiler()
+        lock = TimedLock(threading.RLock(), 'my lock', subject)
+
+        with lock:
+            pass
+
+        assert_that(subject.waits).contains_key('my lock')
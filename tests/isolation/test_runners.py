@@ -5,9 +5,11 @@ from pytest_describe import behaves_like
 from docker import Client as DockerClient
 from concurrent.futures import ThreadPoolExecutor
 from swarmci.docker import Container
-from swarmci.task import Task
+from swarmci.task import Task, TaskType
 from swarmci.runners import SerialRunner, ThreadedRunner, DockerRunner
-from swarmci.errors import TaskFailedError
+from swarmci.stats import summarize, parse_stats
+from swarmci.streams import OutputSink
+from swarmci.errors import TaskFailedError, TaskTimeoutError
 
 
 def create_task_mock(count=1):
@@ -111,6 +113,30 @@ def describe_threaded_runner():
                     task1_mock.execute.assert_called_once()
                     task2_mock.execute.assert_called_once()
 
+        def given_task_after_others():
+            def expect_it_runs_once_they_have_ended():
+                order = []
+                first = Task('first', TaskType.JOB, lambda: order.append('first'))
+                second = Task('second', TaskType.JOB, lambda: order.append('second'))
+                subject = Task('subject', TaskType.JOB, lambda: order.append('subject'))
+                subject.after = (first, second)
+
+                with ThreadPoolExecutor(max_workers=1) as thread_pool_executor:
+                    ThreadedRunner(thread_pool_executor).run_all([subject])
+
+                assert_that(order).is_equal_to(['first', 'second', 'subject'])
+
+            def expect_no_worker_held_while_waiting():
+                # with a single worker, a task waiting on a worker for the tasks it runs after would never end
+                tasks = [Task('shard{}'.format(i), TaskType.JOB, lambda: None) for i in range(3)]
+                subject = Task('subject', TaskType.JOB, lambda: None)
+                subject.after = tuple(tasks)
+
+                with ThreadPoolExecutor(max_workers=1) as thread_pool_executor:
+                    ThreadedRunner(thread_pool_executor).run_all([subject] + tasks)
+
+                assert_that([t.successful for t in tasks + [subject]]).is_equal_to([True] * 4)
+
 
 @behaves_like(a_runner, a_serial_runner)
 def describe_docker_runner():
@@ -133,7 +159,16 @@ def describe_docker_runner():
         def expect_command_executed_in_container(cn_fixture):
             expected_command = 'test task'
             DockerRunner.run_in_docker(expected_command, cn=cn_fixture)
-            cn_fixture.execute.assert_called_once_with(expected_command)
+            cn_fixture.execute.assert_called_once_with(expected_command, timeout=None)
+
+        def given_sink():
+            def expect_output_collected_in_sink(cn_fixture):
+                sink = OutputSink('test task')
+                cn_fixture.execute.side_effect = lambda cmd, out_func, timeout: out_func('line1')
+
+                lines = DockerRunner.run_in_docker('test task', cn=cn_fixture, sink=sink)
+
+                assert_that(lines).is_equal_to(['line1'])
 
     def describe_run_all_container_behavior():
 
@@ -146,3 +181,34 @@ def describe_docker_runner():
 
             subject.run_all([task_fixture])
             task_fixture.execute.assert_called_once_with(cn=mock.ANY)
+
+        def given_stats_interval():
+            def expect_resource_usage_in_results(cn_fixture, task_fixture):
+                docker_mock = create_autospec(DockerClient, spec_set=True)
+                task_fixture.successful = True
+                cn = cn_fixture.return_value.__enter__.return_value
+                expected_usage = summarize([parse_stats({}, 1)])
+                cn.resource_usage.return_value = expected_usage
+
+                subject = DockerRunner('foo_image', docker=docker_mock, cn=cn_fixture, stats_interval=5)
+                results = subject.run_all([task_fixture])
+
+                cn_fixture.assert_called_once_with('foo_image', mock.ANY, docker_mock, env={}, stats_interval=5,
+                                                   tty=True, registry=subject.registry, monitor=subject.monitor,
+                                                   fail_on_output=None, log_archive=None)
+                assert_that(results['resource_usage']).is_equal_to(expected_usage)
+
+        def given_job_times_out():
+            def expect_raises_task_timeout_error(cn_fixture, task_fixture):
+                docker_mock = create_autospec(DockerClient, spec_set=True)
+                task_fixture.successful = False
+                cn = cn_fixture.return_value.__enter__.return_value
+                cn.abort_error = TaskTimeoutError('job timed out')
+
+                subject = DockerRunner('foo_image', docker=docker_mock, cn=cn_fixture, timeout=10)
+
+                with pytest.raises(TaskTimeoutError):
+                    subject.run_all([task_fixture])
+
+                cn.set_timeout.assert_called_once_with(10, mock.ANY)
+                cn.cancel_timeout.assert_called_once_with(cn.set_timeout.return_value)
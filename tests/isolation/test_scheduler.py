@@ -0,0 +1,64 @@
+import threading
+from assertpy import assert_that
+import pytest
+from swarmci.scheduler import FairShareExecutor
+
+
+def run_in_order(subject, submissions):
+    """
+    blocks the only worker while the tasks are submitted, then releases it
+    :param submissions: a list of (queue, label) tuples
+    :return: the labels, in the order their tasks ran
+    """
+    gate = threading.Event()
+    order = []
+    subject.queue('gate').submit(gate.wait, 5)
+    futures = [q.submit(order.append, label) for q, label in submissions]
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    return order
+
+
+def describe_fair_share_executor():
+    def expect_result_returned_by_future():
+        subject = FairShareExecutor(2)
+        try:
+            assert_that(subject.queue('a').submit(lambda x: x * 2, 21).result(timeout=5)).is_equal_to(42)
+        finally:
+            subject.shutdown()
+
+    def expect_exception_raised_by_future():
+        subject = FairShareExecutor(1)
+        try:
+            with pytest.raises(ZeroDivisionError):
+                subject.queue('a').submit(lambda: 1 / 0).result(timeout=5)
+        finally:
+            subject.shutdown()
+
+    def given_big_and_small_build():
+        def expect_small_build_not_starved():
+            subject = FairShareExecutor(1)
+            big, small = subject.queue('big'), subject.queue('small')
+            try:
+                order = run_in_order(subject, [(big, 'big')] * 10 + [(small, 'small')] * 2)
+            finally:
+                subject.shutdown()
+
+            assert_that(order[0:4]).is_equal_to(['big', 'small', 'big', 'small'])
+
+    def given_weighted_builds():
+        def expect_workers_shared_by_weight():
+            subject = FairShareExecutor(1)
+            heavy, light = subject.queue('heavy', weight=2), subject.queue('light', weight=1)
+            try:
+                order = run_in_order(subject, [(heavy, 'heavy')] * 10 + [(light, 'light')] * 10)
+            finally:
+                subject.shutdown()
+
+            assert_that(order[0:9].count('heavy')).is_equal_to(6)
+
+    def given_weight_not_positive():
+        def expect_error_raised():
+            with pytest.raises(ValueError):
+                FairShareExecutor(1).queue('a', weight=0)
@@ -0,0 +1,103 @@
+import json
+import pytest
+from assertpy import assert_that
+from mock import Mock
+from swarmci.errors import SwarmCIError
+from swarmci.sharding import get_parallelism, load_timings, partition, split_job, aggregate
+
+
+def describe_get_parallelism():
+    def given_no_parallelism():
+        def expect_1():
+            assert_that(get_parallelism({'name': 'foo'})).is_equal_to(1)
+
+    def given_parallelism_less_than_1():
+        def expect_error_raised():
+            with pytest.raises(SwarmCIError):
+                get_parallelism({'name': 'foo', 'parallelism': 0})
+
+    def given_parallelism_not_a_number():
+        def expect_error_raised():
+            with pytest.raises(SwarmCIError):
+                get_parallelism({'name': 'foo', 'parallelism': 'bar'})
+
+
+def describe_load_timings():
+    def given_missing_file():
+        def expect_empty_timings(tmpdir):
+            assert_that(load_timings(str(tmpdir.join('nope.json')))).is_empty()
+
+    def given_timings_file():
+        def expect_timings_loaded(tmpdir):
+            path = tmpdir.join('timings.json')
+            path.write(json.dumps({'a.py': 2, 'b.py': 1.5}))
+            assert_that(load_timings(str(path))).is_equal_to({'a.py': 2.0, 'b.py': 1.5})
+
+
+def describe_partition():
+    def expect_one_bucket_per_shard():
+        assert_that(partition(['a', 'b', 'c'], 5)).is_length(5)
+
+    def expect_every_item_assigned_once():
+        items = ['item{}'.format(i) for i in range(20)]
+        shards = partition(items, 3)
+        assigned = [i for shard_items, _ in shards for i in shard_items]
+        assert_that(sorted(assigned)).is_equal_to(sorted(items))
+
+    def given_timings():
+        def expect_shards_balanced_by_time():
+            timings = {'slow': 10, 'medium1': 5, 'medium2': 5, 'fast1': 1, 'fast2': 1}
+            shards = partition(list(timings), 2, timings)
+
+            estimates = sorted(estimate for _, estimate in shards)
+            assert_that(estimates).is_equal_to([11.0, 11.0])
+
+        def expect_unknown_items_use_average():
+            shards = partition(['known', 'unknown'], 1, {'known': 4})
+            assert_that(shards[0][1]).is_equal_to(8.0)
+
+
+def describe_split_job():
+    def expect_shard_env_set():
+        job = {'name': 'tests', 'parallelism': 2, 'env': {'foo': 'bar'},
+               'shard': {'items': ['a.py', 'b.py', 'c.py']}, 'commands': ['run']}
+
+        shard_jobs = split_job(job)
+
+        assert_that(shard_jobs).is_length(2)
+        assert_that(shard_jobs[1]['name']).is_equal_to('tests [shard 2/2]')
+        assert_that(shard_jobs[1]['env']).contains_entry({'foo': 'bar'}, {'SWARMCI_SHARD_INDEX': '1'},
+                                                         {'SWARMCI_SHARD_COUNT': '2'})
+        assert_that(shard_jobs[0]['env']['SWARMCI_SHARD_ITEMS'].split('\n')).is_length(2)
+        assert_that(shard_jobs[1]).does_not_contain_key('parallelism')
+
+    def given_items_with_spaces():
+        def expect_items_separated_by_newlines():
+            job = {'name': 'tests', 'parallelism': 1, 'shard': {'items': ['a b.py', 'c.py']}, 'commands': ['run']}
+
+            items = split_job(job)[0]['env']['SWARMCI_SHARD_ITEMS']
+
+            assert_that(sorted(items.split('\n'))).is_equal_to(['a b.py', 'c.py'])
+
+    def given_fewer_items_than_shards():
+        def expect_empty_shards_skipped():
+            job = {'name': 'tests', 'parallelism': 4, 'shard': {'items': ['a.py', 'b.py']}, 'commands': ['run']}
+
+            shard_jobs = split_job(job)
+
+            assert_that([j['name'] for j in shard_jobs]).is_equal_to(['tests [shard 1/2]', 'tests [shard 2/2]'])
+            assert_that([j['env']['SWARMCI_SHARD_COUNT'] for j in shard_jobs]).is_equal_to(['2', '2'])
+
+    def given_no_items():
+        def expect_every_shard_created():
+            assert_that(split_job({'name': 'tests', 'parallelism': 3, 'commands': ['run']})).is_length(3)
+
+
+def describe_aggregate():
+    def expect_result_per_shard():
+        task_mock = Mock(successful=True, runtime=3, error=None)
+        shard_job = {'shard': {'index': 0, 'count': 1, 'items': ['a.py'], 'estimate': 1.0}}
+
+        results = aggregate([(shard_job, task_mock)])
+
+        assert_that(results[0]).contains_entry({'items': ['a.py']}, {'successful': True}, {'runtime': 3})
@@ -0,0 +1,138 @@
+import json
+import pytest
+from assertpy import assert_that
+from swarmci.errors import SwarmCIError
+from swarmci.simulate import CapacityModel, SimJob, build_plan, load_runtimes, simulate, sweep, format_report
+
+
+def create_config(*stages):
+    return {'stages': [{'name': 'stage{}'.format(i), 'jobs': jobs} for i, jobs in enumerate(stages)]}
+
+
+def describe_build_plan():
+    def expect_recorded_runtimes_used():
+        config = create_config([{'name': 'a', 'image': 'img'}, {'name': 'b', 'image': 'img'}])
+
+        plan, missing = build_plan(config, {'a': 10}, default_runtime=5)
+
+        assert_that([job.runtime for job in plan[0][1]]).is_equal_to([10, 5])
+        assert_that([job.estimated for job in plan[0][1]]).is_equal_to([False, True])
+        assert_that(missing).is_equal_to(['b'])
+
+    def given_sharded_job():
+        def expect_runtime_split_across_shards():
+            config = create_config([{'name': 'a', 'image': 'img', 'parallelism': 4}])
+
+            plan, _ = build_plan(config, {'a': 100})
+
+            assert_that(plan[0][1][0].shard_runtimes).is_equal_to([25.0] * 4)
+
+        def given_shards_recorded():
+            def expect_recorded_shards_used_whatever_their_count():
+                config = create_config([{'name': 'a', 'image': 'img', 'parallelism': 5}])
+                runtimes = {'a [shard 2/5]': 290.0, 'a [shard 1/5]': 300.0}
+
+                plan, missing = build_plan(config, runtimes)
+
+                assert_that(plan[0][1][0].shard_runtimes).is_equal_to([300.0, 290.0])
+                assert_that(plan[0][1][0].runtime).is_equal_to(300.0)
+                assert_that(missing).is_empty()
+
+            def given_job_no_longer_sharded():
+                def expect_shard_runtimes_summed():
+                    config = create_config([{'name': 'a', 'image': 'img'}])
+
+                    plan, missing = build_plan(config, {'a [shard 1/2]': 30.0, 'a [shard 2/2]': 20.0})
+
+                    assert_that(plan[0][1][0].runtime).is_equal_to(50.0)
+                    assert_that(missing).is_empty()
+
+    def given_stages_not_a_list():
+        def expect_error_raised():
+            with pytest.raises(SwarmCIError):
+                build_plan({'stages': 'foo'}, {})
+
+
+def describe_load_runtimes():
+    def expect_runtimes_loaded_from_file(tmpdir):
+        path = tmpdir.join('runtimes.json')
+        path.write(json.dumps({'a': 3}))
+        assert_that(load_runtimes(str(path))).is_equal_to({'a': 3.0})
+
+    def expect_runtimes_loaded_from_journal(tmpdir):
+        tmpdir.join('build1.jsonl').write('\n'.join(json.dumps(e) for e in [
+            {'type': 'JOB', 'name': 'a', 'status': 'succeeded', 'runtime': 7},
+            {'type': 'COMMAND', 'name': 'cmd', 'status': 'succeeded', 'runtime': 1},
+            {'type': 'JOB', 'name': 'b', 'status': 'skipped', 'runtime': 0}]))
+
+        assert_that(load_runtimes(journal_dir=str(tmpdir), build_id='build1')).is_equal_to({'a': 7.0})
+
+    def given_sharded_job_in_journal():
+        def expect_only_its_shards_loaded(tmpdir):
+            tmpdir.join('build1.jsonl').write('\n'.join(json.dumps(e) for e in [
+                {'type': 'JOB', 'name': 'a [shard 1/5]', 'status': 'succeeded', 'runtime': 300},
+                {'type': 'JOB', 'name': 'a [shard 2/5]', 'status': 'succeeded', 'runtime': 290},
+                {'type': 'JOB', 'name': 'a', 'status': 'succeeded', 'runtime': 0.001}]))
+
+            assert_that(load_runtimes(journal_dir=str(tmpdir), build_id='build1'))\
+                .is_equal_to({'a [shard 1/5]': 300.0, 'a [shard 2/5]': 290.0})
+
+
+def describe_simulate():
+    def expect_stages_run_one_after_another():
+        plan = [('s1', [SimJob('a', 'img', 10), SimJob('b', 'img', 20)]), ('s2', [SimJob('c', 'img', 5)])]
+
+        result = simulate(plan, CapacityModel())
+
+        assert_that(result.wall_time).is_equal_to(25)
+        assert_that([job.name for _, job in result.critical_path]).is_equal_to(['b', 'c'])
+
+    def given_fewer_workers_than_jobs():
+        def expect_jobs_queued():
+            plan = [('s1', [SimJob(name, 'img', 10) for name in 'abc'])]
+
+            result = simulate(plan, CapacityModel(max_workers=2))
+
+            assert_that(result.wall_time).is_equal_to(20)
+            assert_that(result.critical_path[0][1].wait_time).is_equal_to(10)
+
+    def given_pull_time_and_overhead():
+        def expect_image_pulled_once_per_node():
+            plan = [('s1', [SimJob('a', 'img', 10, estimated=True)]), ('s2', [SimJob('b', 'img', 10, estimated=True)])]
+
+            result = simulate(plan, CapacityModel(pull_time=5, container_overhead=1))
+
+            assert_that(result.wall_time).is_equal_to(27)
+
+        def given_recorded_runtimes():
+            def expect_overhead_not_added_again():
+                plan = [('s1', [SimJob('a', 'img', 10)]), ('s2', [SimJob('b', 'img', 10)])]
+
+                result = simulate(plan, CapacityModel(pull_time=5, container_overhead=1))
+
+                assert_that(result.wall_time).is_equal_to(25)
+
+    def given_sharded_job():
+        def expect_each_shard_takes_a_worker():
+            plan = [('s1', [SimJob('a', 'img', 10, shard_runtimes=[10, 10, 10])])]
+
+            assert_that(simulate(plan, CapacityModel(max_workers=1)).wall_time).is_equal_to(30)
+            assert_that(simulate(plan, CapacityModel(max_workers=3, slots_per_node=2)).wall_time).is_equal_to(20)
+
+
+def describe_sweep():
+    def expect_result_per_combination():
+        plan = [('s1', [SimJob(name, 'img', 10) for name in 'abcd'])]
+
+        results = sweep(plan, CapacityModel(slots_per_node=2), workers=[2, 4], nodes=[1, 2])
+
+        assert_that(results).is_equal_to([(2, 1, 20), (2, 2, 20), (4, 1, 20), (4, 2, 10)])
+
+    def expect_report_includes_sweep_and_critical_path():
+        plan = [('s1', [SimJob('a', 'img', 10)])]
+        model = CapacityModel()
+
+        lines = format_report(simulate(plan, model), sweep(plan, model, workers=[1]), missing=['a'])
+
+        assert_that(lines[1]).is_equal_to('Predicted wall time - 0 min 10.00 sec')
+        assert_that(lines).contains('Critical path:', 'Sweep:')
@@ -0,0 +1,87 @@
+from mock import Mock
+from assertpy import assert_that
+from swarmci.stats import ResourceSampler, parse_stats, get_limits, summarize, format_report
+
+
+def create_stats(total_usage=200, pre_total_usage=100, system=2000, pre_system=1000, memory=50, max_usage=80):
+    return {
+        'cpu_stats': {'cpu_usage': {'total_usage': total_usage, 'percpu_usage': [0, 0]},
+                      'system_cpu_usage': system},
+        'precpu_stats': {'cpu_usage': {'total_usage': pre_total_usage}, 'system_cpu_usage': pre_system},
+        'memory_stats': {'usage': memory, 'max_usage': max_usage, 'limit': 1000},
+        'blkio_stats': {'io_service_bytes_recursive': [{'op': 'Read', 'value': 10},
+                                                       {'op': 'Write', 'value': 20},
+                                                       {'op': 'Total', 'value': 30}]},
+        'networks': {'eth0': {'rx_bytes': 5, 'tx_bytes': 6}, 'eth1': {'rx_bytes': 1, 'tx_bytes': 1}}
+    }
+
+
+def describe_parse_stats():
+    def expect_cpu_usage_in_cores():
+        sample = parse_stats(create_stats(), 1)
+        assert_that(sample['cpu']).is_equal_to(0.2)
+
+    def expect_io_summed():
+        sample = parse_stats(create_stats(), 1)
+        assert_that(sample).contains_entry({'block_read': 10}, {'block_write': 20}, {'net_rx': 6}, {'net_tx': 7})
+
+    def given_no_previous_cpu_sample():
+        def expect_zero_cpu():
+            stats = create_stats(pre_total_usage=0, pre_system=0)
+            stats['precpu_stats'] = {}
+            assert_that(parse_stats(stats, 1)['cpu']).is_equal_to(0.0)
+
+        def expect_zero_cpu_without_system_delta():
+            assert_that(parse_stats(create_stats(system=1000), 1)['cpu']).is_equal_to(0.0)
+
+
+def describe_get_limits():
+    def given_cpu_quota_and_memory():
+        def expect_limits_returned():
+            assert_that(get_limits({'CpuQuota': 50000, 'Memory': 1024})).is_equal_to((0.5, 1024))
+
+    def given_no_limits():
+        def expect_none():
+            assert_that(get_limits({})).is_equal_to((None, None))
+
+
+def describe_summarize():
+    def given_no_samples():
+        def expect_none():
+            assert_that(summarize([])).is_none()
+
+    def expect_peak_and_average():
+        samples = [parse_stats(create_stats(memory=50, max_usage=50), 1),
+                   parse_stats(create_stats(memory=150, max_usage=150, total_usage=500), 2)]
+
+        usage = summarize(samples, cpu_limit=2.0)
+
+        assert_that(usage).contains_entry({'memory_peak': 150}, {'memory_avg': 100.0},
+                                          {'cpu_limit': 2.0}, {'memory_limit': 1000})
+        assert_that(usage['cpu_peak']).is_equal_to(0.8)
+
+    def expect_report_formatted():
+        usage = summarize([parse_stats(create_stats(), 1)])
+        assert_that(format_report('my_job', usage)).starts_with('Resource Usage - my_job - cpu peak 0.20')
+
+
+def describe_resource_sampler():
+    def expect_sample_appended():
+        docker_mock = Mock()
+        docker_mock.stats.return_value = create_stats()
+
+        subject = ResourceSampler(docker_mock, 'c123', 1, tm=lambda: 7)
+        subject.sample()
+
+        docker_mock.stats.assert_called_once_with('c123', stream=False)
+        assert_that(subject.samples[0]['time']).is_equal_to(7)
+
+    def expect_samples_until_stopped():
+        docker_mock = Mock()
+        docker_mock.stats.return_value = create_stats()
+
+        subject = ResourceSampler(docker_mock, 'c123', 0.01)
+        subject.start()
+        subject.stop()
+
+        assert_that(subject.samples).is_not_empty()
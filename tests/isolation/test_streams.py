@@ -0,0 +1,112 @@
+import gzip
+import struct
+import pytest
+from assertpy import assert_that
+from swarmci.errors import SwarmCIError
+from swarmci.streams import Demuxer, LineSplitter, LogArchive, compile_patterns, iter_lines, STDOUT, STDERR
+
+
+def frame(stream, payload):
+    return struct.pack('>BxxxL', stream, len(payload)) + payload
+
+
+def describe_demuxer():
+    def expect_frames_returned_with_stream():
+        data = frame(STDOUT, b'out') + frame(STDERR, b'err')
+        assert_that(Demuxer().feed(data)).is_equal_to([(STDOUT, b'out'), (STDERR, b'err')])
+
+    def given_chunk_ends_within_header():
+        def expect_frame_carried_over():
+            data = frame(STDOUT, b'hello')
+            subject = Demuxer()
+
+            assert_that(subject.feed(data[:3])).is_empty()
+            assert_that(subject.pending).is_equal_to(3)
+            assert_that(subject.feed(data[3:])).is_equal_to([(STDOUT, b'hello')])
+            assert_that(subject.pending).is_equal_to(0)
+
+    def given_chunk_ends_within_payload():
+        def expect_frame_carried_over():
+            data = frame(STDOUT, b'hello') + frame(STDOUT, b'world')
+            subject = Demuxer()
+
+            assert_that(subject.feed(data[:10])).is_equal_to([])
+            assert_that(subject.feed(data[10:])).is_equal_to([(STDOUT, b'hello'), (STDOUT, b'world')])
+
+
+def describe_line_splitter():
+    def expect_complete_lines_returned():
+        assert_that(LineSplitter().feed(b'a\nb\r\nc')).is_equal_to([b'a', b'b'])
+
+    def given_line_split_across_chunks():
+        def expect_partial_line_carried_over():
+            subject = LineSplitter()
+
+            assert_that(subject.feed(b'hel')).is_empty()
+            assert_that(subject.feed(b'lo\nwor')).is_equal_to([b'hello'])
+            assert_that(subject.feed(b'ld\n')).is_equal_to([b'world'])
+            assert_that(subject.flush()).is_none()
+
+    def given_multibyte_character_split_across_chunks():
+        def expect_line_intact():
+            data = u'café\n'.encode('utf-8')
+            subject = LineSplitter()
+
+            lines = subject.feed(data[:4]) + subject.feed(data[4:])
+
+            assert_that(lines[0].decode('utf-8')).is_equal_to(u'café')
+
+    def expect_trailing_partial_line_flushed():
+        subject = LineSplitter()
+        subject.feed(b'no newline')
+        assert_that(subject.flush()).is_equal_to(b'no newline')
+
+
+def describe_iter_lines():
+    def expect_lines_split_per_stream():
+        data = frame(STDOUT, b'out1\nou') + frame(STDERR, b'err1\n') + frame(STDOUT, b't2\nlast')
+        chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+
+        assert_that(list(iter_lines(chunks))).is_equal_to([
+            (STDOUT, b'out1'), (STDERR, b'err1'), (STDOUT, b'out2'), (STDOUT, b'last')])
+
+
+def describe_compile_patterns():
+    def expect_any_pattern_matched_on_bytes():
+        subject = compile_patterns(['FATAL', r'Segmentation fault \(core'])
+
+        assert_that(subject.search(b'[12:00] FATAL: disk full')).is_not_none()
+        assert_that(subject.search(b'Segmentation fault (core dumped)')).is_not_none()
+        assert_that(subject.search(b'all good')).is_none()
+
+    def given_no_patterns():
+        def expect_none():
+            assert_that(compile_patterns(None)).is_none()
+
+    def given_invalid_pattern():
+        def expect_error_raised():
+            with pytest.raises(SwarmCIError):
+                compile_patterns(['('])
+
+
+def describe_log_archive():
+    def expect_lines_written_gzipped(tmpdir):
+        path = str(tmpdir.join('logs', 'job.log.gz'))
+        subject = LogArchive(path)
+        subject.write(b'line1')
+        subject.write(b'line2')
+        subject.close()
+
+        with gzip.open(path, 'rb') as f:
+            assert_that(f.read()).is_equal_to(b'line1\nline2\n')
+
+    def given_existing_archive():
+        def expect_lines_appended(tmpdir):
+            path = str(tmpdir.join('job.log.gz'))
+            for line in [b'first', b'second']:
+                subject = LogArchive(path)
+                subject.write(line)
+                subject.close()
+
+            with gzip.open(path, 'rb') as f:
+                assert_that(f.read()).is_equal_to(b'first\nsecond\n')
@@ -0,0 +1,122 @@
+import json
+import tarfile
+import pytest
+from mock import Mock
+from assertpy import assert_that
+from swarmci.docker import Container
+from swarmci.sync import HashCache, WorkspaceSync, build_manifest, diff, MANIFEST_NAME
+
+
+@pytest.fixture
+def workspace(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('a.txt').write('a')
+    src.mkdir('sub').join('b.txt').write('b')
+    return src
+
+
+def create_cn_mock(remote_manifest=None, changed=()):
+    """a container holding the files of remote_manifest, except for the changed ones"""
+    cn = Mock(spec=Container)
+    cn.name = 'test_cn'
+    cn.get_file.return_value = None if remote_manifest is None else json.dumps(remote_manifest).encode('utf-8')
+    cn.put_archive.side_effect = lambda dest, f: setattr(cn, 'sent', tarfile.open(fileobj=f).getnames())
+
+    def execute(cmd, out_func=None, **kwargs):
+        if cmd[0] == 'sh':
+            paths = cmd[5:]
+            files = [(p, remote_manifest[p].split(':')) for p in paths if p not in changed]
+            for line in ['{} {}'.format(mode, p) for p, (_, mode) in files] + ['--'] + \
+                    ['{}  {}'.format(sha, p) for p, (sha, _) in files]:
+                out_func(line)
+
+    cn.execute.side_effect = execute
+    return cn
+
+
+def describe_diff():
+    def expect_changed_added_and_deleted_paths():
+        changed, deleted = diff({'a': '1', 'b': '2', 'c': '3'}, {'a': '1', 'b': 'old', 'd': '4'})
+
+        assert_that(changed).is_equal_to(['b', 'c'])
+        assert_that(deleted).is_equal_to(['d'])
+
+
+def describe_build_manifest():
+    def expect_digest_per_file(workspace):
+        manifest = build_manifest(str(workspace), HashCache())
+        assert_that(manifest).contains_only('a.txt', 'sub/b.txt')
+
+    def given_same_content():
+        def expect_same_digest(workspace):
+            workspace.join('c.txt').write('a')
+            manifest = build_manifest(str(workspace), HashCache())
+            assert_that(manifest['c.txt']).is_equal_to(manifest['a.txt'])
+
+    def given_unchanged_files():
+        def expect_files_hashed_once(workspace, tmpdir):
+            cache_path = str(tmpdir.join('hashes.json'))
+            cache = HashCache(cache_path)
+            build_manifest(str(workspace), cache)
+            cache.save()
+
+            reloaded = HashCache(cache_path)
+            build_manifest(str(workspace), reloaded)
+
+            assert_that(cache.hashed).is_equal_to(2)
+            assert_that(reloaded.hashed).is_equal_to(0)
+
+
+def describe_workspace_sync():
+    def given_fresh_target():
+        def expect_all_files_and_manifest_sent(workspace):
+            cn = create_cn_mock()
+            subject = WorkspaceSync()
+
+            assert_that(subject.sync(cn, str(workspace), '/ws')).is_equal_to((2, 0))
+
+            cn.execute.assert_called_once_with(['mkdir', '-p', '/ws'])
+            assert_that(cn.sent).is_equal_to(['a.txt', 'sub/b.txt', MANIFEST_NAME])
+            subject.close()
+
+    def given_target_with_manifest():
+        def expect_only_delta_sent_and_deletions_applied(workspace):
+            manifest = build_manifest(str(workspace), HashCache())
+            workspace.join('a.txt').write('changed')
+            cn = create_cn_mock(dict(manifest, **{'gone.txt': 'x'}))
+            subject = WorkspaceSync()
+
+            assert_that(subject.sync(cn, str(workspace), '/ws/')).is_equal_to((1, 1))
+
+            cn.execute.assert_called_with(['rm', '-rf', '--', '/ws/gone.txt'])
+            assert_that(cn.sent).is_equal_to(['a.txt', MANIFEST_NAME])
+            subject.close()
+
+        def when_nothing_changed():
+            def expect_nothing_sent(workspace):
+                cn = create_cn_mock(build_manifest(str(workspace), HashCache()))
+
+                assert_that(WorkspaceSync().sync(cn, str(workspace), '/ws')).is_equal_to((0, 0))
+                cn.put_archive.assert_not_called()
+                assert_that(cn.execute.call_args[1]).contains_entry({'internal': True})
+
+        def when_file_changed_in_container():
+            def expect_file_sent_again(workspace):
+                cn = create_cn_mock(build_manifest(str(workspace), HashCache()), changed={'sub/b.txt'})
+
+                assert_that(WorkspaceSync().sync(cn, str(workspace), '/ws')).is_equal_to((1, 0))
+                assert_that(cn.sent).is_equal_to(['sub/b.txt', MANIFEST_NAME])
+
+    def given_jobs_needing_same_delta():
+        def expect_delta_built_once(workspace, tmpdir):
+            delta_dir = tmpdir.mkdir('deltas')
+            subject = WorkspaceSync(tmp_dir=str(delta_dir))
+            cn1, cn2 = create_cn_mock(), create_cn_mock()
+
+            subject.sync(cn1, str(workspace), '/ws')
+            subject.sync(cn2, str(workspace), '/ws')
+
+            assert_that(delta_dir.listdir()).is_length(1)
+            assert_that(cn2.sent).is_equal_to(cn1.sent)
+            subject.close()
+            assert_that(delta_dir.listdir()).is_empty()
@@ -1,7 +1,12 @@
+import os
+import threading
 from mock import Mock, call
 from assertpy import assert_that
 import pytest
-from swarmci.task import Task, TaskType, TaskFactory
+from swarmci import metrics
+from swarmci.task import Task, TaskType, TaskFactory, LazyTasks
+from swarmci.streams import OutputSink
+from swarmci.errors import DockerCommandFailedError, TaskFailedError
 
 
 def dummy_func(): pass
@@ -51,6 +56,12 @@ def describe_task():
                 parent_mock.assert_has_calls([call.time(), call.exec_func(), call.time()])
                 assert_that(subject.runtime).is_equal_to(4)
 
+            def expect_listeners_called_with_task():
+                listener = Mock()
+                subject = Task('foo', TaskType.JOB, Mock(), listeners=[listener])
+                subject.execute()
+                listener.assert_called_once_with(subject)
+
             def expect_args_kwargs_passed_to_exec_func():
                 exec_func_mock = Mock()
                 subject = Task('foo', TaskType.JOB, exec_func_mock)
@@ -60,6 +71,26 @@ def describe_task():
                 exec_func_mock.assert_called_once_with(*exp_args, **exp_kwargs)
 
 
+def describe_lazy_tasks():
+    def expect_tasks_created_only_when_reached():
+        create = Mock(side_effect=lambda spec: Task(spec, TaskType.COMMAND, dummy_func))
+        subject = LazyTasks(['a', 'b'], create)
+
+        assert_that(subject).is_length(2)
+        create.assert_not_called()
+        assert_that(next(iter(subject)).name).is_equal_to('a')
+        create.assert_called_once_with('a')
+
+    def expect_same_tasks_on_every_pass():
+        subject = LazyTasks(['a', 'b'], lambda spec: Task(spec, TaskType.COMMAND, dummy_func))
+
+        first_pass = list(subject)
+
+        assert_that(list(subject)).is_equal_to(first_pass)
+        assert_that(subject[0]).is_same_as(first_pass[0])
+        assert_that(subject[-1]).is_same_as(first_pass[1])
+
+
 def describe_task_factory():
     def describe_create():
         @pytest.mark.parametrize(['task_type', 'kwargs'], [
@@ -72,3 +103,176 @@ def describe_task_factory():
             task = TaskFactory().create(task_type, **kwargs)
             assert_that(task.task_type).is_equal_to(task_type)
             assert_that(callable(task.exec_func)).is_true()
+
+    def describe_create_sharded_job_task():
+        def expect_shard_results_aggregated_into_job():
+            shard_jobs = [{'shard': {'index': i, 'count': 2, 'items': [str(i)], 'estimate': 1.0}} for i in range(2)]
+            shard_tasks = [Task('shard{}'.format(i), TaskType.JOB, Mock()) for i in range(2)]
+
+            subject = TaskFactory().create(TaskType.JOB, job={'name': 'test'}, commands=[],
+                                           shards=list(zip(shard_jobs, shard_tasks)))
+            for shard_task in shard_tasks:
+                shard_task.execute()
+            subject.execute()
+
+            assert_that(subject.after).is_equal_to(tuple(shard_tasks))
+            assert_that(subject.successful).is_true()
+            assert_that(subject.results).is_length(2)
+            assert_that([r['successful'] for r in subject.results]).is_equal_to([True, True])
+
+        def given_a_shard_fails():
+            def expect_job_fails_with_results():
+                shard_jobs = [{'shard': {'index': i, 'count': 2, 'items': [str(i)], 'estimate': 1.0}} for i in range(2)]
+                shard_tasks = [Task('shard0', TaskType.JOB, Mock()),
+                               Task('shard1', TaskType.JOB, Mock(side_effect=Exception('boom')))]
+
+                subject = TaskFactory().create(TaskType.JOB, job={'name': 'test'}, commands=[],
+                                               shards=list(zip(shard_jobs, shard_tasks)))
+                for shard_task in shard_tasks:
+                    shard_task.execute()
+                subject.execute()
+
+                assert_that(subject.successful).is_false()
+                assert_that([r['successful'] for r in subject.results]).is_equal_to([True, False])
+
+    def describe_create_job_task():
+        def expect_runner_given_the_build_registry_and_docker_url():
+            runner = Mock()
+            registry = Mock()
+
+            TaskFactory(runners={'job': runner}, registry=registry, docker_url='tcp://manager:4000')\
+                .create(TaskType.JOB, job={'name': 'test', 'image': 'foo'}, commands=[]).execute()
+
+            assert_that(runner.call_args[1]).contains_entry({'registry': registry}, {'url': 'tcp://manager:4000'})
+
+        def given_names_alike_in_a_file_name():
+            def expect_separate_log_files(tmpdir):
+                runner = Mock()
+                factory = TaskFactory(runners={'job': runner}, log_dir=str(tmpdir))
+
+                for name in ('a b', 'a/b'):
+                    factory.create(TaskType.JOB, job={'name': name, 'image': 'foo'}, commands=[]).execute()
+
+                paths = [c[1]['log_path'] for c in runner.call_args_list]
+                assert_that(set(paths)).is_length(2)
+                assert_that([os.path.dirname(p) for p in paths]).is_equal_to([str(tmpdir)] * 2)
+
+        def given_workspace():
+            def expect_input_hash_changed_with_its_files(tmpdir):
+                src = tmpdir.mkdir('src')
+                src.join('a.txt').write('a')
+                job = {'name': 'test', 'image': 'foo', 'workspace': {'src': str(src), 'dest': '/ws'}}
+
+                before = TaskFactory().create(TaskType.JOB, job=job, commands=[]).input_hash
+                src.join('a.txt').write('changed')
+                after = TaskFactory().create(TaskType.JOB, job=job, commands=[]).input_hash
+
+                assert_that(after).is_not_equal_to(before)
+
+        def given_journal_says_skip():
+            def expect_runner_not_used():
+                journal = Mock()
+                journal.should_skip.return_value = True
+                runner = Mock()
+
+                subject = TaskFactory(runners={'job': runner}, journal=journal)\
+                    .create(TaskType.JOB, job={'name': 'test', 'image': 'foo'}, commands=[])
+                subject.execute()
+
+                assert_that(subject.successful).is_true()
+                runner.assert_not_called()
+                journal.record.assert_called_once_with(subject)
+
+    def describe_create_duplicate_job_task():
+        def expect_outcome_and_results_of_original_reused():
+            runner = Mock()
+            runner.return_value.run_all.return_value = ['output']
+            factory = TaskFactory(runners={'job': runner})
+            original = factory.create(TaskType.JOB, job={'name': 'a', 'image': 'foo'}, commands=[])
+
+            subject = factory.create(TaskType.JOB, job={'name': 'b', 'image': 'foo'}, commands=[],
+                                     duplicate_of=original)
+            original.execute()
+            subject.execute()
+
+            assert_that(subject.successful).is_true()
+            assert_that(subject.results).is_equal_to(original.results)
+            assert_that(subject.duplicate_of).is_equal_to('a')
+            runner.assert_called_once()
+
+        def expect_it_runs_after_the_original():
+            original = Task('a', TaskType.JOB, dummy_func)
+            subject = TaskFactory().create(TaskType.JOB, job={'name': 'b'}, commands=[], duplicate_of=original)
+            assert_that(subject.after).is_equal_to((original,))
+
+        def given_original_has_not_run():
+            def expect_duplicate_fails_without_waiting():
+                original = Task('a', TaskType.JOB, dummy_func)
+                subject = TaskFactory().create(TaskType.JOB, job={'name': 'b'}, commands=[], duplicate_of=original)
+
+                subject.execute()
+
+                assert_that(subject.successful).is_false()
+                assert_that(str(subject.error)).is_equal_to('identical job a has not run')
+
+        def given_original_fails():
+            def expect_duplicate_fails():
+                original = Task('a', TaskType.JOB, Mock(side_effect=Exception('boom')))
+                subject = TaskFactory().create(TaskType.JOB, job={'name': 'b'}, commands=[], duplicate_of=original)
+
+                original.execute()
+                subject.execute()
+
+                assert_that(subject.successful).is_false()
+                assert_that(subject.error).is_instance_of(TaskFailedError)
+
+    def describe_create_command_group_task():
+        def expect_commands_run_concurrently_in_container():
+            barrier = threading.Barrier(2, timeout=5)
+            run_func = Mock(side_effect=lambda cmd, **kwargs: (barrier.wait(), [cmd])[1])
+            factory = TaskFactory()
+            commands = [factory.create(TaskType.COMMAND, cmd=cmd, run_func=run_func, buffered=True)
+                        for cmd in ['lint', 'test']]
+
+            subject = factory.create(TaskType.GROUP, commands=commands)
+            subject.execute(cn='my_cn')
+
+            assert_that(subject.successful).is_true()
+            assert_that([r['output'] for r in subject.results]).is_equal_to([['lint'], ['test']])
+            for c in run_func.call_args_list:
+                assert_that(c[1]).contains_entry({'cn': 'my_cn'})
+                assert_that(c[1]['sink']).is_instance_of(OutputSink)
+
+        def expect_workers_counted_apart_from_the_executor():
+            busy = []
+
+            def run_func(cmd, **kwargs):
+                busy.append((metrics.GROUP_BUSY_WORKERS.get(), metrics.EXECUTOR_BUSY_WORKERS.get()))
+                return []
+
+            factory = TaskFactory()
+            executor_busy = metrics.EXECUTOR_BUSY_WORKERS.get()
+            subject = factory.create(TaskType.GROUP, commands=[factory.create(TaskType.COMMAND, cmd='lint',
+                                                                              run_func=run_func, buffered=True)])
+            subject.execute(cn='my_cn')
+
+            assert_that(busy).is_equal_to([(1, executor_busy)])
+            assert_that(metrics.GROUP_BUSY_WORKERS.get()).is_equal_to(0)
+
+        def given_a_command_fails():
+            def expect_group_fails_with_exit_status_per_command():
+                def run_func(cmd, **kwargs):
+                    if cmd == 'test':
+                        raise DockerCommandFailedError(message='failed', exit_code=3, cmd=cmd, output=['boom'])
+                    return []
+
+                factory = TaskFactory()
+                commands = [factory.create(TaskType.COMMAND, cmd=cmd, run_func=run_func, buffered=True)
+                            for cmd in ['lint', 'test']]
+
+                subject = factory.create(TaskType.GROUP, commands=commands)
+                subject.execute(cn='my_cn')
+
+                assert_that(subject.successful).is_false()
+                assert_that([r['exit_code'] for r in subject.results]).is_equal_to([0, 3])
+                assert_that(subject.results[1]['output']).is_equal_to(['boom'])
@@ -0,0 +1,21 @@
+import pytest
+from assertpy import assert_that
+from swarmci.util import parse_duration
+
+
+def describe_parse_duration():
+    @pytest.mark.parametrize(['value', 'expected'], [
+        [None, None],
+        [90, 90.0],
+        ['1.5', 1.5],
+        ['30s', 30.0],
+        ['10m', 600.0],
+        ['1h', 3600.0]
+    ])
+    def expect_seconds_returned(value, expected):
+        assert_that(parse_duration(value)).is_equal_to(expected)
+
+    @pytest.mark.parametrize('value', ['soon', '-1', 0])
+    def given_invalid_duration(value):
+        with pytest.raises(ValueError):
+            parse_duration(value)
@@ -0,0 +1,54 @@
+import threading
+from mock import Mock
+from assertpy import assert_that
+from swarmci.watchdog import Watchdog
+
+
+def describe_watchdog():
+    def describe_schedule():
+        def expect_callback_called_after_timeout():
+            fired = threading.Event()
+            subject = Watchdog()
+
+            subject.schedule(0.01, fired.set)
+
+            assert_that(fired.wait(5)).is_true()
+            subject.stop()
+
+        def expect_callbacks_called_in_deadline_order():
+            calls = []
+            done = threading.Event()
+            subject = Watchdog()
+
+            subject.schedule(0.05, lambda: (calls.append('late'), done.set()))
+            subject.schedule(0.01, lambda: calls.append('early'))
+
+            done.wait(5)
+            assert_that(calls).is_equal_to(['early', 'late'])
+            subject.stop()
+
+        def given_callback_raises():
+            def expect_later_callbacks_still_called():
+                fired = threading.Event()
+                subject = Watchdog()
+
+                subject.schedule(0.01, Mock(side_effect=Exception('boom')))
+                subject.schedule(0.02, fired.set)
+
+                assert_that(fired.wait(5)).is_true()
+                subject.stop()
+
+    def describe_cancel():
+        def expect_callback_not_called():
+            callback = Mock()
+            fired = threading.Event()
+            subject = Watchdog()
+
+            handle = subject.schedule(0.01, callback)
+            subject.cancel(handle)
+            subject.schedule(0.02, fired.set)
+
+            fired.wait(5)
+            callback.assert_not_called()
+            assert_that(subject.pending).is_equal_to(0)
+            subject.stop()